@@ -0,0 +1,184 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""A bank of pre-generated augmentation parameters, for reproducible test-time augmentation.
+
+For each image of a split, the bank holds num_sets parameter sets, one per replica: the crop box
+(normalized [ymin, xmin, ymax, xmax], relative to the image), the horizontal flip, the ordering and
+the factors of the color distortions, and the number of 90o turns (see
+dermatologic_preprocessing.preprocess_batch_for_train()). The parameters are drawn from a seeded
+NumPy generator, with the same distributions of the random preprocessing, and stored in a .npz file
+next to the dataset, keyed by the split, number of sets, seed, crop ranges, and by the names, sizes
+and modification times of the dataset files, so it is rebuilt whenever any of those changes.
+
+Repeated runs with the same bank evaluate exactly the same replicas of each image, so their results
+are reproducible and comparable, and the sampling of the crops leaves the evaluation graph. The
+boxes are relative to the image, so if the images are resized (e.g., by an image_cache.ImageCache)
+the crops cover the same regions, but their aspect ratios change with the aspect of the image.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import os
+import pickle
+
+import numpy as np
+import tensorflow as tf
+
+from . import tf_data_provider
+
+_BANK_VERSION = 1
+_MIN_OBJECT_COVERED = 0.1
+_MAX_ATTEMPTS = 100
+
+
+def _bank_key(dataset, split_name, num_sets, seed, aspect_ratio_range, area_range):
+  data_files = []
+  for data_file in tf_data_provider.get_data_files(dataset):
+    data_stat = os.stat(data_file)
+    data_files.append((os.path.basename(data_file), data_stat.st_size, int(data_stat.st_mtime)))
+  return {
+      'version'            : _BANK_VERSION,
+      'split_name'         : split_name,
+      'num_sets'           : num_sets,
+      'seed'               : seed,
+      'aspect_ratio_range' : tuple(float(r) for r in aspect_ratio_range),
+      'area_range'         : tuple(float(r) for r in area_range),
+      'data_files'         : data_files,
+    }
+
+
+def default_bank_path(dataset_dir, split_name, num_sets, seed):
+  """Returns the path of the bank next to the dataset."""
+  return os.path.join(dataset_dir, 'augmentation_bank_%s_%d_%d.npz' % (split_name, num_sets, seed))
+
+
+def _read_image_sizes(dataset):
+  """Returns the ids, heights and widths of the images, parsed from the records without decoding."""
+  ids = []
+  sizes = []
+  for data_file in tf_data_provider.get_data_files(dataset):
+    for record in tf.python_io.tf_record_iterator(data_file):
+      features = tf.train.Example.FromString(record).features.feature
+      ids.append(features['meta/id'].bytes_list.value[0])
+      sizes.append((features['height'].int64_list.value[0], features['width'].int64_list.value[0]))
+  return ids, np.asarray(sizes, dtype=np.int64).reshape([-1, 2])
+
+
+def sample_box(random, image_height, image_width, aspect_ratio_range, area_range):
+  """Samples a crop box with the constraints of tf.image.sample_distorted_bounding_box.
+
+  As in preprocess_batch_for_train(), the crop must cover at least 10% of the (whole) image, and
+  after 100 failed attempts the whole image is returned.
+  """
+  image_area = float(image_height * image_width)
+  min_area = max(area_range[0], _MIN_OBJECT_COVERED) * image_area
+  max_area = area_range[1] * image_area
+  for _ in range(_MAX_ATTEMPTS):
+    aspect_ratio = random.uniform(*aspect_ratio_range)
+    min_height = int(round(math.sqrt(min_area / aspect_ratio)))
+    max_height = int(round(math.sqrt(max_area / aspect_ratio)))
+    if int(round(max_height * aspect_ratio)) > image_width:
+      max_height = int(image_width / aspect_ratio)
+    max_height = min(max_height, image_height)
+    if min_height > max_height:
+      continue
+    height = random.randint(min_height, max_height + 1)
+    width = int(round(height * aspect_ratio))
+    if width * height < min_area:
+      height += 1
+      width = int(round(height * aspect_ratio))
+    area = width * height
+    if area < min_area or area > max_area or width <= 0 or height <= 0 or \
+        width > image_width or height > image_height:
+      continue
+    y = random.randint(0, image_height - height + 1)
+    x = random.randint(0, image_width - width + 1)
+    return [ y / image_height, x / image_width, (y + height) / image_height, (x + width) / image_width ]
+  return [ 0.0, 0.0, 1.0, 1.0 ]
+
+
+def _generate(image_sizes, num_sets, seed, aspect_ratio_range, area_range):
+  random = np.random.RandomState(seed)
+  num_rows = image_sizes.shape[0] * num_sets
+  boxes = np.empty([num_rows, 4], dtype=np.float32)
+  for r in range(num_rows):
+    boxes[r] = sample_box(random, image_sizes[r // num_sets, 0], image_sizes[r // num_sets, 1],
+                          aspect_ratio_range, area_range)
+  # Same distributions as dermatologic_preprocessing.sample_color_factors()
+  color_factors = np.stack([ random.uniform(-32. / 255., 32. / 255., num_rows),
+                             random.uniform(0.5, 1.5, num_rows),
+                             random.uniform(-0.2, 0.2, num_rows),
+                             random.uniform(0.5, 1.5, num_rows) ], axis=1).astype(np.float32)
+  shape = [ image_sizes.shape[0], num_sets ]
+  return {
+      'boxes'         : boxes.reshape(shape + [ 4 ]),
+      'flips'         : (random.uniform(size=num_rows) < 0.5).reshape(shape),
+      'orderings'     : random.randint(0, 4, num_rows).astype(np.int32).reshape(shape),
+      'color_factors' : color_factors.reshape(shape + [ 4 ]),
+      'turns'         : random.randint(0, 4, num_rows).astype(np.int32).reshape(shape),
+    }
+
+
+class AugmentationBank(object):
+  """The augmentation bank of one split, generated on the first use.
+
+  Args:
+    bank_path: the .npz file of the bank (see default_bank_path()).
+    dataset: a slim Dataset, as returned by dataset_factory.get_dataset().
+    split_name: the name of the split, part of the key.
+    num_sets: the number of parameter sets (replicas) per image.
+    seed: the seed of the generator.
+    aspect_ratio_range: the range of the aspect ratios of the crops.
+    area_range: the range of the relative areas of the crops.
+  """
+
+  _PARAMS = [ 'boxes', 'flips', 'orderings', 'color_factors', 'turns' ]
+
+  def __init__(self, bank_path, dataset, split_name, num_sets, seed,
+               aspect_ratio_range=(0.66, 1.52), area_range=(0.20, 1.0)):
+    self.key = _bank_key(dataset, split_name, num_sets, seed, aspect_ratio_range, area_range)
+    self.path = bank_path
+    self.num_sets = num_sets
+    bank = None
+    if os.path.exists(bank_path):
+      bank = np.load(bank_path)
+      if pickle.loads(bank['key'].tobytes())!=self.key:
+        tf.logging.info('Augmentation bank %s is outdated', bank_path)
+        bank = None
+      else:
+        tf.logging.info('Using augmentation bank %s', bank_path)
+    if bank is None:
+      tf.logging.info('Generating augmentation bank %s', bank_path)
+      ids, image_sizes = _read_image_sizes(dataset)
+      bank = _generate(image_sizes, num_sets, seed, aspect_ratio_range, area_range)
+      bank['ids'] = np.asarray(ids, dtype=bytes)
+      bank['key'] = np.frombuffer(pickle.dumps(self.key), dtype=np.uint8)
+      # Written to a temporary file (one per process, since the tasks of a sharded run may generate
+      # the same bank at once), and renamed when complete
+      temp_path = '%s.tmp%d' % (bank_path, os.getpid())
+      with open(temp_path, 'wb') as bank_file:
+        np.savez(bank_file, **bank)
+      os.rename(temp_path, bank_path)
+      bank = np.load(bank_path)
+    self._params = { name : bank[name] for name in self._PARAMS }
+    self._rows = { image_id : r for r, image_id in enumerate(bank['ids']) }
+    if len(self._rows)!=len(bank['ids']):
+      raise ValueError('the ids of the images are not unique, cannot use an augmentation bank')
+
+  def _lookup(self, image_id):
+    row = self._rows[image_id]
+    return [ self._params[name][row] for name in self._PARAMS ]
+
+  def lookup(self, image_id):
+    """Returns the dict of (fixed) augmentation parameters of the image with the (scalar tensor) id.
+
+    The dict can be passed as the augmentation_params of preprocess_batch_for_train().
+    """
+    dtypes = [ tf.as_dtype(self._params[name].dtype) for name in self._PARAMS ]
+    tensors = tf.py_func(self._lookup, [ image_id ], dtypes, stateful=False,
+                         name='augmentation_bank_lookup')
+    for tensor, name in zip(tensors, self._PARAMS):
+      tensor.set_shape(self._params[name].shape[1:])
+    return dict(zip(self._PARAMS, tensors))
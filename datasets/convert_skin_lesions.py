@@ -27,7 +27,9 @@ from __future__ import division
 from __future__ import print_function
 
 import glob
+import hashlib
 import math
+import multiprocessing
 import os
 import pickle
 import sys
@@ -48,6 +50,11 @@ _RANDOM_SEED = 0
 
 _DELIMITER = ';'
 
+_MANIFEST_FILE = 'manifest.pkl'
+_MANIFEST_VERSION = 1
+
+_RESIZED_JPEG_QUALITY = 95
+
 # Command-line parsing
 tf.app.flags.DEFINE_string(
     'master', '', 'The address of the TensorFlow master to use.')
@@ -78,7 +85,25 @@ tf.app.flags.DEFINE_string(
 tf.app.flags.DEFINE_integer(
     'samples_per_shard', 1024,
     'The number of elements to store in each dataset shard. '
-    'This does not affect the models, just the file storage.')
+    'This does not affect the models, just the file storage. Changing it forces a full conversion.')
+
+tf.app.flags.DEFINE_integer(
+    'num_workers', 0,
+    'The number of worker processes, each writing one shard at a time. '
+    'If 0, uses one worker per CPU core.')
+
+tf.app.flags.DEFINE_integer(
+    'max_image_side', None,
+    'If informed, images (and masks) with a larger side are downscaled (area interpolation, aspect '
+    'ratio preserved) to that maximum side and re-encoded (JPEG quality %d) before being stored. '
+    'Smaller images are stored untouched. Use at least twice the network resolution, so the crops '
+    'of the preprocessing are still downscaled from a finer image.' % _RESIZED_JPEG_QUALITY)
+
+tf.app.flags.DEFINE_bool(
+    'incremental', True,
+    'If --output_dir has the manifest of a previous conversion, rewrites only the shards whose '
+    'samples changed (metadata, image or mask), or were removed; new samples go to the rewritten '
+    'shards or to new shards. Use --noincremental to force a full conversion.')
 
 tf.app.flags.DEFINE_bool(
     'allow_old_python', False, 'The script was not tested on Python 2 and will normally require Python 3.4+, '
@@ -112,44 +137,85 @@ def to_category(values, *categories, **kwargs):
     return categories.index(values) if values in categories else default
 
 
-class ImageReader(object):
-  """Helper class that provides TensorFlow image coding utilities."""
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - { 0xC4, 0xC8, 0xCC }
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def read_jpeg_dims(image_data):
+  """Returns (height, width) of a JPEG image, read from its start-of-frame header (no decoding)."""
+  position = 2
+  if image_data[:2]!=b'\xff\xd8':
+    raise ValueError('not a JPEG image')
+  while position+4<=len(image_data):
+    if image_data[position]!=0xFF:
+      raise ValueError('corrupted JPEG marker at offset %d' % position)
+    marker = image_data[position+1]
+    if marker==0xFF: # Fill byte
+      position += 1
+      continue
+    if marker==0x01 or 0xD0<=marker<=0xD7: # Markers without payload
+      position += 2
+      continue
+    segment_length = (image_data[position+2]<<8) | image_data[position+3]
+    if marker in _JPEG_SOF_MARKERS:
+      height = (image_data[position+5]<<8) | image_data[position+6]
+      width  = (image_data[position+7]<<8) | image_data[position+8]
+      return height, width
+    if marker==0xDA: # Start of scan before any frame header
+      break
+    position += 2+segment_length
+  raise ValueError('no start-of-frame header found in JPEG image')
+
+
+def read_png_dims(image_data):
+  """Returns (height, width) of a PNG image, read from its IHDR header (no decoding)."""
+  if image_data[:8]!=_PNG_SIGNATURE or image_data[12:16]!=b'IHDR':
+    raise ValueError('not a PNG image')
+  width  = int.from_bytes(image_data[16:20], 'big')
+  height = int.from_bytes(image_data[20:24], 'big')
+  return height, width
+
+
+class ImageResizer(object):
+  """Helper class that downscales JPEG images and PNG masks, with its own graph and session."""
 
   def __init__(self):
-    # Initializes function that decodes RGB JPEG data.
-    self._decode_jpeg_data = tf.placeholder(dtype=tf.string)
-    self._decode_jpeg = tf.image.decode_jpeg(self._decode_jpeg_data, channels=3)
-
-  def read_image_dims(self, sess, image_data):
-    image = self.decode_jpeg(sess, image_data)
-    return image.shape[0], image.shape[1]
-
-  def decode_jpeg(self, sess, image_data):
-    image = sess.run(self._decode_jpeg,
-      feed_dict={self._decode_jpeg_data: image_data})
-    assert len(image.shape) == 3
-    assert image.shape[2] == 3
-    return image
-
-
-class MaskReader(object):
-  """Helper class that provides TensorFlow image coding utilities."""
-
-  def __init__(self):
-    # Initializes function that decodes grayscale PNG data.
-    self._decode_png_data = tf.placeholder(dtype=tf.string)
-    self._decode_png = tf.image.decode_png(self._decode_png_data, channels=1)
-
-  def read_image_dims(self, sess, image_data):
-    image = self.decode_png(sess, image_data)
-    return image.shape[0], image.shape[1]
-
-  def decode_png(self, sess, image_data):
-    image = sess.run(self._decode_png,
-      feed_dict={self._decode_png_data: image_data})
-    assert len(image.shape) == 3
-    assert image.shape[2] == 1
-    return image
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      self._size = tf.placeholder(dtype=tf.int32, shape=[2])
+      # Initializes function that downscales RGB JPEG data.
+      self._jpeg_data = tf.placeholder(dtype=tf.string)
+      image = tf.image.decode_jpeg(self._jpeg_data, channels=3)
+      image = tf.image.resize_area(tf.expand_dims(image, 0), self._size)[0]
+      image = tf.saturate_cast(tf.round(image), tf.uint8)
+      self._resized_jpeg = tf.image.encode_jpeg(image, quality=_RESIZED_JPEG_QUALITY)
+      # Initializes function that downscales grayscale PNG data (labels must not be interpolated).
+      self._png_data = tf.placeholder(dtype=tf.string)
+      mask = tf.image.decode_png(self._png_data, channels=1)
+      mask = tf.image.resize_nearest_neighbor(tf.expand_dims(mask, 0), self._size)[0]
+      self._resized_png = tf.image.encode_png(mask)
+    self._session = tf.Session(graph=self._graph)
+
+  def resize_jpeg(self, image_data, height, width):
+    return self._session.run(self._resized_jpeg,
+      feed_dict={self._jpeg_data: image_data, self._size: [height, width]})
+
+  def resize_png(self, image_data, height, width):
+    return self._session.run(self._resized_png,
+      feed_dict={self._png_data: image_data, self._size: [height, width]})
+
+
+def _get_resizer():
+  # One resizer per worker process, created on first use
+  if _get_resizer.resizer is None:
+    _get_resizer.resizer = ImageResizer()
+  return _get_resizer.resizer
+_get_resizer.resizer = None
+
+
+def _downscaled_dims(height, width, max_side):
+  scale = max_side / max(height, width)
+  return max(int(round(height*scale)), 1), max(int(round(width*scale)), 1)
 
 
 def _get_dataset_filename(dataset_dir, split_name, shard_id, num_shards, masks=False):
@@ -194,7 +260,172 @@ def _image_to_tfexample(image_data, image_format, height, width, metadata,
   return tf.train.Example(features=tf.train.Features(feature=feature))
 
 
-def _convert_dataset(split_name, metadata_file, images_dir, masks_dir, dataset_dir):
+def _find_mask(masks_dir, image_id):
+  """Returns the first mask available for the image."""
+  masks_glob = glob.iglob(os.path.join(masks_dir, image_id) + '*.png')
+  try:
+    return next(masks_glob)
+  except StopIteration:
+    message = 'no mask found for image %s.' % image_id
+    tf.logging.error(message)
+    raise RuntimeError(message)
+
+
+def _file_signature(filename, data=None, previous=None):
+  """Returns the size, modification time and SHA-1 of a file.
+
+  The SHA-1 is computed from data, if given, else from the file contents, unless previous is the
+  signature of the same file with the same size and modification time.
+  """
+  file_stat = os.stat(filename)
+  if (previous is not None and previous['file']==filename and
+      previous['size']==file_stat.st_size and previous['mtime']==file_stat.st_mtime):
+    return previous
+  if data is None:
+    data = tf.gfile.FastGFile(filename, 'rb').read()
+  return { 'file'  : filename,
+           'size'  : file_stat.st_size,
+           'mtime' : file_stat.st_mtime,
+           'sha1'  : hashlib.sha1(data).hexdigest() }
+
+
+def _sample_signature(meta, images_dir, masks_dir, previous=None):
+  """Returns the signature of a sample (metadata row, image and mask), as stored in the manifest."""
+  image_file = os.path.join(images_dir, meta[2]) + '.jpg'
+  signature = { 'metadata' : meta,
+                'image'    : _file_signature(image_file, previous=previous and previous['image']) }
+  if masks_dir:
+    mask_file = _find_mask(masks_dir, meta[2])
+    signature['mask'] = _file_signature(mask_file, previous=previous and previous.get('mask'))
+  return signature
+
+
+def _same_sample(signature, previous):
+  if previous is None or signature['metadata']!=previous['metadata']:
+    return False
+  if signature['image']['sha1']!=previous['image']['sha1']:
+    return False
+  return 'mask' not in signature or signature['mask']['sha1']==previous.get('mask', {}).get('sha1')
+
+
+def _convert_shard(shard):
+  """Writes one shard of the dataset. Runs on a worker process.
+
+  Args:
+    shard: A tuple (output_filename, metadata, images_dir, masks_dir, max_image_side), where
+      metadata is the list of rows of the samples in the shard.
+
+  Returns:
+    The list of the signatures of the samples written to the shard, in order.
+  """
+  output_filename, metadata, images_dir, masks_dir, max_image_side = shard
+  signatures = []
+  tfrecord_writer = tf.python_io.TFRecordWriter(output_filename)
+  for meta in metadata:
+    # Read the image file:
+    image_file = os.path.join(images_dir, meta[2]) + '.jpg'
+    image_data = tf.gfile.FastGFile(image_file, 'rb').read()
+    image_height, image_width = read_jpeg_dims(image_data)
+    signature = { 'metadata' : meta, 'image' : _file_signature(image_file, data=image_data) }
+    resize = max_image_side and max(image_height, image_width)>max_image_side
+    if resize:
+      source_height, source_width = image_height, image_width
+      image_height, image_width = _downscaled_dims(image_height, image_width, max_image_side)
+      image_data = _get_resizer().resize_jpeg(image_data, image_height, image_width)
+
+    if masks_dir:
+      mask_file = _find_mask(masks_dir, meta[2])
+      mask_data = tf.gfile.FastGFile(mask_file, 'rb').read()
+      height, width = read_png_dims(mask_data)
+      if resize and height==source_height and width==source_width:
+        mask_data = _get_resizer().resize_png(mask_data, image_height, image_width)
+        height, width = image_height, image_width
+      if height!=image_height or width!=image_width:
+        message = ('image %s and its mask %s have incompatible sizes (expected %dx%d found %dx%d).' %
+              (image_file, mask_file, image_height, image_width, height, width,))
+        tf.logging.error(message)
+        raise RuntimeError(message)
+      signature['mask'] = _file_signature(mask_file, data=mask_data)
+      example = _image_to_tfexample(image_data, b'jpg', image_height, image_width, meta, mask_data, b'png')
+    else:
+      # Creates a dataset without masks
+      example = _image_to_tfexample(image_data, b'jpg', image_height, image_width, meta)
+
+    tfrecord_writer.write(example.SerializeToString())
+    signatures.append(signature)
+
+  tfrecord_writer.close()
+  return signatures
+
+
+def _plan_shards(metadata, previous_split, previous_samples, images_dir, masks_dir, dataset_dir):
+  """Assigns the samples to shards, reusing the shards of a previous conversion when possible.
+
+  Without a previous conversion, the samples are split in order, as in a full conversion. Else,
+  each sample stays in its previous shard; a shard is marked dirty (to be rewritten) if any of its
+  samples was removed or changed (metadata, image or mask); and the new samples fill the dirty
+  shards up to --samples_per_shard, and then new shards.
+
+  Returns:
+    Three lists, with one entry per shard: the ids of the samples, whether the shard must be
+    written, and the file name of the previous shard (or None); plus a dict with the signatures
+    of the samples in the clean shards.
+  """
+  _NUM_PER_SHARD = FLAGS.samples_per_shard
+  ids = [ meta[2] for meta in metadata ]
+
+  if previous_split is None:
+    dataset_size = len(ids)
+    num_shards = int(math.ceil(dataset_size / _NUM_PER_SHARD))
+    if dataset_size % _NUM_PER_SHARD < int(_NUM_PER_SHARD/3.0):
+      num_shards = max(num_shards-1, 1)
+    shard_ids = []
+    for shard_id in range(num_shards):
+      start_ndx = shard_id*_NUM_PER_SHARD
+      end_ndx   = (shard_id+1)*_NUM_PER_SHARD if shard_id<num_shards-1 else dataset_size
+      shard_ids.append(ids[start_ndx:end_ndx])
+    return shard_ids, [ True ]*num_shards, [ None ]*num_shards, {}
+
+  rows = { meta[2] : meta for meta in metadata }
+  signatures = {}
+  shard_ids = []
+  shard_dirty = []
+  shard_previous = []
+  placed = set()
+  for previous_shard in previous_split['shards']:
+    kept = [ i for i in previous_shard['ids'] if i in rows ]
+    placed.update(kept)
+    dirty = len(kept)!=len(previous_shard['ids'])
+    dirty = dirty or not os.path.exists(os.path.join(dataset_dir, previous_shard['file']))
+    for i in kept:
+      signatures[i] = _sample_signature(rows[i], images_dir, masks_dir, previous_samples.get(i))
+      dirty = dirty or not _same_sample(signatures[i], previous_samples.get(i))
+    if kept:
+      shard_ids.append(kept)
+      shard_dirty.append(dirty)
+      shard_previous.append(previous_shard['file'])
+
+  new_ids = [ i for i in ids if i not in placed ]
+  # Fills the shards that will be rewritten anyway, then creates new shards
+  for k, dirty in enumerate(shard_dirty):
+    room = _NUM_PER_SHARD-len(shard_ids[k])
+    if dirty and room>0:
+      shard_ids[k] = shard_ids[k] + new_ids[:room]
+      new_ids = new_ids[room:]
+  while new_ids:
+    shard_ids.append(new_ids[:_NUM_PER_SHARD])
+    shard_dirty.append(True)
+    shard_previous.append(None)
+    new_ids = new_ids[_NUM_PER_SHARD:]
+
+  clean_signatures = {}
+  for ids_k, dirty in zip(shard_ids, shard_dirty):
+    if not dirty:
+      clean_signatures.update({ i : signatures[i] for i in ids_k })
+  return shard_ids, shard_dirty, shard_previous, clean_signatures
+
+
+def _convert_dataset(split_name, metadata_file, images_dir, masks_dir, dataset_dir, manifest=None):
   """Converts the given images and metadata to a TFRecord dataset.
 
   Args:
@@ -202,6 +433,11 @@ def _convert_dataset(split_name, metadata_file, images_dir, masks_dir, dataset_d
     metadata: A list with the dataset metadata
     images_dir: The directory with the input .jpg images
     dataset_dir: The directory where the converted datasets are stored.
+    manifest: The manifest of a previous conversion to the same directory, or None. If given, only
+      the shards whose samples changed are rewritten.
+
+  Returns:
+    The number of samples in each class, and the manifest of the split.
   """
   assert split_name in ['train', 'test']
 
@@ -227,68 +463,90 @@ def _convert_dataset(split_name, metadata_file, images_dir, masks_dir, dataset_d
   metadata = [ m.strip().split(_DELIMITER) for m in open(metadata_file) ]
   metadata = [ [ f.strip() for f in m] for m in metadata ]
   metadata = metadata[1:]
-
-  dataset_size = len(metadata)
-  metadata = iter(metadata)
-  _NUM_PER_SHARD = FLAGS.samples_per_shard
-  num_shards = int(math.ceil(dataset_size / _NUM_PER_SHARD))
-  if dataset_size % _NUM_PER_SHARD < int(_NUM_PER_SHARD/3.0):
-    num_shards = max(num_shards-1, 1)
+  rows = { meta[2] : meta for meta in metadata }
 
   lesion_sizes = [ 0, 0, 0 ]
+  for meta in metadata:
+    lesion_sizes[_diagnosis_to_idx(meta[4])] += 1
+
+  previous_split = manifest['splits'].get(split_name) if manifest else None
+  previous_samples = manifest['samples'] if manifest else {}
+  shard_ids, shard_dirty, shard_previous, signatures = _plan_shards(
+      metadata, previous_split, previous_samples, images_dir, masks_dir, dataset_dir)
+  num_shards = len(shard_ids)
+  output_filenames = [ _get_dataset_filename(dataset_dir, split_name, k, num_shards)
+                       for k in range(num_shards) ]
+
+  # Moves the clean shards out of the way (their names change with the number of shards), and
+  # removes the previous shards that will be rewritten or are gone
+  for k in range(num_shards):
+    if not shard_dirty[k]:
+      os.rename(os.path.join(dataset_dir, shard_previous[k]), output_filenames[k] + '.keep')
+  if previous_split is not None:
+    for previous_shard in previous_split['shards']:
+      previous_filename = os.path.join(dataset_dir, previous_shard['file'])
+      if os.path.exists(previous_filename):
+        os.remove(previous_filename)
+  if manifest is not None:
+    tf.logging.info('%s split: keeping %d shards, writing %d shards', split_name,
+                    shard_dirty.count(False), shard_dirty.count(True))
+
+  # Each dirty shard is written by its own worker
+  shards = [ (output_filenames[k], [ rows[i] for i in shard_ids[k] ], images_dir, masks_dir,
+              FLAGS.max_image_side) for k in range(num_shards) if shard_dirty[k] ]
+  num_samples_to_write = sum(len(shard[1]) for shard in shards)
+  num_workers = min(FLAGS.num_workers or multiprocessing.cpu_count(), max(len(shards), 1))
+  def accumulate(shard_signatures):
+    signatures.update({ signature['metadata'][2] : signature for signature in shard_signatures })
+    accumulate.samples_done += len(shard_signatures)
+    accumulate.shards_done += 1
+    sys.stdout.write('\r>> Converted %d/%d images (%d/%d shards) in %s split' %
+      (accumulate.samples_done, num_samples_to_write, accumulate.shards_done, len(shards), split_name))
+    sys.stdout.flush()
+  accumulate.shards_done = 0
+  accumulate.samples_done = 0
+
+  if num_workers>1:
+    pool = multiprocessing.Pool(num_workers)
+    try:
+      for shard_signatures in pool.imap_unordered(_convert_shard, shards):
+        accumulate(shard_signatures)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    for shard in shards:
+      accumulate(_convert_shard(shard))
+  sys.stdout.write('\n')
+  sys.stdout.flush()
 
-  with tf.Graph().as_default(), tf.Session('') as session:
-    image_reader = ImageReader()
-    mask_reader = MaskReader()
+  for k in range(num_shards):
+    if not shard_dirty[k]:
+      os.rename(output_filenames[k] + '.keep', output_filenames[k])
 
-    for shard_id in range(num_shards):
-      output_filename = _get_dataset_filename(dataset_dir, split_name, shard_id, num_shards)
-      tfrecord_writer = tf.python_io.TFRecordWriter(output_filename)
+  # Records the shard and offset of each sample
+  split_manifest = { 'shards' : [] }
+  for k in range(num_shards):
+    split_manifest['shards'].append({ 'file' : os.path.basename(output_filenames[k]),
+                                      'ids'  : shard_ids[k] })
+    for offset, i in enumerate(shard_ids[k]):
+      signatures[i] = dict(signatures[i], split=split_name, shard=k, offset=offset)
 
-      start_ndx = shard_id*_NUM_PER_SHARD
-      end_ndx   = (shard_id+1)*_NUM_PER_SHARD if shard_id<num_shards-1 else dataset_size
-      for i in range(start_ndx, end_ndx):
-        sys.stdout.write('\r>> Converting image %d/%d shard %d in %s split' %
-          (i+1, dataset_size, shard_id, split_name))
-        sys.stdout.flush()
-
-        # Read the image file:
-        meta = next(metadata)
-
-        lesion_sizes[_diagnosis_to_idx(meta[4])] += 1
-
-        image_file = os.path.join(images_dir, meta[2]) + '.jpg'
-        image_data = tf.gfile.FastGFile(image_file, 'rb').read()
-        image_height, image_width = image_reader.read_image_dims(session, image_data)
-
-        if masks_dir:
-          # Assigns the first mask available to the image
-          masks_glob = glob.iglob(os.path.join(masks_dir, meta[2]) + '*.png')
-          try:
-            mask_file = next(masks_glob)
-          except StopIteration:
-            message = 'no mask found for image %s.' % image_file
-            tf.logging.error(message)
-            raise RuntimeError(message)
-          mask_data = tf.gfile.FastGFile(mask_file, 'rb').read()
-          height, width = mask_reader.read_image_dims(session, mask_data)
-          if height!=image_height or width!=image_width:
-            message = ('image %s and its mask %s have incompatible sizes (expected %dx%d found %dx%d).' %
-                  (image_file, mask_file, image_height, image_width, height, width,))
-            tf.logging.error(message)
-            raise RuntimeError(message)
-          example = _image_to_tfexample(image_data, b'jpg', image_height, image_width, meta, mask_data, b'png')
-        else:
-          # Creates a dataset without masks
-          example = _image_to_tfexample(image_data, b'jpg', image_height, image_width, meta)
-
-        tfrecord_writer.write(example.SerializeToString())
-
-      tfrecord_writer.close()
-  sys.stdout.write('\n')
-  sys.stdout.flush()
+  return lesion_sizes, split_manifest, signatures
 
-  return lesion_sizes
+
+def _load_manifest(dataset_dir, masks_dir):
+  """Returns the manifest of a previous conversion to dataset_dir, if compatible, else None."""
+  manifest_filename = os.path.join(dataset_dir, _MANIFEST_FILE)
+  if not os.path.exists(manifest_filename):
+    return None
+  manifest = pickle.load(open(manifest_filename, 'rb'))
+  if (manifest.get('version')!=_MANIFEST_VERSION or manifest.get('masks')!=bool(masks_dir) or
+      manifest.get('max_image_side')!=FLAGS.max_image_side or
+      manifest.get('samples_per_shard')!=FLAGS.samples_per_shard):
+    tf.logging.info('Ignoring incompatible manifest %s' % manifest_filename)
+    return None
+  return manifest
 
 
 def run(train_file, test_file, images_dir, masks_dir, dataset_dir):
@@ -321,16 +579,47 @@ def run(train_file, test_file, images_dir, masks_dir, dataset_dir):
       tf.logging.fatal('train and test files have common ids %s' % ' '.join(common))
       sys.exit(1)
 
+  manifest = _load_manifest(dataset_dir, masks_dir) if FLAGS.incremental else None
+  new_manifest = { 'version' : _MANIFEST_VERSION, 'masks' : bool(masks_dir),
+                   'max_image_side' : FLAGS.max_image_side, 'samples_per_shard' : FLAGS.samples_per_shard,
+                   'splits' : {}, 'samples' : {} }
+  if manifest:
+    # Keeps the entries of the splits not converted in this run
+    converted_splits = [ split for split, split_file in (('train', train_file), ('test', test_file)) if split_file ]
+    new_manifest['splits'] = { split : manifest['splits'][split] for split in manifest['splits']
+                               if split not in converted_splits }
+    new_manifest['samples'] = { i : sample for i, sample in manifest['samples'].items()
+                                if sample['split'] not in converted_splits }
+
+  def kept_sizes(split_name):
+    # The sizes of a split not converted in this run are counted from its samples in the manifest
+    lesion_sizes = [ 0, 0, 0 ]
+    if split_name in new_manifest['splits']:
+      for sample in new_manifest['samples'].values():
+        if sample['split']==split_name:
+          lesion_sizes[_diagnosis_to_idx(sample['metadata'][4])] += 1
+    else:
+      tf.logging.warning('The %s split was not converted, and has no previous conversion in the manifest: '
+                         'its sizes are recorded as zero' % split_name)
+    return lesion_sizes
+
   # Convert the training and validation sets.
   if train_file:
-    train_sizes = _convert_dataset('train', train_file, images_dir, masks_dir, dataset_dir)
+    train_sizes, new_manifest['splits']['train'], train_samples = _convert_dataset(
+        'train', train_file, images_dir, masks_dir, dataset_dir, manifest)
+    new_manifest['samples'].update(train_samples)
   else:
-    train_sizes = [ 0, 0, 0 ]
+    train_sizes = kept_sizes('train')
 
   if test_file:
-    test_sizes = _convert_dataset('test', test_file, images_dir, masks_dir, dataset_dir)
+    test_sizes, new_manifest['splits']['test'], test_samples = _convert_dataset(
+        'test', test_file, images_dir, masks_dir, dataset_dir, manifest)
+    new_manifest['samples'].update(test_samples)
   else:
-    test_sizes = [ 0, 0, 0 ]
+    test_sizes = kept_sizes('test')
+
+  # Maps each image id to its files' signatures, its shard and offset
+  pickle.dump(new_manifest, open(os.path.join(dataset_dir, _MANIFEST_FILE), 'wb'))
 
   # Saves classes and split sizes
   CLASSES_TO_SIZES = { 'nevus'     : train_sizes[0]+test_sizes[0],
@@ -366,6 +655,12 @@ def main(unparsed):
   if FLAGS.samples_per_shard<_MIN_SAMPLES_PER_SHARD:
     raise ValueError('The value of --samples_per_shard must be above %d' % _MIN_SAMPLES_PER_SHARD)
 
+  if FLAGS.max_image_side is not None and FLAGS.max_image_side<1:
+    raise ValueError('The value of --max_image_side must be positive')
+
+  if FLAGS.num_workers<0:
+    raise ValueError('The value of --num_workers must be 0 (one per CPU core) or positive')
+
   run(FLAGS.train, FLAGS.test, FLAGS.images_dir, FLAGS.masks_dir, FLAGS.output_dir)
 
   return 0
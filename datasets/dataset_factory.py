@@ -28,7 +28,7 @@ datasets_map = {
 }
 
 
-def get_dataset(name, split_name, dataset_dir, file_pattern=None, reader=None):
+def get_dataset(name, split_name, dataset_dir, file_pattern=None, reader=None, items=None):
   """Given a dataset name and a split_name returns a Dataset.
 
   Args:
@@ -38,6 +38,8 @@ def get_dataset(name, split_name, dataset_dir, file_pattern=None, reader=None):
     file_pattern: The file pattern to use for matching the dataset source files.
     reader: The subclass of tf.ReaderBase. If left as `None`, then the default
       reader defined by each dataset is used.
+    items: The list of items that will be decoded (the input field of the
+      dataset is always included). If left as `None`, all items are available.
 
   Returns:
     A `Dataset` class.
@@ -51,4 +53,5 @@ def get_dataset(name, split_name, dataset_dir, file_pattern=None, reader=None):
       split_name,
       dataset_dir,
       file_pattern,
-      reader)
+      reader,
+      items=items)
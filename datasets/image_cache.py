@@ -0,0 +1,186 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""An on-disk cache of decoded and resized images, for repeated passes over the same split.
+
+Each entry of the cache holds the images of one split, decoded and resized (aspect ratio preserved)
+so their longer side is the size of the cache. They are zero-padded to a memory-mapped uint8 NumPy
+array [num_samples, size, size, channels], with the actual size of each image, plus the values of
+the other items (e.g., ids and labels) in the same order. The lookups return the images without the
+padding, so the preprocessing sees the same geometry as for the original images, only downscaled.
+The entry is keyed by the dataset, split, size, resize method, items, and by the names, sizes and
+modification times of the dataset files, so it is rebuilt whenever any of those changes.
+
+The cached images replace the decoded images at the input of the preprocessing, so only the
+(random) preprocessing of each replica runs in the evaluation graph. Since the preprocessing then
+starts from a resampled image, the results are close, but not bit-identical, to decoding the
+original images. The crops of the preprocessing are resampled from the cached images, so a cache
+at the eval image size upsamples them: cache the images at a larger size (e.g., twice the eval size).
+
+Several processes may build the same entry at once: each writes its own temporary files, and renames
+them into place when done.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+import pickle
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+from . import tf_data_provider
+
+slim = tf.contrib.slim
+
+_IMAGES_FILE = 'images.npy'
+_ITEMS_FILE = 'items.pkl'
+_KEY_FILE = 'key.pkl'
+_RESIZE_METHOD = tf.image.ResizeMethod.BILINEAR
+
+
+def _cache_key(dataset, dataset_name, split_name, image_size, items):
+  data_files = []
+  for data_file in tf_data_provider.get_data_files(dataset):
+    data_stat = os.stat(data_file)
+    data_files.append((os.path.basename(data_file), data_stat.st_size, int(data_stat.st_mtime)))
+  key = {
+      'dataset_name'  : dataset_name,
+      'split_name'    : split_name,
+      'image_size'    : image_size,
+      'resize_method' : _RESIZE_METHOD,
+      'layout'        : 'longer_side',
+      'input_field'   : dataset.input_field,
+      'items'         : list(items),
+      'data_files'    : data_files,
+    }
+  key_hash = hashlib.sha1(repr(sorted(key.items())).encode('utf-8')).hexdigest()[:16]
+  return key, '%s_%s_%d_%s' % (dataset_name, split_name, image_size, key_hash)
+
+
+def _build(dataset, image_size, items, cache_path, key, hide_progress=False):
+  """Decodes and resizes (longer side to image_size) every image of the split, in order, into the
+  cache at cache_path."""
+  tf.logging.info('Building image cache %s', cache_path)
+  temp_suffix = '.tmp%d' % os.getpid()
+  num_samples = dataset.num_samples
+  with tf.Graph().as_default():
+    provider = slim.dataset_data_provider.DatasetDataProvider(
+        dataset,
+        shuffle=False,
+        num_readers=1,
+        common_queue_capacity=64,
+        common_queue_min=0)
+    decoded = provider.get([ dataset.input_field ] + list(items))
+    original_size = tf.cast(tf.shape(decoded[0])[:2], tf.float32)
+    resized_size = tf.cast(tf.round(original_size * image_size / tf.reduce_max(original_size)), tf.int32)
+    resized_size = tf.maximum(resized_size, 1)
+    image = tf.image.resize_images(decoded[0], resized_size, method=_RESIZE_METHOD)
+    image = tf.saturate_cast(tf.round(image), tf.uint8)
+    image = tf.image.pad_to_bounding_box(image, 0, 0, image_size, image_size)
+    targets = [ image, resized_size ] + decoded[1:]
+    with tf.Session() as sess:
+      coord = tf.train.Coordinator()
+      threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+      images = None
+      image_sizes = np.zeros([ num_samples, 2 ], dtype=np.int32)
+      values = [ [] for _ in items ]
+      for s in range(num_samples):
+        sample = sess.run(targets)
+        if images is None:
+          images = np.lib.format.open_memmap(os.path.join(cache_path, _IMAGES_FILE + temp_suffix),
+              mode='w+', dtype=np.uint8, shape=(num_samples,) + sample[0].shape)
+        images[s] = sample[0]
+        image_sizes[s] = sample[1]
+        for i, value in enumerate(sample[2:]):
+          values[i].append(value)
+        if not hide_progress and (s+1)%100==0:
+          print('caching image %d of %d' % (s+1, num_samples), end='\r', file=sys.stderr)
+      coord.request_stop()
+      coord.join(threads)
+  images.flush()
+  del images
+  with open(os.path.join(cache_path, _KEY_FILE + temp_suffix), 'wb') as key_file:
+    pickle.dump(key, key_file)
+  with open(os.path.join(cache_path, _ITEMS_FILE + temp_suffix), 'wb') as items_file:
+    pickle.dump({ 'image_sizes' : image_sizes,
+                  'values'      : { item : np.asarray(value) for item, value in zip(items, values) } },
+                items_file)
+  # The items file is renamed last: its presence marks the entry as complete
+  for file_name in [ _IMAGES_FILE, _KEY_FILE, _ITEMS_FILE ]:
+    os.rename(os.path.join(cache_path, file_name + temp_suffix), os.path.join(cache_path, file_name))
+
+
+def _read_key(cache_path):
+  """Returns the key stored in the entry at cache_path, or None if the entry is incomplete or unreadable."""
+  if not os.path.exists(os.path.join(cache_path, _ITEMS_FILE)):
+    return None
+  try:
+    with open(os.path.join(cache_path, _KEY_FILE), 'rb') as key_file:
+      return pickle.load(key_file)
+  except (IOError, OSError, EOFError, pickle.UnpicklingError):
+    return None
+
+
+class ImageCache(object):
+  """A cache entry for one split, built on the first use.
+
+  Args:
+    cache_dir: the base directory of the cache (one subdirectory per entry).
+    dataset: a slim Dataset, as returned by dataset_factory.get_dataset().
+    dataset_name: the name of the dataset, part of the key.
+    split_name: the name of the split, part of the key.
+    image_size: the size of the longer side of the cached images.
+    items: the other items cached with the images, e.g., [ 'id', 'label' ].
+  """
+
+  def __init__(self, cache_dir, dataset, dataset_name, split_name, image_size, items,
+               hide_progress=False):
+    self.key, entry_name = _cache_key(dataset, dataset_name, split_name, image_size, items)
+    self.path = os.path.join(cache_dir, entry_name)
+    self.items = list(items)
+    stored_key = _read_key(self.path)
+    if stored_key==self.key:
+      tf.logging.info('Using image cache %s', self.path)
+    else:
+      if stored_key is not None:
+        # The entry name has only a prefix of the hash of the key: a collision, or a stale entry
+        tf.logging.warning('The image cache %s has another key, rebuilding it', self.path)
+      if not os.path.isdir(self.path):
+        try:
+          os.makedirs(self.path)
+        except OSError:
+          # Created meanwhile by a concurrent builder
+          if not os.path.isdir(self.path):
+            raise
+      _build(dataset, image_size, self.items, self.path, self.key, hide_progress=hide_progress)
+    self._images = np.load(os.path.join(self.path, _IMAGES_FILE), mmap_mode='r')
+    with open(os.path.join(self.path, _ITEMS_FILE), 'rb') as items_file:
+      stored_items = pickle.load(items_file)
+    self._image_sizes = stored_items['image_sizes']
+    self._values = stored_items['values']
+    self.num_samples = self._images.shape[0]
+
+  def _lookup(self, index):
+    height, width = self._image_sizes[index]
+    return [ np.array(self._images[index, :height, :width]) ] + [ self._values[item][index] for item in self.items ]
+
+  def lookup(self, index):
+    """Returns the tensors [ image, items... ] of the sample at the (scalar tensor) index.
+
+    The image has its actual (resized) height and width, unknown in the graph.
+    """
+    dtypes = [ tf.uint8 ] + [ tf.as_dtype(self._values[item].dtype) if self._values[item].dtype.kind!='S'
+                              else tf.string for item in self.items ]
+    tensors = tf.py_func(self._lookup, [ index ], dtypes, stateful=False, name='image_cache_lookup')
+    tensors[0].set_shape([ None, None, self._images.shape[3] ])
+    for tensor, item in zip(tensors[1:], self.items):
+      tensor.set_shape(self._values[item].shape[1:])
+    return tensors
+
+  def get(self):
+    """Returns the tensors [ image, items... ] of the samples, in order, cycling indefinitely."""
+    index = tf.train.range_input_producer(self.num_samples, shuffle=False, capacity=64).dequeue()
+    return self.lookup(index)
@@ -102,8 +102,22 @@ def _items_to_handlers():
       'semiduplicate'        : slim.tfexample_decoder.Tensor('meta/semiduplicate'),
   }
 
-def _get_split(split_name, dataset_dir, file_pattern=None, reader=None,
-    _items_to_descriptions=None, _keys_to_features=None, _items_to_handlers=None):
+def _select_items(items, items_to_handlers, keys_to_features):
+  """Restricts the handlers to the given items, and the features to those the handlers use."""
+  unknown_items = items - set(items_to_handlers)
+  if unknown_items:
+    raise ValueError('unknown items: %s' % ', '.join(sorted(unknown_items)))
+  items_to_handlers = { item : items_to_handlers[item] for item in items }
+  used_keys = set()
+  for handler in items_to_handlers.values():
+    used_keys.update(handler.keys)
+  keys_to_features = { key : keys_to_features[key] for key in used_keys }
+  return items_to_handlers, keys_to_features
+
+
+def _get_split(split_name, dataset_dir, file_pattern=None, reader=None, items=None,
+    _items_to_descriptions=None, _keys_to_features=None, _items_to_handlers=None,
+    _input_field='image'):
   """Gets a dataset tuple with instructions for reading flowers.
 
   Args:
@@ -113,6 +127,9 @@ def _get_split(split_name, dataset_dir, file_pattern=None, reader=None,
       It is assumed that the pattern contains a '%s' string so that the split
       name can be inserted.
     reader: The TensorFlow reader type.
+    items: The items the caller will decode (the input field is always
+      included). Only the features needed by those items are parsed from each
+      record. If None, all items are available.
 
   Returns:
     A `Dataset` namedtuple.
@@ -141,6 +158,10 @@ def _get_split(split_name, dataset_dir, file_pattern=None, reader=None,
 
   items_to_handlers = _items_to_handlers()
 
+  if items is not None:
+    items_to_handlers, keys_to_features = _select_items(
+        set(items) | { _input_field }, items_to_handlers, keys_to_features)
+
   decoder = slim.tfexample_decoder.TFExampleDecoder(
       keys_to_features, items_to_handlers)
 
@@ -156,12 +177,12 @@ def _get_split(split_name, dataset_dir, file_pattern=None, reader=None,
       num_classes=num_classes,
       labels_to_names=labels_to_names)
 
-  dataset.__dict__['input_field'] = 'image'
+  dataset.__dict__['input_field'] = _input_field
 
   return dataset
 
 
-def get_split(split_name, dataset_dir, file_pattern=None, reader=None):
-  return  _get_split(split_name, dataset_dir, file_pattern=file_pattern, reader=reader,
+def get_split(split_name, dataset_dir, file_pattern=None, reader=None, items=None):
+  return  _get_split(split_name, dataset_dir, file_pattern=file_pattern, reader=reader, items=items,
       _items_to_descriptions=_ITEMS_TO_DESCRIPTIONS, _keys_to_features=_keys_to_features,
       _items_to_handlers=_items_to_handlers)
@@ -82,12 +82,10 @@ class Composite(slim.tfexample_decoder.ItemHandler):
 
 _get_split = skin_lesions._get_split
 
-def get_split(split_name, dataset_dir, file_pattern=None, reader=None):
-  dataset =  _get_split(split_name, dataset_dir, file_pattern=file_pattern, reader=reader,
+def get_split(split_name, dataset_dir, file_pattern=None, reader=None, items=None):
+  return  _get_split(split_name, dataset_dir, file_pattern=file_pattern, reader=reader, items=items,
       _items_to_descriptions=_ITEMS_TO_DESCRIPTIONS, _keys_to_features=_keys_to_features,
-      _items_to_handlers=_items_to_handlers)
-  dataset.__dict__['input_field'] = 'composite'
-  return dataset
+      _items_to_handlers=_items_to_handlers, _input_field='composite')
 
 
 _FILE_PATTERN = 'skin_lesions_seg_%s_*.tfrecord'
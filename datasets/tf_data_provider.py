@@ -0,0 +1,213 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""A tf.data alternative to slim's DatasetDataProvider, with parallel reading, decoding and prefetch.
+
+The records are read by interleaving several TFRecord shards in parallel, then decoded (with the
+decoder of the slim Dataset) and preprocessed by parallel calls fused with the batching, and the
+ready batches are prefetched. Requires TensorFlow 1.9 or superior (tf.contrib.data.map_and_batch
+with num_parallel_calls).
+
+Usage, in place of a DatasetDataProvider + tf.train.batch + prefetch_queue:
+  batches = tf_data_provider.make_batched_dataset(dataset, [dataset.input_field, 'label'],
+                                                  preprocess_fn, batch_size, shuffle=True)
+  batch_queue = tf_data_provider.DatasetQueue(batches, batch_size)
+  images, labels = batch_queue.dequeue()
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import os
+import pickle
+
+import tensorflow as tf
+
+# Written by datasets/convert_skin_lesions.py
+_MANIFEST_FILE = 'manifest.pkl'
+
+
+def get_data_files(dataset):
+  """Returns the sorted list of files matched by the data_sources of a slim Dataset."""
+  data_sources = dataset.data_sources
+  if isinstance(data_sources, (str, bytes)):
+    data_sources = [ data_sources ]
+  data_files = []
+  for source in data_sources:
+    data_files.extend(tf.gfile.Glob(source))
+  if not data_files:
+    raise ValueError('No data files found in %s' % (dataset.data_sources,))
+  return sorted(data_files)
+
+
+def shard_dataset(dataset, task_index, num_tasks):
+  """Returns a copy of a slim Dataset restricted to one of num_tasks disjoint blocks of its files.
+
+  The data files are split in num_tasks contiguous blocks, so the blocks, in task order, follow the
+  order of the files. The number of samples of the block is taken from the per-shard counts of the
+  manifest of the conversion (see datasets/convert_skin_lesions.py), or, for the files the manifest
+  does not list, counted from their records.
+  """
+  data_files = get_data_files(dataset)
+  if num_tasks>len(data_files):
+    raise ValueError('Cannot split %d data files in %d tasks: convert the dataset with a smaller '
+                     '--samples_per_shard' % (len(data_files), num_tasks))
+  shard = copy.copy(dataset)
+  shard.data_sources = data_files[task_index*len(data_files)//num_tasks :
+                                  (task_index+1)*len(data_files)//num_tasks]
+  shard_sizes = _manifest_shard_sizes(shard.data_sources)
+  shard.num_samples = sum(shard_sizes[os.path.basename(data_file)] if os.path.basename(data_file) in shard_sizes
+                          else sum(1 for _ in tf.python_io.tf_record_iterator(data_file))
+                          for data_file in shard.data_sources)
+  return shard
+
+
+def _manifest_shard_sizes(data_files):
+  """Returns the number of samples of each shard file listed in the manifests of the data directories."""
+  shard_sizes = {}
+  for data_dir in set(os.path.dirname(data_file) for data_file in data_files):
+    manifest_filename = os.path.join(data_dir, _MANIFEST_FILE)
+    if not tf.gfile.Exists(manifest_filename):
+      continue
+    with tf.gfile.Open(manifest_filename, 'rb') as manifest_file:
+      manifest = pickle.load(manifest_file)
+    for split in manifest.get('splits', {}).values():
+      for shard in split['shards']:
+        shard_sizes[shard['file']] = len(shard['ids'])
+  return shard_sizes
+
+
+def _read_records(dataset, shuffle, num_readers, shuffle_buffer_size, num_epochs, seed):
+  data_files = get_data_files(dataset)
+  records = tf.data.Dataset.from_tensor_slices(data_files)
+  if shuffle:
+    records = records.shuffle(len(data_files), seed=seed)
+  records = records.apply(tf.contrib.data.parallel_interleave(
+      tf.data.TFRecordDataset, cycle_length=min(num_readers, len(data_files)), sloppy=shuffle))
+  # Repeats after the interleave, so each epoch is read whole before the next one starts
+  records = records.repeat(num_epochs)
+  if shuffle:
+    records = records.shuffle(shuffle_buffer_size, seed=seed)
+  return records
+
+
+def make_batched_dataset(dataset, items, preprocess_fn, batch_size, shuffle,
+                         num_readers=4, num_parallel_calls=4, prefetch_batches=2,
+                         shuffle_buffer_size=None, num_epochs=None, seed=None, skip=0):
+  """Creates a tf.data.Dataset with batches of preprocessed items of a slim Dataset.
+
+  Args:
+    dataset: a slim Dataset, as returned by dataset_factory.get_dataset().
+    items: the list of items to decode, e.g., [dataset.input_field, 'label'].
+    preprocess_fn: a function that receives the decoded items (one argument per item) and returns
+      a tuple of tensors for a single sample. If None, the decoded items are batched as they are.
+    batch_size: the number of samples in each batch.
+    shuffle: whether to shuffle the shards and the records. If False, the order of the samples is
+      deterministic (the shards are interleaved in a fixed pattern).
+    num_readers: the number of shards read in parallel.
+    num_parallel_calls: the number of samples decoded and preprocessed in parallel.
+    prefetch_batches: the number of ready batches kept ahead of the consumer.
+    shuffle_buffer_size: the number of records in the shuffle buffer (default: 10 batches).
+    num_epochs: the number of passes over the data, or None to cycle indefinitely.
+    seed: the seed of the shuffling.
+    skip: the number of records skipped (without decoding them) at the start, e.g., to resume an
+      interrupted pass in deterministic order.
+
+  Returns:
+    A tf.data.Dataset.
+  """
+  records = _read_records(dataset, shuffle, num_readers, shuffle_buffer_size or 10 * batch_size,
+                          num_epochs, seed)
+  if skip:
+    records = records.skip(skip)
+
+  def decode_and_preprocess(serialized):
+    decoded = dataset.decoder.decode(serialized, items)
+    if preprocess_fn is None:
+      return tuple(decoded)
+    return preprocess_fn(*decoded)
+
+  batches = records.apply(tf.contrib.data.map_and_batch(
+      decode_and_preprocess, batch_size, num_parallel_calls=num_parallel_calls))
+  return batches.prefetch(prefetch_batches)
+
+
+def make_padded_batched_dataset(dataset, items, preprocess_fn, batch_preprocess_fn, batch_size,
+                                shuffle, num_readers=4, num_parallel_calls=4, prefetch_batches=2,
+                                shuffle_buffer_size=None, num_epochs=None, seed=None):
+  """Creates a tf.data.Dataset with batches preprocessed as a whole, e.g., by a batch augmentation.
+
+  Like make_batched_dataset(), but the samples (decoded and passed through preprocess_fn in
+  parallel) are zero-padded to the largest shape in the batch, and the batches are passed through
+  batch_preprocess_fn.
+
+  Args:
+    preprocess_fn: a function that receives the decoded items (one argument per item) and returns
+      a tuple of tensors for a single sample, e.g., including the shape of the image before the
+      padding. If None, the decoded items are batched as they are.
+    batch_preprocess_fn: a function that receives the padded batches (one argument per tensor
+      returned by preprocess_fn) and returns a tuple of tensors.
+    Other args: see make_batched_dataset().
+
+  Returns:
+    A tf.data.Dataset.
+  """
+  records = _read_records(dataset, shuffle, num_readers, shuffle_buffer_size or 10 * batch_size,
+                          num_epochs, seed)
+
+  def decode_and_preprocess(serialized):
+    decoded = dataset.decoder.decode(serialized, items)
+    if preprocess_fn is None:
+      return tuple(decoded)
+    return preprocess_fn(*decoded)
+
+  samples = records.map(decode_and_preprocess, num_parallel_calls=num_parallel_calls)
+  batches = samples.padded_batch(batch_size, padded_shapes=samples.output_shapes)
+  batches = batches.map(batch_preprocess_fn)
+  return batches.prefetch(prefetch_batches)
+
+
+def make_batched_lookup_dataset(num_samples, lookup_fn, preprocess_fn, batch_size,
+                                num_parallel_calls=4, prefetch_batches=2, skip=0):
+  """Creates a tf.data.Dataset with batches of preprocessed samples fetched by index, in order.
+
+  Like make_batched_dataset(), but for sources that are indexed instead of read from TFRecord files
+  (e.g., an image_cache.ImageCache). The indices cycle indefinitely over range(num_samples).
+
+  Args:
+    num_samples: the number of samples in the source.
+    lookup_fn: a function that receives a scalar index tensor and returns a list of tensors.
+    preprocess_fn: a function that receives the tensors returned by lookup_fn (one argument per
+      tensor) and returns a tuple of tensors for a single sample.
+    batch_size: the number of samples in each batch.
+    num_parallel_calls: the number of samples fetched and preprocessed in parallel.
+    prefetch_batches: the number of ready batches kept ahead of the consumer.
+    skip: the number of indices skipped at the start.
+
+  Returns:
+    A tf.data.Dataset.
+  """
+  indices = tf.data.Dataset.range(num_samples).repeat().skip(skip)
+  batches = indices.apply(tf.contrib.data.map_and_batch(
+      lambda index: preprocess_fn(*lookup_fn(index)), batch_size,
+      num_parallel_calls=num_parallel_calls))
+  return batches.prefetch(prefetch_batches)
+
+
+class DatasetQueue(object):
+  """Exposes the batches of a tf.data.Dataset with the dequeue() interface of slim's prefetch_queue.
+
+  Each call to dequeue() creates a new get_next() op, so that each clone gets its own batches.
+  The static batch dimension, lost by map_and_batch, is restored, since the dataset is expected to
+  cycle indefinitely.
+  """
+
+  def __init__(self, batches, batch_size):
+    self._iterator = batches.make_one_shot_iterator()
+    self._batch_size = batch_size
+
+  def dequeue(self):
+    tensors = self._iterator.get_next()
+    for tensor in tensors:
+      tensor.set_shape([ self._batch_size ] + tensor.get_shape().as_list()[1:])
+    return tensors
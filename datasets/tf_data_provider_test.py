@@ -0,0 +1,65 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Tests for tf_data_provider."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from datasets import tf_data_provider
+
+slim = tf.contrib.slim
+
+
+class ReadRecordsTest(tf.test.TestCase):
+
+  def _make_dataset(self, num_files, records_per_file):
+    data_dir = os.path.join(self.get_temp_dir(), 'records_%d_%d' % (num_files, records_per_file))
+    tf.gfile.MakeDirs(data_dir)
+    for f in range(num_files):
+      with tf.python_io.TFRecordWriter(os.path.join(data_dir, 'shard_%05d.tfrecord' % f)) as writer:
+        for r in range(records_per_file):
+          example = tf.train.Example(features=tf.train.Features(feature={
+              'id' : tf.train.Feature(int64_list=tf.train.Int64List(value=[ f*records_per_file + r ])) }))
+          writer.write(example.SerializeToString())
+    decoder = slim.tfexample_decoder.TFExampleDecoder(
+        { 'id' : tf.FixedLenFeature((), tf.int64) },
+        { 'id' : slim.tfexample_decoder.Tensor('id') })
+    return slim.dataset.Dataset(
+        data_sources=os.path.join(data_dir, 'shard_*.tfrecord'),
+        reader=tf.TFRecordReader,
+        decoder=decoder,
+        num_samples=num_files * records_per_file,
+        items_to_descriptions={})
+
+  def _read_ids(self, batches, num_batches):
+    ids = batches.make_one_shot_iterator().get_next()[0]
+    with self.test_session() as sess:
+      return [ i for _ in range(num_batches) for i in sess.run(ids) ]
+
+  def testEachRecordOncePerEpoch(self):
+    # More files than readers: the files of an epoch are interleaved in several rounds
+    dataset = self._make_dataset(num_files=7, records_per_file=3)
+    batches = tf_data_provider.make_batched_dataset(
+        dataset, [ 'id' ], None, batch_size=1, shuffle=False, num_readers=2)
+    ids = self._read_ids(batches, 2 * dataset.num_samples)
+    self.assertEqual(sorted(ids[:dataset.num_samples]), list(range(dataset.num_samples)))
+    self.assertEqual(sorted(ids[dataset.num_samples:]), list(range(dataset.num_samples)))
+    # The order is deterministic, the same in every epoch
+    self.assertEqual(ids[:dataset.num_samples], ids[dataset.num_samples:])
+
+  def testSkip(self):
+    dataset = self._make_dataset(num_files=5, records_per_file=2)
+    batches = tf_data_provider.make_batched_dataset(
+        dataset, [ 'id' ], None, batch_size=1, shuffle=False, num_readers=2)
+    all_ids = self._read_ids(batches, dataset.num_samples)
+    batches = tf_data_provider.make_batched_dataset(
+        dataset, [ 'id' ], None, batch_size=1, shuffle=False, num_readers=2, skip=4)
+    self.assertEqual(self._read_ids(batches, dataset.num_samples-4), all_ids[4:])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,90 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Thread pools and CPU affinity of the sessions, for packing several jobs on one CPU host.
+
+By default, each TensorFlow session sizes its intra-op and inter-op thread pools to all cores of
+the host, so N jobs side by side run N times too many threads, and contend for the cores. Pinning
+each job to its own set of cores (set_cpu_affinity()), with thread pools of matching sizes
+(session_config()), avoids the oversubscription. See tune_threads.py to find the best settings
+for a model.
+
+Usage:
+  cpus = cpu_config.set_cpu_affinity('0-7')
+  config = cpu_config.session_config(intra_op_threads=0, inter_op_threads=2, cpus=cpus)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+
+def parse_cpu_list(cpu_list):
+  """Parses a list of cores, e.g., '0-3,8,10-11', into a sorted list of core ids."""
+  cpus = set()
+  for cpu_range in cpu_list.split(','):
+    cpu_range = cpu_range.strip()
+    if not cpu_range:
+      continue
+    bounds = cpu_range.split('-')
+    if len(bounds)>2 or not all(b.strip().isdigit() for b in bounds):
+      raise ValueError('Invalid list of cores: %s' % cpu_list)
+    first, last = int(bounds[0]), int(bounds[-1])
+    if first>last:
+      raise ValueError('Invalid list of cores: %s' % cpu_list)
+    cpus.update(range(first, last+1))
+  if not cpus:
+    raise ValueError('Invalid list of cores: %s' % cpu_list)
+  return sorted(cpus)
+
+
+def format_cpu_list(cpus):
+  """The inverse of parse_cpu_list(), e.g., [0, 1, 2, 3, 8] => '0-3,8'."""
+  ranges = []
+  for cpu in sorted(cpus):
+    if ranges and ranges[-1][1]==cpu-1:
+      ranges[-1][1] = cpu
+    else:
+      ranges.append([ cpu, cpu ])
+  return ','.join(('%d' % first) if first==last else ('%d-%d' % (first, last)) for first, last in ranges)
+
+
+def available_cpus():
+  """Returns the cores the process may run on."""
+  if hasattr(os, 'sched_getaffinity'):
+    return sorted(os.sched_getaffinity(0))
+  return list(range(os.cpu_count() or 1))
+
+
+def set_cpu_affinity(cpu_list):
+  """Pins the process (and the threads it starts afterwards) to the cores in cpu_list.
+
+  Returns:
+    The list of core ids.
+  """
+  cpus = parse_cpu_list(cpu_list)
+  if not hasattr(os, 'sched_setaffinity'):
+    raise ValueError('Setting the CPU affinity is not supported on this platform')
+  os.sched_setaffinity(0, cpus)
+  return cpus
+
+
+def session_config(intra_op_threads=0, inter_op_threads=0, cpus=None, **kwargs):
+  """Returns a tf.ConfigProto with the sizes of the thread pools.
+
+  Args:
+    intra_op_threads: the threads available to each op (e.g., a convolution); 0 lets TensorFlow
+      choose, which is all cores of the host, unless cpus is given.
+    inter_op_threads: the ops run in parallel; 0 lets TensorFlow choose.
+    cpus: the cores the process was pinned to (see set_cpu_affinity()). If given, the pools
+      chosen by TensorFlow are sized to these cores instead of all cores of the host.
+    **kwargs: other arguments of tf.ConfigProto, e.g., log_device_placement.
+  """
+  if cpus is not None:
+    intra_op_threads = intra_op_threads or len(cpus)
+    inter_op_threads = inter_op_threads or len(cpus)
+  return tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                        inter_op_parallelism_threads=inter_op_threads,
+                        **kwargs)
@@ -0,0 +1,53 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Tests for cpu_config."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from deployment import cpu_config
+
+
+class CpuListTest(tf.test.TestCase):
+
+  def testParse(self):
+    self.assertEqual(cpu_config.parse_cpu_list('0'), [0])
+    self.assertEqual(cpu_config.parse_cpu_list('0-3,8, 10-11'), [0, 1, 2, 3, 8, 10, 11])
+    self.assertEqual(cpu_config.parse_cpu_list('4,2-3,2'), [2, 3, 4])
+
+  def testParseInvalid(self):
+    for cpu_list in [ '', ',', 'a', '3-1', '1-2-3', '-1' ]:
+      with self.assertRaises(ValueError):
+        cpu_config.parse_cpu_list(cpu_list)
+
+  def testFormat(self):
+    self.assertEqual(cpu_config.format_cpu_list([0, 1, 2, 3, 8, 10, 11]), '0-3,8,10-11')
+    self.assertEqual(cpu_config.format_cpu_list([5]), '5')
+    cpu_list = '0-1,4,6-9'
+    self.assertEqual(cpu_config.format_cpu_list(cpu_config.parse_cpu_list(cpu_list)), cpu_list)
+
+
+class SessionConfigTest(tf.test.TestCase):
+
+  def testDefaults(self):
+    config = cpu_config.session_config()
+    self.assertEqual(config.intra_op_parallelism_threads, 0)
+    self.assertEqual(config.inter_op_parallelism_threads, 0)
+
+  def testThreads(self):
+    config = cpu_config.session_config(intra_op_threads=4, inter_op_threads=2,
+                                       log_device_placement=True)
+    self.assertEqual(config.intra_op_parallelism_threads, 4)
+    self.assertEqual(config.inter_op_parallelism_threads, 2)
+    self.assertTrue(config.log_device_placement)
+
+  def testPinnedCpus(self):
+    config = cpu_config.session_config(inter_op_threads=1, cpus=[0, 1, 2])
+    self.assertEqual(config.intra_op_parallelism_threads, 3)
+    self.assertEqual(config.inter_op_parallelism_threads, 1)
+
+
+if __name__ == '__main__':
+  tf.test.main()
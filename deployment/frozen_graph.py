@@ -0,0 +1,252 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Frozen inference graphs: a network and its checkpoint as a single, optimized GraphDef.
+
+freeze() builds the network in inference mode, restores the checkpoint, and replaces the
+variables by constants. Only the subgraph needed by the logits and the chosen end_points is kept,
+and, when optimized, the training-only and identity ops are stripped, the constant subgraphs
+folded, and the batch normalizations folded into the weights of the convolutions. The GraphDef is
+stored with a small JSON description (write() and read()), and is imported by
+predict_image_classifier.py --frozen_graph (see import_network()) instead of building the network
+and restoring the checkpoint.
+
+A frozen graph may also be converted to a reduced precision for inference (see quantize()): fp16,
+which computes the whole network in float16, or int8, which stores the weights in 8 bits and runs
+the convolutions and matrix products as eight-bit ops. The int8 graphs should then be calibrated
+(see calibrate()), so the ranges of the requantizations are fixed to the ranges seen on a sample of
+images, instead of computed at each step. The inputs and outputs stay float32 in all precisions.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+slim = tf.contrib.slim
+
+_INPUT_NAME = 'input'
+_LOGITS_NAME = 'output/logits'
+_END_POINTS_SCOPE = 'output/end_points/'
+_INFO_SUFFIX = '.json'
+_OPTIMIZATIONS = [ 'strip_unused_nodes',
+                   'remove_nodes(op=Identity, op=CheckNumerics)',
+                   'fold_constants(ignore_errors=true)',
+                   'fold_batch_norms',
+                   'fold_old_batch_norms',
+                   'sort_by_execution_order' ]
+_INT8_QUANTIZATIONS = [ 'quantize_weights',
+                        'quantize_nodes',
+                        'strip_unused_nodes',
+                        'sort_by_execution_order' ]
+_FLOAT_ATTRS = [ 'T', 'dtype', 'SrcT', 'DstT' ]
+# Compute in T (half), but keep their scale, offset, mean and variance in U (float32)
+_MIXED_BATCH_NORMS = [ 'FusedBatchNormV2', 'FusedBatchNormV3' ]
+
+
+def freeze(network_fn, checkpoint_path, image_size, num_channels=3, end_point_names=(),
+           optimize=True):
+  """Freezes a network and its checkpoint.
+
+  Args:
+    network_fn: the network, as returned by nets_factory.get_network_fn(..., is_training=False).
+    checkpoint_path: the checkpoint with the weights.
+    image_size: the (square) size of the input images.
+    num_channels: the number of channels of the input images.
+    end_point_names: the end_points kept as outputs, in addition to the logits.
+    optimize: whether to optimize the frozen graph (see the module docstring).
+
+  Returns:
+    The frozen GraphDef and its description (a dict).
+  """
+  with tf.Graph().as_default() as graph:
+    images = tf.placeholder(tf.float32, [ None, image_size, image_size, num_channels ], name=_INPUT_NAME)
+    logits, end_points = network_fn(images)
+    outputs = { 'logits' : tf.identity(logits, name=_LOGITS_NAME).op.name, 'end_points' : {} }
+    for end_point in end_point_names:
+      if end_point not in end_points:
+        raise ValueError('Invalid end_point: %s (valid end_points: %s)' %
+                         (end_point, ', '.join(sorted(end_points.keys()))))
+      outputs['end_points'][end_point] = tf.identity(end_points[end_point],
+                                                     name=_END_POINTS_SCOPE + end_point).op.name
+    output_names = [ outputs['logits'] ] + sorted(outputs['end_points'].values())
+    init_fn = slim.assign_from_checkpoint_fn(checkpoint_path, slim.get_variables_to_restore())
+    with tf.Session() as sess:
+      init_fn(sess)
+      graph_def = tf.graph_util.convert_variables_to_constants(sess, graph.as_graph_def(), output_names)
+  if optimize:
+    from tensorflow.tools.graph_transforms import TransformGraph
+    graph_def = TransformGraph(graph_def, [ _INPUT_NAME ], output_names, _OPTIMIZATIONS)
+  info = {
+      'checkpoint_path' : checkpoint_path,
+      'image_size'      : image_size,
+      'num_channels'    : num_channels,
+      'num_classes'     : int(logits.get_shape()[-1]),
+      'input'           : _INPUT_NAME,
+      'outputs'         : outputs,
+      'optimized'       : optimize,
+      'precision'       : 'fp32',
+    }
+  return graph_def, info
+
+
+def _output_names(info):
+  return [ info['outputs']['logits'] ] + sorted(info['outputs']['end_points'].values())
+
+
+def _float_to_half(graph_def, info):
+  half = tf.float16.as_datatype_enum
+  single = tf.float32.as_datatype_enum
+  # These batch normalizations only compute in float32
+  unfolded = sorted(set(node.op for node in graph_def.node
+                        if node.op in [ 'FusedBatchNorm', 'BatchNormWithGlobalNormalization' ]))
+  if unfolded:
+    raise ValueError('Cannot convert the batch normalizations (%s) to fp16: freeze the graph with the '
+                     'optimizations, which fold them into the weights' % ' '.join(unfolded))
+  output_names = _output_names(info)
+  cast_name = info['input'] + '/to_half'
+  converted = tf.GraphDef()
+  for node in graph_def.node:
+    new_node = converted.node.add()
+    new_node.CopyFrom(node)
+    if node.name==info['input']:
+      continue
+    # The inputs from the (float32) placeholder go through a cast
+    for i, input_name in enumerate(new_node.input):
+      if input_name in [ info['input'], info['input'] + ':0' ]:
+        new_node.input[i] = cast_name
+    if node.name in output_names:
+      # The outputs are identities, which become casts back to float32
+      del new_node.attr['T']
+      new_node.op = 'Cast'
+      new_node.attr['SrcT'].type = half
+      new_node.attr['DstT'].type = single
+      continue
+    for key in _FLOAT_ATTRS:
+      if key in new_node.attr and new_node.attr[key].type==single:
+        new_node.attr[key].type = half
+    if node.op=='Const' and node.attr['dtype'].type==single:
+      value = tf.make_ndarray(node.attr['value'].tensor).astype(np.float16)
+      new_node.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(value, tf.float16))
+    if node.op in _MIXED_BATCH_NORMS and node.attr['U'].type==single:
+      # The scale, offset, mean and variance (inputs 1 to 4), now half, go back to float32 for U
+      for i in range(1, 5):
+        input_cast = converted.node.add()
+        input_cast.name = '%s/input_%d/to_float' % (node.name, i)
+        input_cast.op = 'Cast'
+        input_cast.input.append(new_node.input[i])
+        input_cast.attr['SrcT'].type = half
+        input_cast.attr['DstT'].type = single
+        new_node.input[i] = input_cast.name
+  cast = converted.node.add()
+  cast.name = cast_name
+  cast.op = 'Cast'
+  cast.input.append(info['input'])
+  cast.attr['SrcT'].type = single
+  cast.attr['DstT'].type = half
+  return converted
+
+
+def quantize(graph_def, info, precision):
+  """Converts a frozen graph to a reduced precision: fp16 or int8 (see the module docstring).
+
+  Returns:
+    The converted GraphDef and its description.
+  """
+  if info.get('precision', 'fp32')!='fp32':
+    raise ValueError('The graph was already converted to %s' % info['precision'])
+  if precision=='fp16':
+    graph_def = _float_to_half(graph_def, info)
+  elif precision=='int8':
+    from tensorflow.tools.graph_transforms import TransformGraph
+    graph_def = TransformGraph(graph_def, [ info['input'] ], _output_names(info),
+                               _OPTIMIZATIONS[:-1] + _INT8_QUANTIZATIONS)
+  else:
+    raise ValueError('Invalid precision: %s (valid precisions: fp16 int8)' % precision)
+  info = dict(info, precision=precision, calibrated=False)
+  return graph_def, info
+
+
+def calibrate(graph_def, info, input_fn, num_batches):
+  """Fixes the ranges of the requantizations of an int8 graph to the ranges seen on a sample.
+
+  The dynamic ranges (RequantizationRange ops) are computed on num_batches batches of images, and
+  replaced by constants with the extreme values seen, by the freeze_requantization_ranges graph
+  transform (fed with a log of the ranges, in the format of its insert_logging counterpart).
+
+  Args:
+    graph_def: a graph quantized to int8 by quantize().
+    info: its description.
+    input_fn: a function that creates, in the current graph, a tensor that yields a new batch of
+      preprocessed images at each run (e.g., the get_next() of a tf.data iterator).
+    num_batches: the number of batches run.
+
+  Returns:
+    The calibrated GraphDef and its description.
+  """
+  if info['precision']!='int8':
+    raise ValueError('Only int8 graphs are calibrated')
+  range_names = [ node.name for node in graph_def.node if node.op=='RequantizationRange' ]
+  with tf.Graph().as_default():
+    images = input_fn()
+    range_tensors = tf.import_graph_def(graph_def, input_map={ info['input'] + ':0' : images },
+        return_elements=[ n + ':0' for n in range_names ] + [ n + ':1' for n in range_names ],
+        name='calibration')
+    with tf.Session() as sess:
+      coord = tf.train.Coordinator()
+      threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+      range_values = [ sess.run(range_tensors) for _ in range(num_batches) ]
+      coord.request_stop()
+      coord.join(threads)
+
+  # The transform takes, for each RequantizationRange, the extreme values of all its log lines
+  log_handle, log_filename = tempfile.mkstemp(suffix='.log', prefix='requantization_ranges_')
+  try:
+    with os.fdopen(log_handle, 'wt') as log_file:
+      for values in range_values:
+        for name, range_min, range_max in zip(range_names, values[:len(range_names)], values[len(range_names):]):
+          print(';%s__print__;__requant_min_max:[%r][%r]' % (name, float(range_min), float(range_max)),
+                file=log_file)
+    from tensorflow.tools.graph_transforms import TransformGraph
+    calibrated = TransformGraph(graph_def, [ info['input'] ], _output_names(info),
+                                [ 'freeze_requantization_ranges(min_max_log_file="%s")' % log_filename ])
+  finally:
+    os.remove(log_filename)
+  info = dict(info, calibrated=True, calibration_batches=num_batches)
+  return calibrated, info
+
+
+def write(graph_def, info, output_file):
+  """Writes a frozen GraphDef to output_file, and its description to output_file.json."""
+  with tf.gfile.GFile(output_file, 'wb') as graph_file:
+    graph_file.write(graph_def.SerializeToString())
+  with open(output_file + _INFO_SUFFIX, 'wt') as info_file:
+    json.dump(info, info_file, indent=2, sort_keys=True)
+
+
+def read(input_file):
+  """Reads a frozen GraphDef and its description, as written by write()."""
+  graph_def = tf.GraphDef()
+  with tf.gfile.GFile(input_file, 'rb') as graph_file:
+    graph_def.ParseFromString(graph_file.read())
+  with open(input_file + _INFO_SUFFIX, 'rt') as info_file:
+    info = json.load(info_file)
+  return graph_def, info
+
+
+def import_network(graph_def, info, images, scope='frozen'):
+  """Imports a frozen network into the current graph, fed by images.
+
+  Returns:
+    The logits and the dict of the end_points kept in the frozen graph, like a network_fn.
+  """
+  outputs = info['outputs']
+  end_point_names = sorted(outputs['end_points'].keys())
+  tensor_names = [ outputs['logits'] + ':0' ] + [ outputs['end_points'][e] + ':0' for e in end_point_names ]
+  tensors = tf.import_graph_def(graph_def, input_map={ info['input'] + ':0' : images },
+                                return_elements=tensor_names, name=scope)
+  return tensors[0], dict(zip(end_point_names, tensors[1:]))
@@ -0,0 +1,124 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Tests for frozen_graph."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from deployment import frozen_graph
+
+slim = tf.contrib.slim
+
+
+def SmallNetwork(inputs):
+  end_points = {}
+  with slim.arg_scope([slim.conv2d], normalizer_fn=slim.batch_norm,
+                      normalizer_params={ 'is_training' : False }):
+    net = slim.conv2d(inputs, 4, [3, 3], scope='conv1')
+    end_points['conv1'] = net
+    net = tf.reduce_mean(net, [1, 2], name='pool')
+    end_points['pool'] = net
+    logits = slim.fully_connected(net, 2, activation_fn=None, scope='logits')
+  return logits, end_points
+
+
+class FrozenGraphTest(tf.test.TestCase):
+
+  def setUp(self):
+    np.random.seed(0)
+    self._images = np.random.uniform(-1.0, 1.0, [2, 8, 8, 3]).astype(np.float32)
+    self._checkpoint_path = os.path.join(self.get_temp_dir(), 'model.ckpt')
+    with tf.Graph().as_default():
+      images = tf.constant(self._images)
+      logits, end_points = SmallNetwork(images)
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        # Non-trivial moving statistics, so the folding of the batch norm is exercised
+        for variable in slim.get_variables():
+          if 'moving' in variable.op.name:
+            sess.run(variable.assign(tf.random_uniform(variable.get_shape(), 0.5, 1.5)))
+        self._logits, self._pool = sess.run([logits, end_points['pool']])
+        tf.train.Saver().save(sess, self._checkpoint_path)
+
+  def testFreezeAndImport(self):
+    for optimize in [ False, True ]:
+      graph_def, info = frozen_graph.freeze(SmallNetwork, self._checkpoint_path, image_size=8,
+                                            end_point_names=[ 'pool' ], optimize=optimize)
+      self.assertEqual(info['num_classes'], 2)
+      self.assertEqual([ n.op for n in graph_def.node if n.op in ['Variable', 'VariableV2'] ], [])
+      with tf.Graph().as_default():
+        images = tf.placeholder(tf.float32, [None, 8, 8, 3])
+        logits, end_points = frozen_graph.import_network(graph_def, info, images)
+        self.assertEqual(sorted(end_points.keys()), [ 'pool' ])
+        with tf.Session() as sess:
+          logits, pool = sess.run([logits, end_points['pool']], feed_dict={ images : self._images })
+      self.assertAllClose(logits, self._logits, rtol=1e-4, atol=1e-4)
+      self.assertAllClose(pool, self._pool, rtol=1e-4, atol=1e-4)
+
+  def _run_frozen(self, graph_def, info):
+    with tf.Graph().as_default():
+      images = tf.placeholder(tf.float32, [None, 8, 8, 3])
+      logits, _ = frozen_graph.import_network(graph_def, info, images)
+      with tf.Session() as sess:
+        return sess.run(logits, feed_dict={ images : self._images })
+
+  def testQuantizeFp16(self):
+    graph_def, info = frozen_graph.freeze(SmallNetwork, self._checkpoint_path, image_size=8)
+    graph_def, info = frozen_graph.quantize(graph_def, info, 'fp16')
+    self.assertEqual(info['precision'], 'fp16')
+    logits = self._run_frozen(graph_def, info)
+    self.assertEqual(logits.dtype, np.float32)
+    self.assertAllClose(logits, self._logits, rtol=1e-2, atol=1e-2)
+
+  def testQuantizeFp16Unfolded(self):
+    # Without the optimizations, the batch normalizations are left in the graph
+    graph_def, info = frozen_graph.freeze(SmallNetwork, self._checkpoint_path, image_size=8, optimize=False)
+    if 'FusedBatchNorm' in [ node.op for node in graph_def.node ]:
+      with self.assertRaises(ValueError):
+        frozen_graph.quantize(graph_def, info, 'fp16')
+    else:
+      graph_def, info = frozen_graph.quantize(graph_def, info, 'fp16')
+      self.assertAllClose(self._run_frozen(graph_def, info), self._logits, rtol=1e-2, atol=1e-2)
+
+  def testQuantizeInt8Calibrated(self):
+    graph_def, info = frozen_graph.freeze(SmallNetwork, self._checkpoint_path, image_size=8)
+    graph_def, info = frozen_graph.quantize(graph_def, info, 'int8')
+    self.assertIn('QuantizedConv2D', [ node.op for node in graph_def.node ])
+    graph_def, info = frozen_graph.calibrate(graph_def, info, lambda: tf.constant(self._images),
+                                             num_batches=2)
+    self.assertTrue(info['calibrated'])
+    self.assertNotIn('RequantizationRange', [ node.op for node in graph_def.node ])
+    logits = self._run_frozen(graph_def, info)
+    tolerance = 0.05 * np.max(np.abs(self._logits)) + 1e-2
+    self.assertLess(np.max(np.abs(logits - self._logits)), tolerance)
+
+  def testQuantizeInvalid(self):
+    graph_def, info = frozen_graph.freeze(SmallNetwork, self._checkpoint_path, image_size=8)
+    with self.assertRaises(ValueError):
+      frozen_graph.quantize(graph_def, info, 'int4')
+    graph_def, info = frozen_graph.quantize(graph_def, info, 'fp16')
+    with self.assertRaises(ValueError):
+      frozen_graph.quantize(graph_def, info, 'int8')
+
+  def testWriteAndRead(self):
+    graph_def, info = frozen_graph.freeze(SmallNetwork, self._checkpoint_path, image_size=8,
+                                          optimize=False)
+    output_file = os.path.join(self.get_temp_dir(), 'frozen.pb')
+    frozen_graph.write(graph_def, info, output_file)
+    graph_def_read, info_read = frozen_graph.read(output_file)
+    self.assertEqual(graph_def_read, graph_def)
+    self.assertEqual(info_read, info)
+
+  def testInvalidEndPoint(self):
+    with self.assertRaises(ValueError):
+      frozen_graph.freeze(SmallNetwork, self._checkpoint_path, image_size=8,
+                          end_point_names=[ 'missing' ])
+
+
+if __name__ == '__main__':
+  tf.test.main()
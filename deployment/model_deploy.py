@@ -108,6 +108,7 @@ slim = tf.contrib.slim
 
 __all__ = ['create_clones',
            'deploy',
+           'mixed_precision_getter',
            'optimize_clones',
            'DeployedModel',
            'DeploymentConfig',
@@ -195,6 +196,39 @@ def create_clones(config, model_fn, args=None, kwargs=None):
   return clones
 
 
+def mixed_precision_getter(compute_dtype):
+  """Returns a custom variable getter for training in reduced precision.
+
+  The variables are always stored in float32 (the master weights, which the
+  optimizer updates). When a layer asks for a variable in `compute_dtype`
+  (because its inputs are in that dtype), it gets a cast of the float32
+  variable, so the convolutions and activations are computed in reduced
+  precision, and the gradients flow back, through the cast, to the float32
+  variable. The batch normalization parameters and statistics are returned in
+  float32, as expected by the fused batch normalization of float16 inputs
+  (the default of slim.batch_norm from TensorFlow 1.9).
+
+  Usage:
+    with tf.variable_scope(tf.get_variable_scope(),
+                           custom_getter=mixed_precision_getter(tf.float16)):
+      logits, end_points = network_fn(tf.cast(images, tf.float16))
+
+  Args:
+    compute_dtype: tf.float16 or tf.bfloat16.
+
+  Returns:
+    A function usable as the `custom_getter` of a variable scope.
+  """
+  def custom_getter(getter, name, shape=None, dtype=None, *args, **kwargs):
+    if dtype != compute_dtype:
+      return getter(name, shape, dtype, *args, **kwargs)
+    variable = getter(name, shape, tf.float32, *args, **kwargs)
+    if 'BatchNorm' in name.split('/'):
+      return variable
+    return tf.cast(variable, compute_dtype)
+  return custom_getter
+
+
 def _gather_clone_loss(clone, num_clones, regularization_losses):
   """Gather the loss for a single clone.
 
@@ -236,8 +270,16 @@ def _gather_clone_loss(clone, num_clones, regularization_losses):
   return sum_loss
 
 
+def _scale_gradient(grad, scale):
+  if grad is None:
+    return None
+  if isinstance(grad, tf.IndexedSlices):
+    return tf.IndexedSlices(grad.values * scale, grad.indices, grad.dense_shape)
+  return grad * scale
+
+
 def _optimize_clone(optimizer, clone, num_clones, regularization_losses,
-                    **kwargs):
+                    loss_scale=1.0, **kwargs):
   """Compute losses and gradients for a single clone.
 
   Args:
@@ -246,6 +288,8 @@ def _optimize_clone(optimizer, clone, num_clones, regularization_losses,
     num_clones: The number of clones being deployed.
     regularization_losses: Possibly empty list of regularization_losses
       to add to the clone losses.
+    loss_scale: The factor of the loss in the backward pass (see
+      `optimize_clones()`).
     **kwargs: Dict of kwarg to pass to compute_gradients().
 
   Returns:
@@ -258,12 +302,18 @@ def _optimize_clone(optimizer, clone, num_clones, regularization_losses,
   clone_grad = None
   if sum_loss is not None:
     with tf.device(clone.device):
-      clone_grad = optimizer.compute_gradients(sum_loss, **kwargs)
+      if loss_scale != 1.0:
+        clone_grad = optimizer.compute_gradients(sum_loss * loss_scale, **kwargs)
+        clone_grad = [(_scale_gradient(g, 1.0 / loss_scale), v)
+                      for g, v in clone_grad]
+      else:
+        clone_grad = optimizer.compute_gradients(sum_loss, **kwargs)
   return sum_loss, clone_grad
 
 
 def optimize_clones(clones, optimizer,
                     regularization_losses=None,
+                    loss_scale=1.0,
                     **kwargs):
   """Compute clone losses and gradients for the given list of `Clones`.
 
@@ -275,6 +325,10 @@ def optimize_clones(clones, optimizer,
    regularization_losses: Optional list of regularization losses. If None it
      will gather them from tf.GraphKeys.REGULARIZATION_LOSSES. Pass `[]` to
      exclude them.
+   loss_scale: The losses are multiplied by this factor before the backward
+     pass, and the gradients divided by it, so the small gradients of a model
+     computed in float16 do not underflow (see `mixed_precision_getter()`).
+     The total_loss and the gradients returned are unscaled.
    **kwargs: Optional list of keyword arguments to pass to `compute_gradients`.
 
   Returns:
@@ -294,7 +348,8 @@ def optimize_clones(clones, optimizer,
   for clone in clones:
     with tf.name_scope(clone.scope):
       clone_loss, clone_grad = _optimize_clone(
-          optimizer, clone, num_clones, regularization_losses, **kwargs)
+          optimizer, clone, num_clones, regularization_losses, loss_scale,
+          **kwargs)
       if clone_loss is not None:
         clones_losses.append(clone_loss)
         grads_and_vars.append(clone_grad)
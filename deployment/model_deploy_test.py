@@ -461,6 +461,73 @@ class OptimizeclonesTest(tf.test.TestCase):
         self.assertDeviceEqual(g.device, '/job:worker/device:GPU:0')
         self.assertDeviceEqual(v.device, '/job:ps/task:0/CPU:0')
 
+  def testLossScale(self):
+    gradients = []
+    for loss_scale in [1.0, 128.0]:
+      g = tf.Graph()
+      with g.as_default():
+        tf.set_random_seed(0)
+        tf_inputs = tf.constant(self._inputs, dtype=tf.float32)
+        tf_labels = tf.constant(self._labels, dtype=tf.float32)
+
+        model_fn = BatchNormClassifier
+        clone_args = (tf_inputs, tf_labels)
+        deploy_config = model_deploy.DeploymentConfig(num_clones=2,
+                                                      clone_on_cpu=True)
+
+        clones = model_deploy.create_clones(deploy_config, model_fn, clone_args)
+        optimizer = tf.train.GradientDescentOptimizer(learning_rate=1.0)
+        total_loss, grads_and_vars = model_deploy.optimize_clones(
+            clones, optimizer, loss_scale=loss_scale)
+        self.assertEqual(total_loss.op.name, 'total_loss')
+        with self.test_session(graph=g) as sess:
+          sess.run(tf.global_variables_initializer())
+          gradients.append(sess.run([grad for grad, _ in grads_and_vars]))
+    for unscaled, scaled in zip(gradients[0], gradients[1]):
+      self.assertAllClose(unscaled, scaled, rtol=1e-5, atol=1e-6)
+
+  def testMixedPrecision(self):
+    g = tf.Graph()
+    with g.as_default():
+      tf.set_random_seed(0)
+      tf_inputs = tf.constant(self._inputs, dtype=tf.float32)
+      tf_labels = tf.constant(self._labels, dtype=tf.float32)
+
+      def ModelFn(inputs, labels):
+        with tf.variable_scope(
+            tf.get_variable_scope(),
+            custom_getter=model_deploy.mixed_precision_getter(tf.float16)):
+          logits = slim.fully_connected(tf.cast(inputs, tf.float16), 1,
+                                        activation_fn=None,
+                                        scope='fully_connected')
+        self.assertEqual(logits.dtype, tf.float16)
+        predictions = tf.sigmoid(tf.cast(logits, tf.float32))
+        slim.losses.log_loss(predictions, labels)
+        return predictions
+
+      deploy_config = model_deploy.DeploymentConfig(num_clones=1,
+                                                    clone_on_cpu=True)
+      clones = model_deploy.create_clones(deploy_config, ModelFn,
+                                          (tf_inputs, tf_labels))
+      # The master weights are kept in float32
+      self.assertEqual(len(slim.get_variables()), 2)
+      for v in slim.get_variables():
+        self.assertEqual(v.dtype.base_dtype, tf.float32)
+
+      optimizer = tf.train.GradientDescentOptimizer(learning_rate=1.0)
+      total_loss, grads_and_vars = model_deploy.optimize_clones(
+          clones, optimizer, loss_scale=128.0)
+      self.assertEqual(len(grads_and_vars), len(tf.trainable_variables()))
+      for grad, v in grads_and_vars:
+        self.assertEqual(grad.dtype.base_dtype, tf.float32)
+      train_op = optimizer.apply_gradients(grads_and_vars)
+      with self.test_session(graph=g) as sess:
+        sess.run(tf.global_variables_initializer())
+        initial_loss = sess.run(total_loss)
+        for _ in range(10):
+          sess.run(train_op)
+        self.assertLess(sess.run(total_loss), initial_loss)
+
 
 class DeployTest(tf.test.TestCase):
 
@@ -0,0 +1,132 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Durations of the stages of an input and evaluation pipeline, summarized per run.
+
+The stages built in the graph (e.g., the decoding and the augmentation, which run in the threads of
+the input pipeline, or the forward pass) are timed by wrap(), which surrounds the subgraph of a
+function by two timestamps (py_funcs): the first runs when the inputs of the function are ready, and
+gates its ops; the second runs when all its outputs are ready, and records the difference. The
+stages that run in Python are timed by record(). summary() reports, for each stage, the count, the
+total time, the p50 and p95 of the durations, and the images/sec the stage sustains (by itself, in a
+single thread), and write() saves the summary as JSON or CSV.
+
+Usage:
+  timer = stage_timer.StageTimer()
+  images = timer.wrap('augmentation', augment)(image)
+  ...
+  timer.write('timing.json', elapsed=elapsed, num_images=num_images)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+_CSV_COLUMNS = [ 'stage', 'count', 'images', 'total_sec', 'mean_ms', 'p50_ms', 'p95_ms', 'images_per_sec' ]
+
+
+def _map_tensors(fn, structure):
+  """Applies fn to the tensors in a (nested) list, tuple or dict, keeping the other values."""
+  if isinstance(structure, tf.Tensor):
+    return fn(structure)
+  if isinstance(structure, (list, tuple)):
+    return type(structure)(_map_tensors(fn, s) for s in structure)
+  if isinstance(structure, dict):
+    return type(structure)((k, _map_tensors(fn, v)) for k, v in structure.items())
+  return structure
+
+
+def _tensors(structure):
+  tensors = []
+  _map_tensors(tensors.append, structure)
+  return tensors
+
+
+class StageTimer(object):
+  """Collects the durations of the stages of a pipeline, from any thread."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._durations = collections.OrderedDict()
+    self._images = collections.OrderedDict()
+
+  def record(self, stage, seconds, images=1):
+    """Records one run of a stage, which took seconds and handled images."""
+    with self._lock:
+      self._durations.setdefault(stage, []).append(seconds)
+      self._images[stage] = self._images.get(stage, 0) + images
+
+  def wrap(self, stage, fn, images=1):
+    """Returns a function that builds the subgraph of fn, timed at each run as the given stage.
+
+    The arguments and the outputs of fn may be tensors or (nested) lists, tuples and dicts of tensors.
+    All outputs are waited for, so fn must only return tensors that are evaluated anyway.
+    """
+    def record_since(start):
+      seconds = time.time()-start
+      self.record(stage, seconds, images)
+      return np.float64(seconds)
+
+    def timed_fn(*args):
+      with tf.name_scope('%s_timer' % stage):
+        with tf.control_dependencies(_tensors(args)):
+          start = tf.py_func(lambda: np.float64(time.time()), [], tf.float64, stateful=True, name='start')
+      with tf.control_dependencies([ start ]):
+        args = _map_tensors(tf.identity, args)
+      outputs = fn(*args)
+      with tf.name_scope('%s_timer' % stage):
+        with tf.control_dependencies(_tensors(outputs)):
+          stop = tf.py_func(record_since, [ start ], tf.float64, stateful=True, name='stop')
+      with tf.control_dependencies([ stop ]):
+        return _map_tensors(tf.identity, outputs)
+    return timed_fn
+
+  def summary(self, elapsed=None, num_images=None):
+    """Returns the statistics of each stage and, if elapsed and num_images are given, of the run."""
+    with self._lock:
+      durations = [ (stage, np.asarray(d)) for stage, d in self._durations.items() ]
+      images = dict(self._images)
+    stages = []
+    for stage, stage_durations in durations:
+      total = float(np.sum(stage_durations))
+      stages.append(collections.OrderedDict([
+          ('stage',          stage),
+          ('count',          len(stage_durations)),
+          ('images',         images[stage]),
+          ('total_sec',      total),
+          ('mean_ms',        1000.0 * float(np.mean(stage_durations))),
+          ('p50_ms',         1000.0 * float(np.percentile(stage_durations, 50))),
+          ('p95_ms',         1000.0 * float(np.percentile(stage_durations, 95))),
+          ('images_per_sec', images[stage] / total if total>0.0 else float('inf')),
+        ]))
+    summary = collections.OrderedDict([ ('stages', stages) ])
+    if elapsed is not None and num_images is not None:
+      summary['elapsed_sec'] = elapsed
+      summary['images'] = num_images
+      summary['images_per_sec'] = num_images / elapsed if elapsed>0.0 else float('inf')
+    return summary
+
+  def write(self, output_file, elapsed=None, num_images=None):
+    """Writes the summary() to output_file, in CSV if its extension is .csv, and in JSON otherwise.
+
+    In CSV, the run is the last row, as the stage 'total'.
+    """
+    summary = self.summary(elapsed, num_images)
+    with open(output_file, 'wt') as outfile:
+      if output_file.lower().endswith('.csv'):
+        print(', '.join(_CSV_COLUMNS), file=outfile)
+        rows = summary['stages']
+        if 'elapsed_sec' in summary:
+          rows = rows + [ { 'stage' : 'total', 'count' : 1, 'images' : summary['images'],
+                            'total_sec' : summary['elapsed_sec'], 'images_per_sec' : summary['images_per_sec'] } ]
+        for row in rows:
+          print(', '.join(str(row.get(c, '')) for c in _CSV_COLUMNS), file=outfile)
+      else:
+        json.dump(summary, outfile, indent=2)
+    return summary
@@ -0,0 +1,64 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Tests for stage_timer."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import tensorflow as tf
+
+from deployment import stage_timer
+
+
+class StageTimerTest(tf.test.TestCase):
+
+  def testSummary(self):
+    timer = stage_timer.StageTimer()
+    for seconds in [ 0.1 ] * 19 + [ 2.1 ]:
+      timer.record('forward', seconds, images=4)
+    timer.record('decode', 0.5)
+    summary = timer.summary(elapsed=10.0, num_images=80)
+    self.assertEqual([ s['stage'] for s in summary['stages'] ], [ 'forward', 'decode' ])
+    forward = summary['stages'][0]
+    self.assertEqual(forward['count'], 20)
+    self.assertEqual(forward['images'], 80)
+    self.assertAllClose(forward['total_sec'], 4.0)
+    self.assertAllClose(forward['p50_ms'], 100.0)
+    self.assertAllClose(forward['p95_ms'], 200.0)
+    self.assertAllClose(forward['images_per_sec'], 20.0)
+    self.assertAllClose(summary['images_per_sec'], 8.0)
+
+  def testWrap(self):
+    timer = stage_timer.StageTimer()
+    with tf.Graph().as_default():
+      inputs = tf.placeholder(tf.float32, [ 2 ])
+      outputs = timer.wrap('square', lambda x: { 'square' : tf.square(x) }, images=2)(inputs)
+      with tf.Session() as sess:
+        for _ in range(3):
+          self.assertAllClose(sess.run(outputs['square'], feed_dict={ inputs : [ 2.0, 3.0 ] }), [ 4.0, 9.0 ])
+    stages = timer.summary()['stages']
+    self.assertEqual(len(stages), 1)
+    self.assertEqual(stages[0]['count'], 3)
+    self.assertEqual(stages[0]['images'], 6)
+
+  def testWrite(self):
+    timer = stage_timer.StageTimer()
+    timer.record('serialization', 0.01)
+    json_file = os.path.join(self.get_temp_dir(), 'timing.json')
+    timer.write(json_file, elapsed=1.0, num_images=1)
+    with open(json_file, 'rt') as infile:
+      self.assertEqual(json.load(infile)['stages'][0]['stage'], 'serialization')
+    csv_file = os.path.join(self.get_temp_dir(), 'timing.csv')
+    timer.write(csv_file, elapsed=1.0, num_images=1)
+    with open(csv_file, 'rt') as infile:
+      lines = infile.read().splitlines()
+    self.assertEqual(len(lines), 3)
+    self.assertTrue(lines[1].startswith('serialization, 1, 1, '))
+    self.assertTrue(lines[2].startswith('total, 1, 1, 1.0'))
+
+
+if __name__ == '__main__':
+  tf.test.main()
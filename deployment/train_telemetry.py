@@ -0,0 +1,90 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Per-step telemetry of the training: wall time, examples/sec and the fill level of the input queues.
+
+Each step is appended as a row of a compact CSV log, and the averages over the last steps are
+written as summaries. When the input queues stay nearly empty for many consecutive steps, the
+training is starved by its input pipeline (e.g., by the augmentation), and a warning is logged.
+
+Usage, in the train_step_fn of slim.learning.train():
+  telemetry = train_telemetry.StepTelemetry('telemetry.csv', examples_per_step=32,
+                                            queue_names=[ 'batch_queue', 'prefetch_queue' ])
+  ...
+  telemetry.record(step, step_time, queue_fills)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+
+class StepTelemetry(object):
+  """Records the steps of a training, in a CSV log and as summaries, and warns on input starvation.
+
+  Args:
+    log_file: the CSV file, appended to (a restarted training continues the same log).
+    examples_per_step: the number of examples of each step (over all clones).
+    queue_names: the names of the monitored input queues, whose fill levels (from 0.0, empty, to
+      1.0, full) are given to record().
+    summary_writer: a tf.summary.FileWriter for the summaries, or None for no summaries.
+    summary_every_steps: the number of steps averaged in each summary.
+    starvation_fill: the fill level under which a queue is nearly empty.
+    starvation_steps: the number of consecutive steps with a nearly empty queue that trigger the warning.
+  """
+
+  def __init__(self, log_file, examples_per_step, queue_names=(), summary_writer=None,
+               summary_every_steps=100, starvation_fill=0.1, starvation_steps=50):
+    self.examples_per_step = examples_per_step
+    self.queue_names = list(queue_names)
+    self.summary_writer = summary_writer
+    self.summary_every_steps = summary_every_steps
+    self.starvation_fill = starvation_fill
+    self.starvation_steps = starvation_steps
+    self.starved_steps = 0
+    self.starvation_warnings = 0
+    self._window = []
+    new_log = not os.path.exists(log_file) or os.path.getsize(log_file)==0
+    self._log = open(log_file, 'at')
+    if new_log:
+      header = [ 'step', 'step_sec', 'examples_per_sec' ] + [ n + '_fill' for n in self.queue_names ]
+      print(', '.join(header), file=self._log)
+
+  def record(self, step, step_time, queue_fills=()):
+    """Records a step, which took step_time seconds, with the input queues at the given fill levels."""
+    examples_per_sec = self.examples_per_step / step_time if step_time>0.0 else float('inf')
+    row = [ '%d' % step, '%.4f' % step_time, '%.1f' % examples_per_sec ] + [ '%.2f' % f for f in queue_fills ]
+    print(', '.join(row), file=self._log)
+    self._window.append([ step_time, examples_per_sec ] + list(queue_fills))
+    if len(self._window)>=self.summary_every_steps:
+      self._summarize(step)
+
+    # The training is starved when a queue is nearly empty during many consecutive steps
+    if queue_fills and min(queue_fills)<self.starvation_fill:
+      self.starved_steps += 1
+    else:
+      self.starved_steps = 0
+    if self.starved_steps==self.starvation_steps:
+      self.starvation_warnings += 1
+      starved_queues = [ n for n, f in zip(self.queue_names, queue_fills) if f<self.starvation_fill ]
+      tf.logging.warning('The input queue (%s) was below %d%% full for the last %d steps: the training '
+                         'is waiting on the input pipeline. Consider more --num_preprocessing_threads, '
+                         '--batched_augmentation or --input_pipeline=dataset.',
+                         ', '.join(starved_queues), round(100 * self.starvation_fill), self.starvation_steps)
+
+  def _summarize(self, step):
+    means = np.mean(np.asarray(self._window), axis=0)
+    self._window = []
+    self._log.flush()
+    if self.summary_writer is None:
+      return
+    tags = [ 'telemetry/step_sec', 'telemetry/examples_per_sec' ] + \
+           [ 'telemetry/%s_fill' % n for n in self.queue_names ]
+    summary = tf.Summary(value=[ tf.Summary.Value(tag=t, simple_value=float(m)) for t, m in zip(tags, means) ])
+    self.summary_writer.add_summary(summary, step)
+
+  def close(self):
+    self._log.close()
@@ -0,0 +1,70 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Tests for train_telemetry."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from deployment import train_telemetry
+
+
+class StepTelemetryTest(tf.test.TestCase):
+
+  def testLog(self):
+    log_file = os.path.join(self.get_temp_dir(), 'telemetry_log.csv')
+    telemetry = train_telemetry.StepTelemetry(log_file, examples_per_step=32,
+                                              queue_names=[ 'batch_queue', 'prefetch_queue' ])
+    telemetry.record(0, 0.5, [ 1.0, 0.5 ])
+    telemetry.close()
+    # A restarted training appends to the same log, without a new header
+    telemetry = train_telemetry.StepTelemetry(log_file, examples_per_step=32,
+                                              queue_names=[ 'batch_queue', 'prefetch_queue' ])
+    telemetry.record(1, 0.25, [ 0.8, 1.0 ])
+    telemetry.close()
+    with open(log_file, 'rt') as infile:
+      lines = infile.read().splitlines()
+    self.assertEqual(lines, [ 'step, step_sec, examples_per_sec, batch_queue_fill, prefetch_queue_fill',
+                              '0, 0.5000, 64.0, 1.00, 0.50',
+                              '1, 0.2500, 128.0, 0.80, 1.00' ])
+
+  def testStarvationWarning(self):
+    log_file = os.path.join(self.get_temp_dir(), 'telemetry_starvation.csv')
+    telemetry = train_telemetry.StepTelemetry(log_file, examples_per_step=32, queue_names=[ 'batch_queue' ],
+                                              starvation_fill=0.1, starvation_steps=5)
+    for step in range(4):
+      telemetry.record(step, 1.0, [ 0.0 ])
+    # A single step with a full queue resets the count
+    telemetry.record(4, 1.0, [ 1.0 ])
+    self.assertEqual(telemetry.starvation_warnings, 0)
+    for step in range(5, 20):
+      telemetry.record(step, 1.0, [ 0.05 ])
+    # Warns once per starvation episode
+    self.assertEqual(telemetry.starvation_warnings, 1)
+    telemetry.close()
+
+  def testSummaries(self):
+    log_file = os.path.join(self.get_temp_dir(), 'telemetry_summaries.csv')
+    summary_dir = os.path.join(self.get_temp_dir(), 'telemetry_summaries')
+    summary_writer = tf.summary.FileWriter(summary_dir)
+    telemetry = train_telemetry.StepTelemetry(log_file, examples_per_step=10, queue_names=[ 'batch_queue' ],
+                                              summary_writer=summary_writer, summary_every_steps=2)
+    telemetry.record(0, 1.0, [ 0.5 ])
+    telemetry.record(1, 0.5, [ 1.0 ])
+    telemetry.close()
+    summary_writer.close()
+    values = {}
+    for event_file in tf.gfile.Glob(os.path.join(summary_dir, 'events.*')):
+      for event in tf.train.summary_iterator(event_file):
+        for value in event.summary.value:
+          values[value.tag] = value.simple_value
+    self.assertAllClose(values['telemetry/step_sec'], 0.75)
+    self.assertAllClose(values['telemetry/examples_per_sec'], 15.0)
+    self.assertAllClose(values['telemetry/batch_queue_fill'], 0.75)
+
+
+if __name__ == '__main__':
+  tf.test.main()
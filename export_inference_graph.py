@@ -0,0 +1,109 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Exports a checkpoint as a frozen, optimized inference graph, for predict_image_classifier.py.
+
+The graph takes the preprocessed images (input:0, [batch, image_size, image_size, channels]) and
+outputs the logits and the chosen end_points, with the variables replaced by constants, the batch
+normalizations folded into the convolutions, and the training-only ops stripped (see
+deployment/frozen_graph.py). Use it with predict_image_classifier.py --frozen_graph, instead of
+--checkpoint_path.
+
+Usage:
+  python export_inference_graph.py --model_name=inception_v4 --checkpoint_path=model.ckpt-30000 \
+      --dataset_dir=... --feature_end_points=PreLogitsFlatten --output_file=inception_v4_frozen.pb
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from datasets import dataset_factory
+from deployment import frozen_graph
+from nets import nets_factory
+
+tf.app.flags.DEFINE_string(
+    'model_name', 'inception_v4', 'The name of the architecture to export.')
+
+tf.app.flags.DEFINE_string(
+    'checkpoint_path', None,
+    'The directory where the model was written to or an absolute path to a checkpoint file.')
+
+tf.app.flags.DEFINE_integer(
+    'num_classes', None,
+    'The number of classes of the dataset (before subtracting --labels_offset). By default, the number of '
+    'classes of the dataset in --dataset_dir.')
+
+tf.app.flags.DEFINE_string(
+    'dataset_name', 'skin_lesions', 'The name of the dataset, which determines the number of classes.')
+
+tf.app.flags.DEFINE_string(
+    'dataset_dir', None, 'The directory of the dataset, whose metadata gives the number of classes.')
+
+tf.app.flags.DEFINE_integer(
+    'labels_offset', 0, 'An offset for the labels in the dataset (see predict_image_classifier.py).')
+
+tf.app.flags.DEFINE_integer(
+    'image_size', None, 'Size of the input images. By default, the default size of the network.')
+
+tf.app.flags.DEFINE_integer(
+    'num_channels', None, 'Channels of the input images. By default, 4 for the *_seg networks and 3 otherwise.')
+
+tf.app.flags.DEFINE_string(
+    'feature_end_points', 'PreLogitsFlatten',
+    'Comma-separated list of end_points kept as outputs, in addition to the logits (the end_points '
+    'that predict_image_classifier.py --extract_features may extract).')
+
+tf.app.flags.DEFINE_bool(
+    'optimize', True, 'Folds the batch normalizations and constants, and strips the training-only ops.')
+
+tf.app.flags.DEFINE_string(
+    'output_file', None, 'File to output the frozen GraphDef. Its description goes to <output_file>.json.')
+
+FLAGS = tf.app.flags.FLAGS
+
+
+def main(unparsed):
+  unparsed = unparsed[1:]
+  if unparsed:
+    raise ValueError('Unrecognized arguments: %s' % ' '.join(unparsed))
+
+  if not FLAGS.checkpoint_path:
+    raise ValueError('You must supply the checkpoint with --checkpoint_path')
+
+  if not FLAGS.output_file:
+    raise ValueError('You must supply the output file with --output_file')
+
+  if FLAGS.num_classes is None and not FLAGS.dataset_dir:
+    raise ValueError('You must supply the number of classes with --num_classes or the dataset with --dataset_dir')
+
+  tf.logging.set_verbosity(tf.logging.INFO)
+  checkpoint_path = FLAGS.checkpoint_path
+  if tf.gfile.IsDirectory(checkpoint_path):
+    checkpoint_path = tf.train.latest_checkpoint(checkpoint_path)
+
+  if FLAGS.num_classes is None:
+    # Only the number of classes is needed: the metadata of the dataset is read, but not its records
+    dataset = dataset_factory.get_dataset(FLAGS.dataset_name, 'train', FLAGS.dataset_dir)
+    num_classes = dataset.num_classes
+  else:
+    num_classes = FLAGS.num_classes
+  network_fn = nets_factory.get_network_fn(
+      FLAGS.model_name,
+      num_classes=(num_classes - FLAGS.labels_offset),
+      is_training=False)
+  image_size = FLAGS.image_size or network_fn.default_image_size
+  num_channels = FLAGS.num_channels or (4 if FLAGS.model_name.endswith('_seg') else 3)
+  feature_end_points = [ e.strip() for e in FLAGS.feature_end_points.split(',') if e.strip() ]
+
+  tf.logging.info('Freezing %s', checkpoint_path)
+  graph_def, info = frozen_graph.freeze(network_fn, checkpoint_path, image_size, num_channels,
+                                        feature_end_points, optimize=FLAGS.optimize)
+  info['model_name'] = FLAGS.model_name
+  frozen_graph.write(graph_def, info, FLAGS.output_file)
+  tf.logging.info('Wrote %s (%d nodes, %.1f MB)', FLAGS.output_file, len(graph_def.node),
+                  graph_def.ByteSize() / 2.0**20)
+
+
+if __name__ == '__main__':
+  tf.app.run()
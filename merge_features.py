@@ -0,0 +1,67 @@
+# Copyright 2017 Eduardo Valle. All rights reserved.
+# eduardovalle.com/ github.com/learningtitans
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Merges the partial outputs of a sharded feature extraction (predict_image_classifier.py with
+--num_tasks>1) into a single features file, concatenating them in task order."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import argparse
+import os
+import sys
+
+from svm_layer import feature_files as sf
+from svm_layer import utils as su
+
+version_required = (3, 4, 0)
+version_running  = sys.version_info
+if version_running<version_required and '--allow_old_python' not in sys.argv:
+  print('This script requires Python %s or superior, your version: %s' %
+      ('.'.join((str(v) for v in version_required)),
+       '.'.join((str(v) for v in version_running )),), file=sys.stderr)
+  sys.exit(1)
+
+parser = argparse.ArgumentParser(prog='merge_features.py', description='Merge the partial outputs of a sharded feature extraction.')
+parser.add_argument('--output_file', type=str, required=True, help='the --output_file of the extraction (after replacing any placeholders); '
+    'the partial outputs are <output_file>.part-<task>-of-<num_tasks>.')
+parser.add_argument('--num_tasks', type=int, required=True, help='the --num_tasks of the extraction.')
+parser.add_argument('--remove_partials', help='removes the partial outputs after merging them.', action='store_true')
+parser.add_argument('--allow_old_python', help='The script was not tested on Python 2 and will normally require Python 3.4+, '
+    'but this flag allows using older versions (use it at your own risk).', action='store_true')
+FLAGS = parser.parse_args()
+
+
+def main():
+  input_files = [ sf.partial_filename(FLAGS.output_file, t, FLAGS.num_tasks) for t in range(FLAGS.num_tasks) ]
+  missing = [ input_file for input_file in input_files if not os.path.exists(input_file) ]
+  if missing:
+    print('Missing partial outputs (unfinished tasks?):', ' '.join(missing), file=sys.stderr)
+    sys.exit(1)
+  unfinished = [ input_file for t, input_file in enumerate(input_files)
+                 if os.path.exists(sf.progress_filename(FLAGS.output_file, t, FLAGS.num_tasks)) ]
+  if unfinished:
+    print('Unfinished partial outputs (use --resume on their tasks):', ' '.join(unfinished), file=sys.stderr)
+    sys.exit(1)
+
+  start = su.print_and_time('Merging %d partial outputs...' % FLAGS.num_tasks, file=sys.stderr)
+  sf.merge_feature_files(input_files, FLAGS.output_file)
+  if FLAGS.remove_partials:
+    for input_file in input_files:
+      os.remove(input_file)
+  su.print_and_time('', past=start, file=sys.stderr)
+
+
+if __name__ == '__main__':
+  main()
@@ -19,16 +19,30 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import copy
 import datetime
+import os
 import pickle
+import queue
 import signal
 import sys
+import threading
+import time
 
 import tensorflow as tf
+from tensorflow.python.client import timeline
 
+from datasets import augmentation_bank
 from datasets import dataset_factory
+from datasets import image_cache
+from datasets import tf_data_provider
+from deployment import cpu_config
+from deployment import frozen_graph
+from deployment import stage_timer
 from nets import nets_factory
+from preprocessing import dermatologic_preprocessing
 from preprocessing import preprocessing_factory
+from svm_layer import feature_files
 
 import numpy as np
 import sklearn.metrics
@@ -46,12 +60,14 @@ if version_running<version_required and '--allow_old_python' not in sys.argv:
 
 _PREDICTION_OUTPUT_FORMAT='%.16f'
 _TIMEOUT_PER_TEST_IN_MS=12000
+_PREDICTION_LISTS=[ 'list_ids', 'list_labels', 'list_scores', 'list_predictions' ]
 
 tf.app.flags.DEFINE_integer(
     'random_seed', 0, 'The random generator seed.')
 
 tf.app.flags.DEFINE_integer(
-    'batch_size', 1, 'The number of samples in each batch.')
+    'batch_size', 1, 'The number of samples in each batch. All replicas of the samples in a batch '
+    'are evaluated in a single forward pass (the network sees batch_size*eval_replicas images).')
 
 tf.app.flags.DEFINE_string(
     'master', '', 'The address of the TensorFlow master to use.')
@@ -59,7 +75,15 @@ tf.app.flags.DEFINE_string(
 tf.app.flags.DEFINE_string(
     'checkpoint_path', '/tmp/tfmodel/',
     'The directory where the model was written to or an absolute path to a '
-    'checkpoint file.')
+    'checkpoint file. A comma-separated list evaluates several checkpoints in a single pass over '
+    'the data; in that case --output_file must contain the placeholder {checkpoint}, which is '
+    'replaced by the base name of each checkpoint.')
+
+tf.app.flags.DEFINE_string(
+    'frozen_graph', None,
+    'A frozen inference graph, exported by export_inference_graph.py, evaluated instead of building '
+    'the network and restoring --checkpoint_path. Only the end_points exported with the graph can '
+    'be extracted.')
 
 tf.app.flags.DEFINE_string(
     'eval_dir', '/tmp/tfmodel/', 'Directory where the results are saved to.')
@@ -68,6 +92,22 @@ tf.app.flags.DEFINE_integer(
     'num_preprocessing_threads', 4,
     'The number of threads used to create the batches.')
 
+tf.app.flags.DEFINE_integer(
+    'num_readers', 4,
+    'The number of data files read in parallel by --input_pipeline=dataset, which interleaves them in '
+    'a fixed pattern. The queue pipeline always uses a single reader, since parallel readers do not '
+    'keep the order of the samples.')
+
+tf.app.flags.DEFINE_string(
+    'input_pipeline', 'queue',
+    'The input pipeline: queue (slim DatasetDataProvider with queue runners) or dataset (tf.data, '
+    'with parallel interleaved reading, parallel decoding and preprocessing fused with the '
+    'batching, and prefetch; requires TensorFlow 1.9+).')
+
+tf.app.flags.DEFINE_integer(
+    'prefetch_batches', 2,
+    'The number of batches prefetched by --input_pipeline=dataset.')
+
 tf.app.flags.DEFINE_string(
     'dataset_name', 'skin_lesion', 'The name of the dataset to load.')
 
@@ -95,20 +135,100 @@ tf.app.flags.DEFINE_string(
 tf.app.flags.DEFINE_integer(
     'eval_image_size', None, 'Eval image size')
 
+tf.app.flags.DEFINE_string(
+    'image_cache_dir', None,
+    'Directory of a cache of decoded and resized images (built on the first pass over each split, '
+    'and reused by the following passes), so only the preprocessing of the replicas runs per pass.')
+
+tf.app.flags.DEFINE_integer(
+    'image_cache_size', None,
+    'Size of the longer side of the images in --image_cache_dir (their aspect ratio is preserved). By '
+    'default, twice the eval image size, so the crops of the preprocessing are downscaled from the cached '
+    'images, not upsampled.')
+
 tf.app.flags.DEFINE_integer(
     'eval_replicas', 50, 'Number of replicas of the image to be evaluated. If >1 test augmentation.')
 
+tf.app.flags.DEFINE_bool(
+    'batched_augmentation', False,
+    'With --eval_replicas>1 and the dermatologic preprocessing, creates all replicas with a single '
+    'vectorized augmentation subgraph (per-replica crops, flips, colors and rotations), instead of '
+    'one subgraph per replica. The crops are always resized with bilinear interpolation, and the '
+    'random replicas differ from the ones of the per-replica subgraphs.')
+
+tf.app.flags.DEFINE_bool(
+    'augmentation_bank', False,
+    'With --batched_augmentation, takes the crops, flips, colors and rotations of the replicas from a '
+    'bank of pre-generated parameters (generated on the first use, and stored next to the dataset), so '
+    'repeated runs evaluate exactly the same replicas. Requires --id_field_name=id.')
+
+tf.app.flags.DEFINE_integer(
+    'augmentation_bank_seed', 0, 'Seed of the parameters in the --augmentation_bank.')
+
+tf.app.flags.DEFINE_string(
+    'augmentation_bank_path', None,
+    'File of the --augmentation_bank. By default, augmentation_bank_<split>_<eval_replicas>_<seed>.npz '
+    'in the dataset directory.')
+
 tf.app.flags.DEFINE_string(
     'id_field_name', None, 'The name of the field in the dataset metadata to identify the predictions.')
 
 tf.app.flags.DEFINE_string(
-    'output_file', None, 'File to output predictions or features, by default the standard output.')
+    'output_file', None, 'File to output predictions or features, by default the standard output. '
+    'When extracting features from several --feature_end_points, the file name must contain the '
+    'placeholder {end_point}, which is replaced by the name of each end_point.')
 
 tf.app.flags.DEFINE_string(
     'metrics_file', None, 'File to append metrics, in addition to the standard output.')
 
 tf.app.flags.DEFINE_string(
-    'output_format', 'text', 'Format of the output: text or (only with --extract_features) pickle.')
+    'output_format', 'text', 'Format of the output: text or (only with --extract_features) pickle or columnar. '
+    'The columnar format stores the features as a contiguous float32 block, which the SVM layer scripts '
+    'memory-map directly.')
+
+tf.app.flags.DEFINE_integer(
+    'output_chunk_size', 256,
+    'Number of feature vectors accumulated before each (bulk) write to --output_file.')
+
+tf.app.flags.DEFINE_bool(
+    'output_in_background', False,
+    'Serializes and writes the feature vectors in a background thread.')
+
+tf.app.flags.DEFINE_integer(
+    'output_queue_size', 2,
+    'Maximum number of evaluated batches waiting for the output thread, which pools, formats and '
+    'writes them while the next batch is evaluated. If 0, the output is processed inline.')
+
+tf.app.flags.DEFINE_integer(
+    'num_tasks', 1,
+    'Number of tasks of a sharded feature extraction. Each task reads a disjoint block of the data '
+    'files of the split, and writes a partial output, <output_file>.part-<task>-of-<num_tasks>. '
+    'The partial outputs are concatenated, in task order, by merge_features.py.')
+
+tf.app.flags.DEFINE_integer(
+    'task_index', 0, 'Index (0 to --num_tasks-1) of the task of a sharded feature extraction.')
+
+tf.app.flags.DEFINE_integer(
+    'progress_every_batches', 100,
+    'Every this many batches, syncs the outputs to disk and records the progress (the number of '
+    'batches done and the offsets of the output files) next to each output file, in <output file>.progress, '
+    'so an interrupted run can be continued with --resume. If 0, no progress is recorded.')
+
+tf.app.flags.DEFINE_bool(
+    'resume', False,
+    'Continues an interrupted run from its last recorded progress: the output files are truncated '
+    'to the recorded offsets, and the samples already written are skipped. Requires --output_file.')
+
+tf.app.flags.DEFINE_string(
+    'timing_file', None,
+    'File to output the time per stage of the run (dequeue, decode, augmentation, forward, pooling, '
+    'serialization): the count, total, p50 and p95 of the durations, and the images/sec, in CSV if the '
+    'name ends with .csv, and in JSON otherwise. Timing adds a few ops per sample and per batch.')
+
+tf.app.flags.DEFINE_integer(
+    'trace_step', None,
+    'Runs this batch with full tracing, and writes its timeline to <timing_file>.trace-<step>.json '
+    '(open in chrome://tracing). Requires --timing_file.')
 
 tf.app.flags.DEFINE_string(
     'pool_features', 'avg',
@@ -128,6 +248,12 @@ tf.app.flags.DEFINE_bool(
     'extract_features', False,
     'Extracts features instead of predictions to output_file. No metrics will be computed.')
 
+tf.app.flags.DEFINE_string(
+    'feature_end_points', 'PreLogitsFlatten',
+    'Comma-separated list of end_points to extract with --extract_features, e.g., '
+    'Mixed_7d,PreLogitsFlatten,Logits. All are extracted in a single pass, each to its own file. '
+    'Spatial end_points are globally average-pooled before pooling across replicas.')
+
 tf.app.flags.DEFINE_string(
     'add_scores_to_features', 'none',
     'Adds model decisions at the end of the feature vector as part of it. Valid options are: '
@@ -145,6 +271,20 @@ tf.app.flags.DEFINE_bool(
     'fixed_memory', False,
     'Allocates the entire memory at once.')
 
+tf.app.flags.DEFINE_integer(
+    'intra_op_parallelism_threads', 0,
+    'Threads available to each op (e.g., a convolution). If 0, TensorFlow chooses (all cores of the '
+    'host, or all cores in --cpu_affinity).')
+
+tf.app.flags.DEFINE_integer(
+    'inter_op_parallelism_threads', 0,
+    'Ops run in parallel. If 0, TensorFlow chooses (all cores of the host, or all cores in --cpu_affinity).')
+
+tf.app.flags.DEFINE_string(
+    'cpu_affinity', None,
+    'Pins the process to a list of cores, e.g., 0-7 or 0-3,8-11, so several jobs on one host do not '
+    'contend for the same cores. See tune_threads.py to find the best settings for a model.')
+
 tf.app.flags.DEFINE_bool(
     'aggressive_augmentation', False, 'Turn off fast_mode on preprocessing')
 
@@ -167,6 +307,67 @@ tf.app.flags.DEFINE_bool(
 
 FLAGS = tf.app.flags.FLAGS
 
+
+class OutputPipeline(object):
+  """Hands the results of each batch to a consumer, in order, from a thread fed by a bounded queue.
+
+  The main loop may then start the next sess.run while the previous results are concatenated,
+  formatted and written. With max_pending_batches=0, the consumer runs inline, in the caller.
+  Keeps the time the caller waited on put() and the time spent by the consumer.
+  """
+
+  def __init__(self, consumer, max_pending_batches):
+    self._consumer = consumer
+    self._error = None
+    self.wait_time = 0.0
+    self.busy_time = 0.0
+    if max_pending_batches>0:
+      self._queue = queue.Queue(maxsize=max_pending_batches)
+      self._thread = threading.Thread(target=self._consume_loop, name='output_pipeline')
+      self._thread.daemon = True
+      self._thread.start()
+    else:
+      self._queue = None
+      self._thread = None
+
+  def _consume(self, args):
+    busy_start = time.time()
+    self._consumer(*args)
+    self.busy_time += time.time()-busy_start
+
+  def _consume_loop(self):
+    while True:
+      args = self._queue.get()
+      if args is None:
+        break
+      if self._error is None:
+        try:
+          self._consume(args)
+        except Exception as error: # Re-raised by the caller on the next put() or on close()
+          self._error = error
+
+  def _check_error(self):
+    if self._error is not None:
+      raise RuntimeError('the output thread failed: %s' % self._error)
+
+  def put(self, *args):
+    wait_start = time.time()
+    if self._queue is None:
+      self._consume(args)
+    else:
+      self._check_error()
+      self._queue.put(args)
+    self.wait_time += time.time()-wait_start
+
+  def close(self):
+    if self._thread is not None:
+      wait_start = time.time()
+      self._queue.put(None)
+      self._thread.join()
+      self._thread = None
+      self.wait_time += time.time()-wait_start
+    self._check_error()
+
 def main(unparsed):
 
   this_app_path = unparsed[0]
@@ -205,19 +406,72 @@ def main(unparsed):
       (FLAGS.pool_scores=='none' or FLAGS.pool_features=='none')):
     raise ValueError('Option --pool_features=none requires --pool_scores=none and vice-versa when extracting both features and decisions')
 
-  valid_output_formats = [ 'text', 'pickle' ]
+  valid_output_formats = [ 'text', 'pickle', 'columnar' ]
   if not FLAGS.output_format in valid_output_formats:
     raise ValueError('Option --output_format must be one of ' + ' '.join(valid_output_formats))
 
-  if FLAGS.output_format=='pickle' and not FLAGS.extract_features:
-    raise ValueError('Option --output_format=pickle requires --extract_features')
+  if FLAGS.output_format!='text' and not FLAGS.extract_features:
+    raise ValueError('Option --output_format=%s requires --extract_features' % FLAGS.output_format)
+
+  if FLAGS.output_format!='text' and not FLAGS.output_file:
+    raise ValueError('Option --output_format=%s requires --output_file' % FLAGS.output_format)
 
-  if FLAGS.output_format=='pickle' and not FLAGS.output_file:
-    raise ValueError('Option --output_format=pickle requires --output_file')
+  feature_end_points = [ e.strip() for e in FLAGS.feature_end_points.split(',') if e.strip() ]
+  if not feature_end_points:
+    raise ValueError('Option --feature_end_points must list at least one end_point')
+
+  if FLAGS.feature_end_points!='PreLogitsFlatten' and not FLAGS.extract_features:
+    raise ValueError('Option --feature_end_points must be used with --extract_features')
+
+  if len(feature_end_points)>1 and (not FLAGS.output_file or '{end_point}' not in FLAGS.output_file):
+    raise ValueError('Option --feature_end_points with several end_points requires an --output_file '
+                     'with the placeholder {end_point}')
 
   if not FLAGS.normalize_per_image in [0, 1, 2]:
     raise ValueError('Invalid value for --normalize_per_image: must be 0, 1 or 2')
 
+  if FLAGS.resume and not FLAGS.output_file:
+    raise ValueError('Option --resume requires --output_file')
+
+  if FLAGS.num_tasks<1 or not 0<=FLAGS.task_index<FLAGS.num_tasks:
+    raise ValueError('Option --task_index must be between 0 and --num_tasks-1')
+
+  if FLAGS.num_tasks>1 and not (FLAGS.extract_features and FLAGS.output_file):
+    raise ValueError('Option --num_tasks>1 requires --extract_features and --output_file')
+
+  if FLAGS.trace_step is not None and not FLAGS.timing_file:
+    raise ValueError('Option --trace_step requires --timing_file')
+
+  valid_input_pipelines = [ 'queue', 'dataset' ]
+  if not FLAGS.input_pipeline in valid_input_pipelines:
+    raise ValueError('Option --input_pipeline must be one of ' + ' '.join(valid_input_pipelines))
+
+  if FLAGS.augmentation_bank and not (FLAGS.eval_replicas>1 and FLAGS.batched_augmentation and
+                                      FLAGS.preprocessing_name=='dermatologic'):
+    raise ValueError('Option --augmentation_bank requires --eval_replicas>1, --batched_augmentation '
+                     'and --preprocessing_name=dermatologic')
+
+  if FLAGS.augmentation_bank and FLAGS.id_field_name!='id':
+    raise ValueError('Option --augmentation_bank requires --id_field_name=id')
+
+  checkpoint_paths = []
+  if FLAGS.frozen_graph:
+    frozen_graph_def, frozen_info = frozen_graph.read(FLAGS.frozen_graph)
+    checkpoint_paths.append(FLAGS.frozen_graph)
+  else:
+    for checkpoint_path in FLAGS.checkpoint_path.split(','):
+      checkpoint_path = checkpoint_path.strip()
+      if tf.gfile.IsDirectory(checkpoint_path):
+        checkpoint_path = tf.train.latest_checkpoint(checkpoint_path)
+      checkpoint_paths.append(checkpoint_path)
+
+  if len(checkpoint_paths)>1 and (not FLAGS.output_file or '{checkpoint}' not in FLAGS.output_file):
+    raise ValueError('Option --checkpoint_path with several checkpoints requires an --output_file '
+                     'with the placeholder {checkpoint}')
+
+  # Pins the process before the session creates its thread pools, which inherit the affinity
+  cpus = cpu_config.set_cpu_affinity(FLAGS.cpu_affinity) if FLAGS.cpu_affinity else None
+
   tf.logging.set_verbosity(tf.logging.INFO)
   with tf.Graph().as_default():
     # tf_global_step = slim.get_or_create_global_step()
@@ -225,8 +479,30 @@ def main(unparsed):
     ######################
     # Select the dataset #
     ######################
-    dataset = dataset_factory.get_dataset(
-        FLAGS.dataset_name, FLAGS.dataset_split_name, FLAGS.dataset_dir)
+    if FLAGS.id_field_name:
+      field_id = FLAGS.id_field_name
+    else:
+      field_id = FLAGS.task_name
+
+    # Only the input field, the id and the task label are parsed from each record
+    split_dataset = dataset_factory.get_dataset(
+        FLAGS.dataset_name, FLAGS.dataset_split_name, FLAGS.dataset_dir,
+        items=[ field_id, FLAGS.task_name ])
+    if FLAGS.num_tasks>1:
+      dataset = tf_data_provider.shard_dataset(split_dataset, FLAGS.task_index, FLAGS.num_tasks)
+      tf.logging.info('Task %d of %d: %d samples in %s', FLAGS.task_index, FLAGS.num_tasks,
+                      dataset.num_samples, ', '.join(dataset.data_sources))
+    else:
+      dataset = split_dataset
+
+    # The stages are timed by ops added around their subgraphs (see deployment/stage_timer.py)
+    timer = stage_timer.StageTimer() if FLAGS.timing_file else None
+    def timed(stage, fn, images=1):
+      return timer.wrap(stage, fn, images) if timer else fn
+    if timer:
+      dataset = copy.copy(dataset)
+      dataset.decoder = copy.copy(dataset.decoder)
+      dataset.decoder.decode = timed('decode', dataset.decoder.decode)
 
     ####################
     # Select the model #
@@ -237,22 +513,6 @@ def main(unparsed):
         num_classes=num_classes,
         is_training=False)
 
-    ##############################################################
-    # Create a dataset provider that loads data from the dataset #
-    ##############################################################
-    provider = slim.dataset_data_provider.DatasetDataProvider(
-        dataset,
-        shuffle=False,
-        common_queue_capacity=max(64, 2 * FLAGS.batch_size),
-        common_queue_min=0)
-
-    if FLAGS.id_field_name:
-      field_id = FLAGS.id_field_name
-    else:
-      field_id = FLAGS.task_name
-    [image, image_id, label] = provider.get([dataset.input_field, field_id, FLAGS.task_name])
-    label -= FLAGS.labels_offset
-
     #####################################
     # Select the preprocessing function #
     #####################################
@@ -263,6 +523,20 @@ def main(unparsed):
 
     eval_image_size = FLAGS.eval_image_size or network_fn.default_image_size
 
+    if FLAGS.frozen_graph:
+      eval_image_size = FLAGS.eval_image_size or frozen_info['image_size']
+      if frozen_info['image_size']!=eval_image_size or frozen_info['num_classes']!=num_classes:
+        raise ValueError('The frozen graph %s was exported for images of size %d and %d classes' %
+                         (FLAGS.frozen_graph, frozen_info['image_size'], frozen_info['num_classes']))
+
+    if FLAGS.augmentation_bank:
+      bank_path = FLAGS.augmentation_bank_path or augmentation_bank.default_bank_path(
+          FLAGS.dataset_dir, FLAGS.dataset_split_name, FLAGS.eval_replicas, FLAGS.augmentation_bank_seed)
+      # The bank covers the whole split, so it is shared by all tasks of a sharded run
+      bank = augmentation_bank.AugmentationBank(bank_path, split_dataset, FLAGS.dataset_split_name,
+          FLAGS.eval_replicas, FLAGS.augmentation_bank_seed,
+          area_range=(FLAGS.minimum_area_to_crop, 1.0))
+
     def preprocess(img):
       if FLAGS.preprocessing_name=='dermatologic':
         return image_preprocessing_fn(img, eval_image_size, eval_image_size,
@@ -274,92 +548,276 @@ def main(unparsed):
       else:
         return image_preprocessing_fn(img, eval_image_size, eval_image_size)
 
-    if FLAGS.eval_replicas>1:
-      aug_list = []
-      for r in range(FLAGS.eval_replicas):
-        aug_list.append(preprocess(image))
-    else:
-      aug_list = [ preprocess(image) for r in range(FLAGS.eval_replicas) ]
+    def augment(image, image_id, label):
+      label -= FLAGS.labels_offset
+      if FLAGS.eval_replicas>1 and FLAGS.batched_augmentation and FLAGS.preprocessing_name=='dermatologic':
+        # All replicas are cropped and distorted as a single batch, by a single subgraph
+        image_aug = dermatologic_preprocessing.preprocess_batch_for_train(
+            tf.expand_dims(image, 0), eval_image_size, eval_image_size,
+            num_crops=FLAGS.eval_replicas,
+            fast_mode=not FLAGS.aggressive_augmentation,
+            area_range=(FLAGS.minimum_area_to_crop, 1.0),
+            add_rotations=FLAGS.add_rotations,
+            normalize_per_image=FLAGS.normalize_per_image,
+            augmentation_params=bank.lookup(image_id) if FLAGS.augmentation_bank else None)
+        # tf.train.batch, in the queue pipeline, requires fully defined shapes
+        image_aug.set_shape([ FLAGS.eval_replicas, eval_image_size, eval_image_size, 3 ])
+        return image_aug, image_id, label
+      if FLAGS.eval_replicas>1:
+        aug_list = []
+        for r in range(FLAGS.eval_replicas):
+          aug_list.append(preprocess(image))
+      else:
+        aug_list = [ preprocess(image) for r in range(FLAGS.eval_replicas) ]
+      image_aug  = tf.stack(aug_list)
+      return image_aug, image_id, label
+
+    ########################################################
+    # Recover the recorded progress of an interrupted run #
+    ########################################################
+    def output_name(checkpoint_path, end_point=None):
+      output_file = FLAGS.output_file.replace('{checkpoint}', os.path.basename(checkpoint_path))
+      if end_point is not None:
+        output_file = output_file.replace('{end_point}', end_point)
+      return output_file
+
+    def output_path(checkpoint_path, end_point=None):
+      # Each task of a sharded run writes a partial output, merged by merge_features.py
+      return feature_files.partial_filename(output_name(checkpoint_path, end_point),
+                                            FLAGS.task_index, FLAGS.num_tasks)
+
+    progress = None
+    progress_path = None
+    if FLAGS.output_file:
+      # The same progress is recorded next to each output, where merge_features.py looks for it
+      progress_paths = [ feature_files.progress_filename(output_name(checkpoint_path, end_point),
+                                                         FLAGS.task_index, FLAGS.num_tasks)
+                         for checkpoint_path in checkpoint_paths
+                         for end_point in (feature_end_points if FLAGS.extract_features else [ None ]) ]
+      progress_path = progress_paths[0]
+      progress_key = {
+          'checkpoint_paths'   : checkpoint_paths,
+          'dataset'            : (FLAGS.dataset_name, FLAGS.dataset_split_name, dataset.num_samples),
+          'task'               : (FLAGS.task_index, FLAGS.num_tasks),
+          'batch_size'         : FLAGS.batch_size,
+          'eval_replicas'      : FLAGS.eval_replicas,
+          'output_format'      : FLAGS.output_format,
+          'extract_features'   : FLAGS.extract_features,
+          'feature_end_points' : feature_end_points,
+        }
+      if FLAGS.resume and os.path.exists(progress_path):
+        with open(progress_path, 'rb') as progress_file:
+          progress = pickle.load(progress_file)
+        if progress['key']!=progress_key:
+          raise ValueError('Cannot resume from %s, which was recorded with different options' % progress_path)
+        tf.logging.info('Resuming from %s: %d batches already done', progress_path, progress['batches_done'])
+      elif FLAGS.resume:
+        tf.logging.info('No progress recorded in %s, starting from the beginning', progress_path)
+      else:
+        # A new run overwrites the outputs, so the progress of the previous one is obsolete
+        for path in progress_paths:
+          if os.path.exists(path):
+            os.remove(path)
+    first_batch = progress['batches_done'] if progress else 0
 
-    image_aug  = tf.stack(aug_list)
+    ##############################################################
+    # Create a dataset provider that loads data from the dataset #
+    ##############################################################
+    # Packs several images (each with all its replicas) in a single forward pass. The samples are
+    # kept in a deterministic order: the tf.data pipeline interleaves the shards in a fixed pattern,
+    # and the queue pipeline uses a single batching thread.
+    batch_size = FLAGS.batch_size
+    if FLAGS.image_cache_dir:
+      image_cache_size = FLAGS.image_cache_size or 2*eval_image_size
+      if image_cache_size<2*eval_image_size:
+        tf.logging.warning('The crops of the preprocessing are upsampled from the cached images of size %d: '
+                           'consider --image_cache_size=%d or more', image_cache_size, 2*eval_image_size)
+      cache = image_cache.ImageCache(FLAGS.image_cache_dir, dataset, FLAGS.dataset_name,
+          FLAGS.dataset_split_name, image_cache_size,
+          [ field_id, FLAGS.task_name ], hide_progress=FLAGS.hide_progress)
+      # The cached images are already decoded: their reading is timed as the decoding
+      cache.lookup = timed('decode', cache.lookup)
+    augment_fn = timed('augmentation', augment)
+    if FLAGS.image_cache_dir and FLAGS.input_pipeline=='dataset':
+      batches = tf_data_provider.make_batched_lookup_dataset(
+          cache.num_samples, cache.lookup,
+          preprocess_fn=augment_fn,
+          batch_size=batch_size,
+          num_parallel_calls=FLAGS.num_preprocessing_threads,
+          prefetch_batches=FLAGS.prefetch_batches,
+          skip=first_batch*batch_size)
+      batch_queue = tf_data_provider.DatasetQueue(batches, batch_size)
+      images_aug, images_id, labels = timed('dequeue', batch_queue.dequeue, batch_size)()
+    elif FLAGS.input_pipeline=='dataset':
+      batches = tf_data_provider.make_batched_dataset(
+          dataset, [dataset.input_field, field_id, FLAGS.task_name],
+          preprocess_fn=augment_fn,
+          batch_size=batch_size,
+          shuffle=False,
+          num_readers=FLAGS.num_readers,
+          num_parallel_calls=FLAGS.num_preprocessing_threads,
+          prefetch_batches=FLAGS.prefetch_batches,
+          skip=first_batch*batch_size)
+      batch_queue = tf_data_provider.DatasetQueue(batches, batch_size)
+      images_aug, images_id, labels = timed('dequeue', batch_queue.dequeue, batch_size)()
+    else:
+      if FLAGS.image_cache_dir:
+        [image, image_id, label] = cache.get()
+      else:
+        provider = slim.dataset_data_provider.DatasetDataProvider(
+            dataset,
+            shuffle=False,
+            # A single reader keeps the order of the samples, on which --resume relies
+            num_readers=1,
+            common_queue_capacity=max(64, 2 * FLAGS.batch_size),
+            common_queue_min=0)
+        [image, image_id, label] = provider.get([dataset.input_field, field_id, FLAGS.task_name])
+      image_aug, image_id, label = augment_fn(image, image_id, label)
+      images_aug, images_id, labels = timed('dequeue', lambda: tf.train.batch(
+          [image_aug, image_id, label],
+          batch_size=batch_size,
+          num_threads=1,
+          capacity=2 * batch_size), batch_size)()
 
     ####################
     # Define the model #
     ####################
-    logits, end_points = network_fn(image_aug)
-
-    variables_to_restore = slim.get_variables_to_restore()
-
-    def tf_reduce_maxabs_axis_0(tensor):
-      xtrm_rows  = tf.argmax(tf.abs(tensor), axis=0)
-      xtrm_cols  = tf.range(num_classes, dtype=tf.int64)
-      # For other axes the indexing below must change
-      xtrm_index = tf.transpose(tf.stack([xtrm_rows, xtrm_cols]))
-      return tf.gather_nd(tensor, xtrm_index)
-
-    pooled_features = True
-    nada = tf.constant([float('nan')])
-    if FLAGS.extract_features:
-      features = end_points['PreLogitsFlatten']
+    replica_shape = images_aug.get_shape().as_list()[2:]
+    images_flat = tf.reshape(images_aug, [-1] + replica_shape)
+
+    def regroup_replicas(tensor):
+      # [batch_size*eval_replicas, ...] => [batch_size, eval_replicas, ...]
+      tensor_shape = tensor.get_shape().as_list()[1:]
+      return tf.reshape(tensor, [batch_size, FLAGS.eval_replicas] + tensor_shape)
+
+    def tf_reduce_maxabs(tensor, axis):
+      # Keeps, for each coordinate, the value with the largest magnitude along the axis
+      xtrm_index = tf.argmax(tf.abs(tensor), axis=axis)
+      xtrm_mask  = tf.one_hot(xtrm_index, tf.shape(tensor)[axis], axis=axis, dtype=tensor.dtype)
+      return tf.reduce_sum(tensor*xtrm_mask, axis=axis)
+
+    def feature_end_point(end_points, end_point):
+      if end_point not in end_points:
+        raise ValueError('Invalid end_point for model %s: %s (valid end_points: %s)' %
+                         (FLAGS.model_name, end_point, ', '.join(sorted(end_points.keys()))))
+      return end_points[end_point]
+
+    def pool_features(features):
+      # Pools spatial end_points globally
+      features_rank = len(features.get_shape())
+      if features_rank>2:
+        features = tf.reduce_mean(features, axis=list(range(1, features_rank-1)))
+      features = regroup_replicas(features)
       # Pools across replicas
       if FLAGS.pool_features == 'avg':
-        features = tf.reduce_mean(features, axis=0)
+        features = tf.reduce_mean(features, axis=1)
       elif FLAGS.pool_features == 'max':
-        features = tf.reduce_max(features, axis=0)
+        features = tf.reduce_max(features, axis=1)
       elif FLAGS.pool_features == 'xtrm':
-        features = tf_reduce_maxabs_axis_0(features)
+        features = tf_reduce_maxabs(features, axis=1)
       elif FLAGS.pool_features == 'none':
-        pooled_features = False
+        pass
       else:
         assert False, "Invalid FLAGS.pool_features: '%s'" % FLAGS.pool_features
-      feature_size = int(features.get_shape()[0 if pooled_features else 1])
-    else:
-      features = nada
-      feature_size = 0
-
-    pooled_scores = True
-    # Pools across replicas
-    if FLAGS.pool_scores == 'avg':
-      probabilities = tf.nn.softmax(logits)
-      probabilities = tf.reduce_mean(probabilities, axis=0)
-      logits_out    = tf.reduce_mean(logits, axis=0)
-    elif FLAGS.pool_scores == 'avg_logits':
-      logits_out    = tf.reduce_mean(logits, axis=0)
-      probabilities = tf.nn.softmax(logits_out)
-    elif FLAGS.pool_scores == 'max':
-      probabilities = tf.nn.softmax(logits)
-      probabilities = tf.reduce_max(probabilities, axis=0)
-      logits_out    = tf.reduce_max(logits, axis=0)
-    elif FLAGS.pool_scores == 'max_logits':
-      logits_out    = tf.reduce_max(logits, axis=0)
-      probabilities = tf.nn.softmax(logits_out)
-    elif FLAGS.pool_scores == 'xtrm_logits':
-      logits_out    = tf_reduce_maxabs_axis_0(logits)
-      probabilities = tf.nn.softmax(logits_out)
-    elif FLAGS.pool_scores == 'none':
-      probabilities = tf.nn.softmax(logits)
-      logits_out    = logits
-      pooled_scores = False
-    else:
-      assert False, "Invalid FLAGS.pool_scores: '%s'" % FLAGS.pool_scores
+      return features
+
+    def pool_scores(logits):
+      logits = regroup_replicas(logits)
+      # Pools across replicas
+      if FLAGS.pool_scores == 'avg':
+        probabilities = tf.nn.softmax(logits)
+        probabilities = tf.reduce_mean(probabilities, axis=1)
+        logits_out    = tf.reduce_mean(logits, axis=1)
+      elif FLAGS.pool_scores == 'avg_logits':
+        logits_out    = tf.reduce_mean(logits, axis=1)
+        probabilities = tf.nn.softmax(logits_out)
+      elif FLAGS.pool_scores == 'max':
+        probabilities = tf.nn.softmax(logits)
+        probabilities = tf.reduce_max(probabilities, axis=1)
+        logits_out    = tf.reduce_max(logits, axis=1)
+      elif FLAGS.pool_scores == 'max_logits':
+        logits_out    = tf.reduce_max(logits, axis=1)
+        probabilities = tf.nn.softmax(logits_out)
+      elif FLAGS.pool_scores == 'xtrm_logits':
+        logits_out    = tf_reduce_maxabs(logits, axis=1)
+        probabilities = tf.nn.softmax(logits_out)
+      elif FLAGS.pool_scores == 'none':
+        probabilities = tf.nn.softmax(logits)
+        logits_out    = logits
+      else:
+        assert False, "Invalid FLAGS.pool_scores: '%s'" % FLAGS.pool_scores
+      return probabilities, logits_out
 
+    def pool(logits, raw_features):
+      probabilities, logits_out = pool_scores(logits)
+      return probabilities, logits_out, [ pool_features(f) for f in raw_features ]
+
+    pooled_features = FLAGS.pool_features != 'none'
+    pooled_scores   = FLAGS.pool_scores != 'none'
     assert pooled_scores==pooled_features
 
-    # Predicts across classes (on each replica, if not pooled)
-    predictions = tf.argmax(probabilities, axis=0 if pooled_scores else 1)
+    # All checkpoints share the input pipeline: each batch is decoded and augmented once, and then
+    # evaluated by every checkpoint, whose variables are kept resident in separate scopes.
+    nada = tf.constant([float('nan')])
+    models = []
+    for c, checkpoint_path in enumerate(checkpoint_paths):
+      model_scope = 'checkpoint_%d' % c if len(checkpoint_paths)>1 else None
+
+      def forward(images):
+        if FLAGS.frozen_graph:
+          logits, end_points = frozen_graph.import_network(frozen_graph_def, frozen_info, images)
+        elif model_scope:
+          with tf.variable_scope(model_scope):
+            logits, end_points = network_fn(images)
+        else:
+          logits, end_points = network_fn(images)
+        # Only the outputs used are returned, so the timing does not force the others to be computed
+        if FLAGS.extract_features:
+          return logits, [ feature_end_point(end_points, e) for e in feature_end_points ]
+        return logits, []
+
+      logits, raw_features = timed('forward', forward, batch_size)(images_flat)
+      if FLAGS.frozen_graph:
+        # The weights are constants in the graph: there is nothing to restore
+        variables_to_restore = None
+      elif model_scope:
+        variables_to_restore = { v.op.name[len(model_scope)+1:] : v
+                                 for v in slim.get_variables(scope=model_scope+'/') }
+      else:
+        variables_to_restore = slim.get_variables_to_restore()
+
+      probabilities, logits_out, features = timed('pooling', pool, batch_size)(logits, raw_features)
+      # Predicts across classes (on each replica, if not pooled)
+      predictions = tf.argmax(probabilities, axis=1 if pooled_scores else 2)
+
+      if FLAGS.extract_features:
+        feature_sizes = [ int(f.get_shape()[-1]) for f in features ]
+      else:
+        features = nada
+        feature_sizes = []
+
+      models.append({
+          'checkpoint_path' : checkpoint_path,
+          'init_fn'         : (lambda sess: None) if FLAGS.frozen_graph else
+                              slim.assign_from_checkpoint_fn(checkpoint_path, variables_to_restore),
+          'probabilities'   : probabilities,
+          'logits'          : logits_out,
+          'predictions'     : predictions,
+          'features'        : features,
+          'feature_sizes'   : feature_sizes,
+        })
 
     ###########################
     # Performs the prediction #
     ###########################
 
-    if tf.gfile.IsDirectory(FLAGS.checkpoint_path):
-      checkpoint_path = tf.train.latest_checkpoint(FLAGS.checkpoint_path)
-    else:
-      checkpoint_path = FLAGS.checkpoint_path
-
-    tf.logging.info('Evaluating %s', checkpoint_path)
+    for model in models:
+      tf.logging.info('Evaluating %s', model['checkpoint_path'])
 
-    session_config = tf.ConfigProto(
+    session_config = cpu_config.session_config(
+        intra_op_threads = FLAGS.intra_op_parallelism_threads,
+        inter_op_threads = FLAGS.inter_op_parallelism_threads,
+        cpus = cpus,
         log_device_placement = FLAGS.verbose_placement,
         allow_soft_placement = not FLAGS.hard_placement)
     if not FLAGS.fixed_memory:
@@ -368,84 +826,191 @@ def main(unparsed):
     # This ensures that we make a single pass over all of the data.
     num_samples = dataset.num_samples
 
-    init_fn = slim.assign_from_checkpoint_fn(checkpoint_path,
-      variables_to_restore) # slim.get_model_variables(FLAGS.model_name))
-
-    if FLAGS.output_file:
-      if FLAGS.output_format=='text':
-        outfile = open(FLAGS.output_file, 'wt')
+    def open_output(checkpoint_path, end_point=None):
+      if FLAGS.output_file:
+        output_file = output_path(checkpoint_path, end_point)
+        # When resuming, the partial output is truncated to its recorded state and continued
+        state = progress['outputs'][output_file] if progress else None
+        if FLAGS.output_format=='text':
+          return open(output_file, 'wt') if state is None else \
+                 feature_files.reopen_file(output_file, state, 'r+t')
+        elif FLAGS.output_format=='columnar':
+          return feature_files.ColumnarFeatureWriter(output_file, flags=FLAGS.__flags, state=state)
+        else:
+          return open(output_file, 'wb') if state is None else \
+                 feature_files.reopen_file(output_file, state, 'r+b')
       else:
-        outfile = open(FLAGS.output_file, 'wb')
-    else:
-      outfile = sys.stdout
+        return sys.stdout
+
     num_outputs = num_samples if pooled_features else num_samples * FLAGS.eval_replicas
-    tensor_id = image_id if FLAGS.id_field_name else nada
+    tensor_id = images_id if FLAGS.id_field_name else nada
     if FLAGS.extract_features:
       # Features - control message and targets
       progress_message = 'extracting feature for sample %d of %d'
       if FLAGS.add_scores_to_features == 'probs':
-        feature_size += num_classes
-        targets =[ tensor_id, label, features, probabilities, nada ]
+        for model in models:
+          model['feature_sizes'] = [ f + num_classes for f in model['feature_sizes'] ]
+        targets =[ tensor_id, labels, [ m['features'] for m in models ],
+                   [ m['probabilities'] for m in models ], nada ]
       elif FLAGS.add_scores_to_features == 'logits':
-        feature_size += num_classes
-        targets =[ tensor_id, label, features, logits_out, nada ]
+        for model in models:
+          model['feature_sizes'] = [ f + num_classes for f in model['feature_sizes'] ]
+        targets =[ tensor_id, labels, [ m['features'] for m in models ],
+                   [ m['logits'] for m in models ], nada ]
       else:
-        targets =[ tensor_id, label, features, nada, nada ]
-      # Features - outputs header
-      if FLAGS.output_format=='text':
-        print(num_outputs, file=outfile)
-        header  = [ FLAGS.id_field_name ] if FLAGS.id_field_name else  [ ]
-        header += [ 'truth' ]
-        header += [ 'feature[%d]' % feature_size ]
-        print(', '.join(header), file=outfile)
-      else:
-        pickle.dump([num_outputs, feature_size, FLAGS.__flags], outfile)
-      # Features - outputs contents
-      def print_replica(image_id, label, feats):
+        targets =[ tensor_id, labels, [ m['features'] for m in models ], nada, nada ]
+      # Features - outputs header (one file per checkpoint and end_point)
+      def open_features_output(checkpoint_path, end_point, feature_size):
+        outfile = open_output(checkpoint_path, end_point)
         if FLAGS.output_format=='text':
-          record  = [ image_id.decode('utf-8') ] if FLAGS.id_field_name else  [ ]
-          record += [ str(label) ]
-          record += [ _PREDICTION_OUTPUT_FORMAT % feats[f]  for f in range(feature_size) ]
-          print(', '.join(record), file=outfile)
+          if not progress:
+            print(num_outputs, file=outfile)
+            header  = [ FLAGS.id_field_name ] if FLAGS.id_field_name else  [ ]
+            header += [ 'truth' ]
+            header += [ 'feature[%d]' % feature_size ]
+            print(', '.join(header), file=outfile)
+          block_writer = feature_files.TextBlockWriter(outfile, write_ids=bool(FLAGS.id_field_name))
+        elif FLAGS.output_format=='pickle':
+          if not progress:
+            pickle.dump([num_outputs, feature_size, FLAGS.__flags], outfile)
+          block_writer = feature_files.PickleBlockWriter(outfile)
         else:
-          pickle.dump([image_id.decode('utf-8'), label, feats], outfile)
+          block_writer = outfile
+        # Samples are serialized in chunks, so the evaluation loop does not wait on each one
+        return feature_files.ChunkedFeatureWriter(block_writer, feature_size,
+            chunk_size=FLAGS.output_chunk_size, background=FLAGS.output_in_background)
+      for model in models:
+        model['outfiles'] = [ open_features_output(model['checkpoint_path'], e, f)
+                              for e, f in zip(feature_end_points, model['feature_sizes']) ]
+      # Features - outputs contents
+      def print_replica(outfile, image_id, label, feats):
+        outfile.write(image_id.decode('utf-8') if FLAGS.id_field_name else '', label, feats)
     else: # => FLAGS.extract_features==False
-      if pooled_scores:
-        list_ids         = []
-        list_labels      = []
-        list_scores      = []
-        list_predictions = []
       # Predictions - control message and targets
       progress_message = 'making prediction for sample %d of %d'
-      targets =[ tensor_id, label, nada, probabilities, predictions ]
-      # Predictions - print header
+      targets =[ tensor_id, labels, nada, [ m['probabilities'] for m in models ],
+                 [ m['predictions'] for m in models ] ]
+      # Predictions - print header (one file per checkpoint)
       header  = [ FLAGS.id_field_name ] if FLAGS.id_field_name else  [ ]
       header += [ 'truth' ]
       header += [ 'class%d' % c for c in range(num_classes) ] if dataset.labels_to_names is None else \
                 [ dataset.labels_to_names[c] + '[%d]' % c for c in range(num_classes) ]
       header += [ 'prediction' ]
-      print(', '.join(header), file=outfile)
+      for m, model in enumerate(models):
+        model['outfile'] = open_output(model['checkpoint_path'])
+        if not progress:
+          print(', '.join(header), file=model['outfile'])
+        if pooled_scores:
+          model['list_ids']         = []
+          model['list_labels']      = []
+          model['list_scores']      = []
+          model['list_predictions'] = []
+          if progress:
+            model.update(progress['lists'][m])
       # Predictions - print contents
-      def print_replica(image_id, label, scores, pred):
+      def print_replica(outfile, image_id, label, scores, pred):
         record  = [ image_id.decode('utf-8') ] if FLAGS.id_field_name else  [ ]
         record += [ str(label) ]
         record += [ _PREDICTION_OUTPUT_FORMAT % scores[c] for c in range(num_classes) ]
         record += [ str(pred) ]
         print(', '.join(record), file=outfile)
 
+    def process_batch(b, batch_results):
+      batch_ids, batch_labs, batch_feats, batch_scores, batch_preds = batch_results
+      serialization_start = time.time()
+      # The input cycles over the dataset, so the excess of the last batch must be discarded
+      batch_samples = min(batch_size, num_samples-b*batch_size)
+      for i in range(batch_samples):
+        s = b*batch_size + i
+        # Updates progress
+        if not FLAGS.hide_progress:
+          progress_sample = progress_message % (s+1, num_samples,)
+          progress_erase = ' '*(process_batch.progress_previous-len(progress_sample))
+          print(progress_sample+progress_erase, end='\r', file=sys.stderr)
+          sys.stderr.flush()
+          process_batch.progress_previous = len(progress_sample)
+        # Accumulates result
+        next_id  = batch_ids[i] if FLAGS.id_field_name else ''
+        next_lab = batch_labs[i]
+        for m, model in enumerate(models):
+          if FLAGS.extract_features:
+            for outfile, end_point_feats in zip(model['outfiles'], batch_feats[m]):
+              next_feats = end_point_feats[i]
+              if FLAGS.add_scores_to_features!='none':
+                next_feats = np.concatenate((next_feats, batch_scores[m][i]), axis=0 if pooled_features else 1)
+              if pooled_features:
+                print_replica(outfile, next_id, next_lab, next_feats)
+              else:
+                for r in range(FLAGS.eval_replicas):
+                  print_replica(outfile, next_id, next_lab, next_feats[r])
+          else:
+            next_scores = batch_scores[m][i]
+            next_preds  = batch_preds[m][i]
+            if pooled_scores:
+              model['list_ids'].append(next_id)
+              model['list_labels'].append(next_lab)
+              model['list_scores'].append(next_scores)
+              model['list_predictions'].append(next_preds)
+              print_replica(model['outfile'], next_id, next_lab, next_scores, next_preds)
+            else:
+              for r in range(FLAGS.eval_replicas):
+                print_replica(model['outfile'], next_id, next_lab, next_scores[r], next_preds[r])
+        # print('{All variables: ', len (tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)), '}')
+      if timer:
+        timer.record('serialization', time.time()-serialization_start, batch_samples)
+      if progress_path and FLAGS.progress_every_batches>0 and (b+1)%FLAGS.progress_every_batches==0:
+        record_progress(b+1)
+    process_batch.progress_previous = 0
+
+    def record_progress(batches_done):
+      # Runs in the same thread as process_batch(), so the outputs are synced at a batch boundary
+      outputs = {}
+      lists = []
+      for model in models:
+        if FLAGS.extract_features:
+          for end_point, outfile in zip(feature_end_points, model['outfiles']):
+            outputs[output_path(model['checkpoint_path'], end_point)] = outfile.sync()
+        else:
+          outputs[output_path(model['checkpoint_path'])] = feature_files.sync_file(model['outfile'])
+          lists.append({ l : list(model[l]) for l in _PREDICTION_LISTS if l in model })
+      new_progress = {
+          'key'          : progress_key,
+          'batches_done' : batches_done,
+          'outputs'      : outputs,
+          'lists'        : lists,
+        }
+      # progress_path is written first, so it always holds the latest progress
+      for path in progress_paths:
+        with open(path + '.tmp', 'wb') as progress_file:
+          pickle.dump(new_progress, progress_file)
+        os.rename(path + '.tmp', path)
+      record_progress.batches_done = batches_done
+    record_progress.batches_done = first_batch
+
+    output_pipeline = OutputPipeline(process_batch, FLAGS.output_queue_size)
+
+    if timer:
+      # Each task of a sharded run writes its own timing, keeping the extension, which sets the format
+      timing_root, timing_ext = os.path.splitext(FLAGS.timing_file)
+      timing_path = feature_files.partial_filename(timing_root, FLAGS.task_index, FLAGS.num_tasks) + timing_ext
+
     start = datetime.datetime.utcnow()
     tf.logging.info('Started on (UTC): %s', str(start))
 
     def exit_gracefully(signum, frame):
       interrupted = datetime.datetime.utcnow()
       tf.logging.error('Interrupted on (UTC): %s', str(interrupted))
+      if progress_path and record_progress.batches_done>0:
+        tf.logging.error('Progress recorded up to batch %d in %s, use --resume to continue',
+                         record_progress.batches_done, progress_path)
       sys.exit(1)
 
     signal.signal(signal.SIGINT, exit_gracefully)
     signal.signal(signal.SIGTERM, exit_gracefully)
 
     with tf.Session(config=session_config) as sess:
-      init_fn(sess)
+      for model in models:
+        model['init_fn'](sess)
 
       # init_op = tf.global_variables_initializer()
       # sess.run(init_op)
@@ -453,47 +1018,63 @@ def main(unparsed):
       coord = tf.train.Coordinator()
       threads = tf.train.start_queue_runners(sess=sess, coord=coord)
 
-      progress_previous = 0
-      for s in range(num_samples):
-        # Updates progress
-        if not FLAGS.hide_progress:
-          progress_sample = progress_message % (s+1, num_samples,)
-          progress_erase = ' '*(progress_previous-len(progress_sample))
-          print(progress_sample+progress_erase, end='\r', file=sys.stderr)
-          sys.stderr.flush()
-          progress_previous = len(progress_sample)
+      if first_batch>0 and FLAGS.input_pipeline=='queue':
+        # The queues cannot skip records: the batches already done are read and discarded
+        for b in range(first_batch):
+          sess.run(labels)
+
+      num_batches = (num_samples+batch_size-1) // batch_size
+      compute_time = 0.0
+      loop_start = time.time()
+      for b in range(first_batch, num_batches):
         # Performs evaluation
-        next_id, next_lab, next_feats, next_scores, next_preds = sess.run(
-            targets, options=tf.RunOptions(timeout_in_ms=_TIMEOUT_PER_TEST_IN_MS))
-        # Accumulates result
-        next_id = next_id if FLAGS.id_field_name else ''
-        if FLAGS.extract_features:
-          if FLAGS.add_scores_to_features!='none':
-            next_feats = np.concatenate((next_feats, next_scores), axis=0 if pooled_features else 1)
-          if pooled_features:
-            print_replica(next_id, next_lab, next_feats)
-          else:
-            for r in range(FLAGS.eval_replicas):
-              print_replica(next_id, next_lab, next_feats[r])
-        else:
-          if pooled_scores:
-            list_ids.append(next_id)
-            list_labels.append(next_lab)
-            list_scores.append(next_scores)
-            list_predictions.append(next_preds)
-            print_replica(next_id, next_lab, next_scores, next_preds)
-          else:
-            for r in range(FLAGS.eval_replicas):
-              print_replica(next_id, next_lab, next_scores[r], next_preds[r])
-        # print('{All variables: ', len (tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)), '}')
+        compute_start = time.time()
+        run_options = tf.RunOptions(timeout_in_ms=_TIMEOUT_PER_TEST_IN_MS*batch_size*len(models))
+        run_metadata = None
+        if b==FLAGS.trace_step:
+          run_options.trace_level = tf.RunOptions.FULL_TRACE
+          run_metadata = tf.RunMetadata()
+        batch_results = sess.run(targets, options=run_options, run_metadata=run_metadata)
+        compute_time += time.time()-compute_start
+        if run_metadata is not None:
+          trace_path = '%s.trace-%d.json' % (timing_path, b)
+          with open(trace_path, 'wt') as trace_file:
+            trace_file.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+          tf.logging.info('Trace of batch %d written to %s', b, trace_path)
+        # Hands the results to the output thread (or process them here, if there is none)
+        output_pipeline.put(b, batch_results)
+      output_pipeline.close()
 
       if not FLAGS.hide_progress:
-        print(' '*progress_previous, file=sys.stderr)
+        print(' '*process_batch.progress_previous, file=sys.stderr)
         print('%d samples evaluated.' % num_samples, file=sys.stderr)
 
+      tf.logging.info('Time in sess.run: %.1fs, waiting for the output: %.1fs, processing the output: %.1fs',
+                      compute_time, output_pipeline.wait_time, output_pipeline.busy_time)
+
+      if timer:
+        loop_samples = num_samples - min(first_batch*batch_size, num_samples)
+        timing = timer.write(timing_path, elapsed=time.time()-loop_start, num_images=loop_samples)
+        for stage in timing['stages']:
+          tf.logging.info('%-13s p50: %8.1fms  p95: %8.1fms  %8.1f images/sec', stage['stage'],
+                          stage['p50_ms'], stage['p95_ms'], stage['images_per_sec'])
+        tf.logging.info('Run: %.1f images/sec, timing written to %s', timing['images_per_sec'], timing_path)
+
       coord.request_stop()
       coord.join(threads)
 
+    for model in models:
+      if FLAGS.extract_features:
+        for outfile in model['outfiles']:
+          outfile.close()
+      elif model['outfile'] is not sys.stdout:
+        model['outfile'].close()
+    # The outputs are complete: there is nothing left to resume
+    if progress_path:
+      for path in progress_paths:
+        if os.path.exists(path):
+          os.remove(path)
+
   finish = datetime.datetime.utcnow()
   tf.logging.info('Finished on (UTC): %s', str(finish))
   tf.logging.info('Elapsed: %s', str(finish-start))
@@ -506,36 +1087,42 @@ def main(unparsed):
     else:
       metfile = None
 
-    np_labels        = np.asarray(list_labels)
-    np_predictions   = np.asarray(list_predictions)
-    np_probabilities = np.asarray(list_scores)
-
-    metfile and print(checkpoint_path, ', ' , sep='', end='', file=metfile)
-    print('Confusion Matrix:\n', sklearn.metrics.confusion_matrix(np_labels, np_predictions))
-    m_acc = sklearn.metrics.accuracy_score(np_labels, np_predictions)
-    print('Acc: ', m_acc)
-    metfile and print(m_acc, ', ' , sep='', end='', file=metfile)
-    try:
-      aucs = []
-      mAPs = []
-      for j in range(num_classes):
-        np_labels_j = np.int64(np_labels == j)
-        np_scores_j = np_probabilities[:, j]
-        # fpr, tpr, _ = sklearn.metrics.roc_curve(np_labels_j, np_scores_j)
-        auc = sklearn.metrics.roc_auc_score(np_labels_j, np_scores_j)
-        aucs.append(auc)
-        print('AUC[%d]: ' % j, auc)
-        # pre, rec, _ = sklearn.metrics.precision_recall_curve(np_labels_j, np_scores_j)
-        mAP = sklearn.metrics.average_precision_score(np_labels_j, np_scores_j)
-        mAPs.append(mAP)
-        print('mAP[%d]: ' % j, mAP)
-      if metfile:
-        print(aucs[1], aucs[2], mAPs[1], mAPs[2], (aucs[1]+aucs[2])/2.0,
-              sep=', ', end='', file=metfile)
-      print('AUCavg: ', sum(aucs) / num_classes)
-      print('mAPavg: ', sum(mAPs) / num_classes)
-    except ValueError:
-      pass
+    for model in models:
+      checkpoint_path = model['checkpoint_path']
+      if len(models)>1:
+        print('Checkpoint: ', checkpoint_path)
+
+      np_labels        = np.asarray(model['list_labels'])
+      np_predictions   = np.asarray(model['list_predictions'])
+      np_probabilities = np.asarray(model['list_scores'])
+
+      metfile and print(checkpoint_path, ', ' , sep='', end='', file=metfile)
+      print('Confusion Matrix:\n', sklearn.metrics.confusion_matrix(np_labels, np_predictions))
+      m_acc = sklearn.metrics.accuracy_score(np_labels, np_predictions)
+      print('Acc: ', m_acc)
+      metfile and print(m_acc, ', ' , sep='', end='', file=metfile)
+      try:
+        aucs = []
+        mAPs = []
+        for j in range(num_classes):
+          np_labels_j = np.int64(np_labels == j)
+          np_scores_j = np_probabilities[:, j]
+          # fpr, tpr, _ = sklearn.metrics.roc_curve(np_labels_j, np_scores_j)
+          auc = sklearn.metrics.roc_auc_score(np_labels_j, np_scores_j)
+          aucs.append(auc)
+          print('AUC[%d]: ' % j, auc)
+          # pre, rec, _ = sklearn.metrics.precision_recall_curve(np_labels_j, np_scores_j)
+          mAP = sklearn.metrics.average_precision_score(np_labels_j, np_scores_j)
+          mAPs.append(mAP)
+          print('mAP[%d]: ' % j, mAP)
+        if metfile:
+          print(aucs[1], aucs[2], mAPs[1], mAPs[2], (aucs[1]+aucs[2])/2.0,
+                sep=', ', end='', file=metfile)
+        print('AUCavg: ', sum(aucs) / num_classes)
+        print('mAPavg: ', sum(mAPs) / num_classes)
+      except ValueError:
+        pass
+      metfile and print(file=metfile)
 
   return 0
 
@@ -27,6 +27,7 @@ import sklearn.gaussian_process
 import sklearn.model_selection
 import sklearn.preprocessing
 
+from svm_layer import feature_files as sf
 from svm_layer import utils as su
 
 version_required = (3, 4, 0)
@@ -39,10 +40,14 @@ if version_running<version_required and '--allow_old_python' not in sys.argv:
 
 parser = argparse.ArgumentParser(prog='predict_svm_layer.py', description='Predict the SVM decision.')
 parser.add_argument('--input_model', type=str, required=True, help='input trained model, in pickle format.')
-parser.add_argument('--input_test', type=str, required=True, help='input file with the test data, in pickle format.')
+parser.add_argument('--input_test', type=str, required=True, help='input file with the test data, in pickle or columnar format.')
 parser.add_argument('--output_file', type=str , help='output file with the predictions, in isbi challenge format (default=stdout).')
 parser.add_argument('--metrics_file', type=str, help='output file with the metrics, in text format (default=stdout).')
 parser.add_argument('--pool_by_id', type=str, default='none', help='pool answers of contiguous identical ids: none (default), avg, max, xtrm')
+parser.add_argument('--reference_test', type=str, help='input file with reference test data (e.g., extracted by the float32 graph, '
+    'when --input_test was extracted by a quantized graph), whose AUCs must be matched within --auc_tolerance.')
+parser.add_argument('--auc_tolerance', type=float, default=0.01, help='maximum difference of the AUCs to those of --reference_test '
+    '(default=0.01); if exceeded, the script fails with exit status 1.')
 parser.add_argument('--allow_old_python', help='The script was not tested on Python 2 and will normally require Python 3.4+, '
     'but this flag allows using older versions (use it at your own risk).', action='store_true')
 FLAGS = parser.parse_args() # Parse args already checks for unparsed arguments, contrarily to tf / parse_known_args()
@@ -57,7 +62,7 @@ def main():
   model_file.close()
 
   start = su.print_and_time('Reading test data...',  past=start, file=sys.stderr)
-  image_ids, labels, features = su.read_pickled_data(FLAGS.input_test)
+  image_ids, labels, features = sf.read_features_data(FLAGS.input_test)
   num_samples = len(image_ids)
 
   start = su.print_and_time('Preprocessing test data...', file=sys.stderr)
@@ -131,6 +136,26 @@ def main():
   except ValueError:
     pass
 
+  if FLAGS.reference_test:
+    start = su.print_and_time('Checking against the reference test data...', past=start, file=sys.stderr)
+    reference_ids, reference_labels, reference_features = sf.read_features_data(FLAGS.reference_test)
+    if list(reference_ids)!=list(image_ids) or np.any(np.asarray(reference_labels)!=np.asarray(labels)):
+      print('The reference test data does not have the same samples as the test data', file=sys.stderr)
+      sys.exit(1)
+    reference_features = preprocessor.transform(reference_features)
+    reference_m = probability_from_logits(classifier_m.decision_function(reference_features))
+    reference_k = probability_from_logits(classifier_k.decision_function(reference_features))
+    exceeded = False
+    for j, scores_j, reference_j in [ [1, predictions_m, reference_m], [2, predictions_k, reference_k] ]:
+      labels_j = (labels == j).astype(np.int)
+      auc = sk.metrics.roc_auc_score(labels_j, scores_j)
+      reference_auc = sk.metrics.roc_auc_score(labels_j, reference_j)
+      print('AUC[%d] reference: ' % j, reference_auc, ' difference: ', auc - reference_auc, file=metfile)
+      exceeded = exceeded or abs(auc - reference_auc)>FLAGS.auc_tolerance
+    if exceeded:
+      print('AUC differs from the reference by more than %g' % FLAGS.auc_tolerance, file=sys.stderr)
+      sys.exit(1)
+
   print('\n Total time ', end='', file=sys.stderr)
   _ = su.print_and_time('Done!\n', past=first, file=sys.stderr)
 
@@ -24,6 +24,9 @@ import tensorflow as tf
 
 from tensorflow.python.ops import control_flow_ops
 
+_SUMMARY_LEVELS = [ 'none', 'sampled', 'full' ]
+_SUMMARY_SAMPLING_RATE = 0.01
+
 
 def apply_with_random_selector(x, func, num_cases):
   """Computes func(x, sel), with sel sampled from [0...num_cases-1].
@@ -154,6 +157,28 @@ def distorted_bounding_box_crop(image,
     return cropped_image, distort_bbox
 
 
+def image_summary(name, image_fn, summary_level='none'):
+  """Adds an image summary, according to the summary level.
+
+  Args:
+    name: name of the summary.
+    image_fn: function that returns the 4-D Tensor to summarize; only called if needed.
+    summary_level: 'none' adds nothing; 'full' summarizes every image; 'sampled' summarizes a
+      random fraction (_SUMMARY_SAMPLING_RATE) of the images, and an empty batch for the others,
+      so the ops that build the summarized image only run for the sampled images.
+  """
+  if summary_level == 'none':
+    return
+  elif summary_level == 'full':
+    tf.summary.image(name, image_fn())
+  elif summary_level == 'sampled':
+    sampled = tf.less(tf.random_uniform([]), _SUMMARY_SAMPLING_RATE)
+    image = tf.cond(sampled, image_fn, lambda: tf.zeros([0, 1, 1, 3]))
+    tf.summary.image(name, image)
+  else:
+    raise ValueError('summary_level must be one of %s' % ', '.join(_SUMMARY_LEVELS))
+
+
 def apply_image_normalization(image, normalize_per_image=0) :
   if normalize_per_image == 0 :
     image = tf.subtract(image, 0.5)
@@ -178,6 +203,7 @@ def preprocess_for_train(image, height, width, bbox,
                          area_range=(0.20, 1.0),
                          add_rotations=True,
                          normalize_per_image=0,
+                         summary_level='none',
                          scope=None):
   """Distort one image for training a network.
 
@@ -185,8 +211,8 @@ def preprocess_for_train(image, height, width, bbox,
   set during training in order to make the network invariant to aspects
   of the image that do not effect the label.
 
-  Additionally it would create image_summaries to display the different
-  transformations applied to the image.
+  Additionally it can create image_summaries to display the different
+  transformations applied to the image (see summary_level).
 
   Args:
     image: 3-D Tensor of image. If dtype is tf.float32 then the range should be
@@ -201,6 +227,7 @@ def preprocess_for_train(image, height, width, bbox,
     fast_mode: Optional boolean, if True avoids slower transformations (i.e.
       bi-cubic resizing, random_hue or random_contrast).
     normalize_per_image: 0 - None; 1 - Subtracts Mean; 2 - Subtracts Mean and Div Stdev
+    summary_level: 'none' (default), 'sampled' or 'full'; see image_summary().
     scope: Optional scope for name_scope.
   Returns:
     3-D float Tensor of distorted image used for training with range [-1, 1].
@@ -214,19 +241,18 @@ def preprocess_for_train(image, height, width, bbox,
       image = tf.image.convert_image_dtype(image, dtype=tf.float32)
     # Each bounding box has shape [1, num_boxes, box coords] and
     # the coordinates are ordered [ymin, xmin, ymax, xmax].
-    image_with_box = tf.image.draw_bounding_boxes(tf.expand_dims(image, 0),
-                                                  bbox)
-    tf.summary.image('image_with_bounding_boxes', image_with_box)
+    image_summary('image_with_bounding_boxes',
+                  lambda: tf.image.draw_bounding_boxes(tf.expand_dims(image, 0), bbox),
+                  summary_level)
 
     distorted_image, distorted_bbox = distorted_bounding_box_crop(image, bbox,
       aspect_ratio_range=aspect_ratio_range, area_range=area_range)
     # Restore the shape since the dynamic slice based upon the bbox_size loses
     # the third dimension.
     distorted_image.set_shape([None, None, 3])
-    image_with_distorted_box = tf.image.draw_bounding_boxes(
-        tf.expand_dims(image, 0), distorted_bbox)
-    tf.summary.image('images_with_distorted_bounding_box',
-                     image_with_distorted_box)
+    image_summary('images_with_distorted_bounding_box',
+                  lambda: tf.image.draw_bounding_boxes(tf.expand_dims(image, 0), distorted_bbox),
+                  summary_level)
 
     # This resizing operation may distort the images because the aspect
     # ratio is not respected.
@@ -241,8 +267,8 @@ def preprocess_for_train(image, height, width, bbox,
         lambda x, method: tf.image.resize_images(x, [height, width], method=method),
         num_cases=num_resize_cases)
 
-    tf.summary.image('cropped_resized_image',
-                     tf.expand_dims(distorted_image, 0))
+    image_summary('cropped_resized_image',
+                  lambda: tf.expand_dims(distorted_image, 0), summary_level)
 
     # Randomly flip the image horizontally.
     distorted_image = tf.image.random_flip_left_right(distorted_image)
@@ -253,7 +279,8 @@ def preprocess_for_train(image, height, width, bbox,
         lambda x, ordering: distort_color(x, ordering, fast_mode),
         num_cases=4)
 
-    tf.summary.image('final_distorted_image', tf.expand_dims(distorted_image, 0))
+    image_summary('final_distorted_image',
+                  lambda: tf.expand_dims(distorted_image, 0), summary_level)
 
     if add_rotations and height==width :
       # Randomly rotates the image. There are 4 orientations, since only multiples of 90o are available
@@ -267,6 +294,233 @@ def preprocess_for_train(image, height, width, bbox,
     return distorted_image
 
 
+def sample_color_factors(num_rows):
+  """Samples [num_rows, 4] brightness deltas, saturation factors, hue deltas and contrast factors."""
+  def uniform(minval, maxval):
+    return tf.random_uniform([num_rows, 1], minval=minval, maxval=maxval)
+  return tf.concat([ uniform(-32. / 255., 32. / 255.),
+                     uniform(0.5, 1.5),
+                     uniform(-0.2, 0.2),
+                     uniform(0.5, 1.5) ], axis=1)
+
+
+def distort_color_rows(images, fast_mode=False, orderings=None, color_factors=None, scope=None):
+  """Distort the color of a batch of images, with independent parameters for each row.
+
+  Vectorized counterpart of distort_color(): each row gets its own random color ordering and its
+  own brightness, saturation (and, if not fast_mode, hue and contrast) factors, from the same
+  ranges. The rows are partitioned by ordering, and each partition goes through its own chain of
+  distortions, so each row is distorted only once.
+
+  Args:
+    images: 4-D Tensor [batch, height, width, 3] with images in [0, 1].
+    fast_mode: Avoids slower ops (random_hue and random_contrast)
+    orderings: Optional 1-D int Tensor [batch] with the color ordering (0-3) of each row. If
+      None, sampled at random.
+    color_factors: Optional 2-D float Tensor [batch, 4] with the brightness delta, saturation
+      factor, hue delta and contrast factor of each row. If None, sampled at random.
+    scope: Optional scope for name_scope.
+  Returns:
+    4-D Tensor with the color-distorted images on range [0, 1]
+  """
+  with tf.name_scope(scope, 'distort_color_rows', [images]):
+    num_rows = tf.shape(images)[0]
+    if color_factors is None:
+      color_factors = sample_color_factors(num_rows)
+    if orderings is None:
+      orderings = tf.random_uniform([num_rows], maxval=4, dtype=tf.int32)
+
+    def brightness(x, factors):
+      return x + factors[:, 0]
+    def saturation(x, factors):
+      hue, sat, value = tf.unstack(tf.image.rgb_to_hsv(x), axis=3)
+      sat = tf.clip_by_value(sat * factors[:, 1, :, :, 0], 0.0, 1.0)
+      return tf.image.hsv_to_rgb(tf.stack([hue, sat, value], axis=3))
+    def hue(x, factors):
+      hue, sat, value = tf.unstack(tf.image.rgb_to_hsv(x), axis=3)
+      hue = tf.mod(hue + factors[:, 2, :, :, 0], 1.0)
+      return tf.image.hsv_to_rgb(tf.stack([hue, sat, value], axis=3))
+    def contrast(x, factors):
+      mean = tf.reduce_mean(x, axis=[1, 2], keep_dims=True)
+      return (x - mean) * factors[:, 3] + mean
+
+    if fast_mode:
+      distortions = [ [ brightness, saturation ],
+                      [ saturation, brightness ] ]
+      # As in distort_color(), orderings 1-3 are the same in fast_mode
+      selector = tf.minimum(orderings, 1)
+    else:
+      distortions = [ [ brightness, saturation, hue, contrast ],
+                      [ saturation, brightness, contrast, hue ],
+                      [ contrast, hue, brightness, saturation ],
+                      [ hue, saturation, contrast, brightness ] ]
+      selector = orderings
+    selector = tf.cast(selector, tf.int32)
+
+    # The rows are split by ordering, so each row goes through a single chain of distortions
+    num_cases = len(distortions)
+    partitioned_indices = tf.dynamic_partition(tf.range(num_rows), selector, num_cases)
+    partitioned_images = tf.dynamic_partition(images, selector, num_cases)
+    partitioned_factors = tf.dynamic_partition(tf.reshape(color_factors, [-1, 4, 1, 1, 1]),
+                                               selector, num_cases)
+    distorted_partitions = []
+    for ordering, distorted, factors in zip(distortions, partitioned_images, partitioned_factors):
+      for distortion in ordering:
+        distorted = distortion(distorted, factors)
+      distorted_partitions.append(distorted)
+    distorted_images = tf.dynamic_stitch(partitioned_indices, distorted_partitions)
+    distorted_images.set_shape(images.get_shape())
+    images = distorted_images
+
+    # The distortions do not necessarily clamp.
+    return tf.clip_by_value(images, 0.0, 1.0)
+
+
+def rot90_rows(images, turns=None, scope=None):
+  """Rotates each (square) image of a batch by a multiple (turns, random if None) of 90 degrees."""
+  with tf.name_scope(scope, 'rot90_rows', [images]):
+    if turns is None:
+      turns = tf.random_uniform([tf.shape(images)[0]], maxval=4, dtype=tf.int32)
+    turns = tf.mod(tf.cast(turns, tf.int32), 4)
+    rotations = [ lambda x: x,
+                  lambda x: tf.transpose(tf.reverse(x, [2]), [0, 2, 1, 3]),
+                  lambda x: tf.reverse(x, [1, 2]),
+                  lambda x: tf.reverse(tf.transpose(x, [0, 2, 1, 3]), [2]) ]
+
+    # The rows are split by number of turns, so each row is rotated only once
+    partitioned_indices = tf.dynamic_partition(tf.range(tf.shape(images)[0]), turns, len(rotations))
+    partitioned_images = tf.dynamic_partition(images, turns, len(rotations))
+    rotated_images = tf.dynamic_stitch(partitioned_indices,
+        [ rotate(partition) for rotate, partition in zip(rotations, partitioned_images) ])
+    rotated_images.set_shape(images.get_shape())
+    return rotated_images
+
+
+def apply_images_normalization(images, normalize_per_image=0):
+  """Batch counterpart of apply_image_normalization(), on a 4-D Tensor of images."""
+  if normalize_per_image == 0 :
+    images = tf.subtract(images, 0.5)
+    images = tf.multiply(images, 2.0) # All pixels now between -1.0 and 1.0
+    return images
+  elif normalize_per_image == 1 :
+    images = tf.multiply(images, 2.0) # All pixels now between 0.0 and 2.0
+    images = images - tf.reduce_mean(images, axis=[1, 2], keep_dims=True)
+    # Most pixels should be between -1.0 and 1.0
+    return images
+  elif normalize_per_image == 2 :
+    # Same as tf.image.per_image_standardization on each image
+    num_pixels = tf.cast(tf.reduce_prod(tf.shape(images)[1:]), tf.float32)
+    mean = tf.reduce_mean(images, axis=[1, 2, 3], keep_dims=True)
+    stddev = tf.sqrt(tf.reduce_mean(tf.square(images - mean), axis=[1, 2, 3], keep_dims=True))
+    images = (images - mean) / tf.maximum(stddev, tf.rsqrt(num_pixels))
+    images = tf.multiply(images, 0.4) # This makes 98.8% of pixels between -1.0 and 1.0
+    return images
+  else :
+    raise ValueError('invalid value for normalize_per_image: %d' % normalize_per_image)
+
+
+def preprocess_batch_for_train(images, height, width,
+                               image_sizes=None,
+                               num_crops=1,
+                               fast_mode=False,
+                               aspect_ratio_range=(0.66, 1.52),
+                               area_range=(0.20, 1.0),
+                               add_rotations=True,
+                               normalize_per_image=0,
+                               augmentation_params=None,
+                               scope=None):
+  """Distort a batch of images (or several crops of each image) for training a network.
+
+  Vectorized counterpart of preprocess_for_train(): the distorted bounding boxes are sampled for
+  each crop, and the crops are extracted and resized by a single crop_and_resize; the flips,
+  color distortions and rotations are then applied to the whole batch, with per-row random
+  parameters. The graph does not grow with the number of crops. Differences to the single-image
+  version: the crops are always resized with bilinear interpolation, and no image summaries are
+  created.
+
+  Args:
+    images: 4-D Tensor [batch, image_height, image_width, 3]. If dtype is tf.float32 then the
+      range should be [0, 1], otherwise it would converted to tf.float32 (see
+      `tf.image.convert_image_dtype` for details).
+    height: integer
+    width: integer
+    image_sizes: Optional 2-D int Tensor [batch, 2] with the actual height and width of each
+      image, when the images of different sizes were zero-padded to stack them in a batch
+      (e.g., by tf.train.batch(..., dynamic_pad=True)). The crops are sampled inside the actual
+      images. If None, all images span the whole tensor.
+    num_crops: number of distorted crops of each image.
+    fast_mode: Optional boolean, if True avoids slower transformations (i.e.
+      random_hue or random_contrast).
+    normalize_per_image: 0 - None; 1 - Subtracts Mean; 2 - Subtracts Mean and Div Stdev
+    augmentation_params: Optional dict with fixed parameters for each crop, instead of random
+      ones: 'boxes' [crops, 4] (normalized [ymin, xmin, ymax, xmax] relative to the actual image),
+      'flips' [crops] (bool), 'orderings' [crops] (int), 'color_factors' [crops, 4] (see
+      distort_color_rows) and 'turns' [crops] (int). See preprocessing/augmentation_bank.py.
+    scope: Optional scope for name_scope.
+  Returns:
+    4-D float Tensor [batch*num_crops, height, width, 3] of distorted images, with range [-1, 1];
+    the crops of image i are in rows i*num_crops to (i+1)*num_crops-1.
+  """
+  with tf.name_scope(scope, 'distort_images', [images, height, width]):
+    if images.dtype != tf.float32:
+      images = tf.image.convert_image_dtype(images, dtype=tf.float32)
+    images_shape = tf.shape(images)
+    box_ind = tf.reshape(tf.tile(tf.expand_dims(tf.range(images_shape[0]), 1), [1, num_crops]), [-1])
+    whole_image = tf.constant([0.0, 0.0, 1.0, 1.0], dtype=tf.float32, shape=[1, 1, 4])
+    if image_sizes is None:
+      image_sizes = tf.tile(tf.expand_dims(images_shape[1:3], 0), [images_shape[0], 1])
+    crop_sizes = tf.gather(tf.cast(image_sizes, tf.int32), box_ind)
+
+    def sample_box(image_size):
+      _, _, distort_bbox = tf.image.sample_distorted_bounding_box(
+          tf.concat([image_size, images_shape[3:]], axis=0),
+          bounding_boxes=whole_image,
+          min_object_covered=0.1,
+          aspect_ratio_range=aspect_ratio_range,
+          area_range=area_range,
+          max_attempts=100,
+          use_image_if_no_bounding_boxes=True)
+      return tf.reshape(distort_bbox, [4])
+    if augmentation_params is None:
+      augmentation_params = {}
+    if 'boxes' in augmentation_params:
+      boxes = tf.cast(augmentation_params['boxes'], tf.float32)
+    else:
+      boxes = tf.map_fn(sample_box, crop_sizes, dtype=tf.float32, back_prop=False)
+    # The boxes are relative to the actual images: rescales them to the (padded) batch tensor.
+    # crop_and_resize maps the coordinate 1.0 to the pixel size-1, so the scale is (h-1)/(H-1),
+    # and the edge 1.0 of a box lands on the last actual pixel, never on the padding
+    scales = tf.cast(crop_sizes - 1, tf.float32) / tf.cast(tf.maximum(images_shape[1:3] - 1, 1), tf.float32)
+    boxes = boxes * tf.tile(scales, [1, 2])
+
+    # Crops and resizes all boxes at once. This resizing operation may distort the images since
+    # the aspect ratio is not respected.
+    distorted_images = tf.image.crop_and_resize(images, boxes, box_ind, [height, width])
+
+    # Randomly flip the images horizontally.
+    flips = augmentation_params.get('flips')
+    if flips is None:
+      flips = tf.random_uniform([tf.shape(box_ind)[0]]) < 0.5
+    distorted_images = tf.where(flips, tf.reverse(distorted_images, [2]), distorted_images)
+
+    # Randomly distort the colors.
+    distorted_images = distort_color_rows(distorted_images, fast_mode,
+        orderings=augmentation_params.get('orderings'),
+        color_factors=augmentation_params.get('color_factors'))
+
+    if add_rotations and height==width :
+      # Randomly rotates the images. There are 4 orientations, since only multiples of 90o are available
+      distorted_images = rot90_rows(distorted_images, turns=augmentation_params.get('turns'))
+
+    distorted_images = apply_images_normalization(distorted_images, normalize_per_image)
+    # The number of rows is computed from tf.shape: restores its static value, when known (e.g.,
+    # for tf.train.batch, which requires fully defined shapes)
+    batch_size = images.get_shape()[0].value
+    distorted_images.set_shape([ batch_size * num_crops if batch_size is not None else None,
+                                 height, width, images.get_shape()[3].value ])
+    return distorted_images
+
+
 def preprocess_for_eval(image, height, width,
                         central_fraction=0.875,
                         normalize_per_image=0,
@@ -316,7 +570,8 @@ def preprocess_image(image, height, width,
                      aspect_ratio_range=(0.66, 1.52),
                      area_range=(0.20, 1.0),
                      add_rotations=True,
-                     normalize_per_image=0):
+                     normalize_per_image=0,
+                     summary_level='none'):
   """Pre-process one image for training or evaluation.
 
   Args:
@@ -329,6 +584,8 @@ def preprocess_image(image, height, width,
       where each coordinate is [0, 1) and the coordinates are arranged as
       [ymin, xmin, ymax, xmax].
     fast_mode: Optional boolean, if True avoids slower transformations.
+    summary_level: image summaries of the training transformations: 'none'
+      (default), 'sampled' or 'full'.
 
   Returns:
     3-D float Tensor containing an appropriately scaled image
@@ -342,7 +599,8 @@ def preprocess_image(image, height, width,
         aspect_ratio_range=aspect_ratio_range,
         area_range=area_range,
         add_rotations=add_rotations,
-        normalize_per_image=normalize_per_image)
+        normalize_per_image=normalize_per_image,
+        summary_level=summary_level)
   else:
     return preprocess_for_eval(image, height, width,
       normalize_per_image=normalize_per_image)
@@ -0,0 +1,89 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Tests for dermatologic_preprocessing."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from preprocessing import dermatologic_preprocessing
+
+
+class PreprocessBatchForTrainTest(tf.test.TestCase):
+
+  def _padded_batch(self, image_sizes, padded_size):
+    # The actual images are white, and the zero padding is black
+    images = np.zeros([ len(image_sizes) ] + padded_size + [ 3 ], dtype=np.float32)
+    for i, (height, width) in enumerate(image_sizes):
+      images[i, :height, :width, :] = 1.0
+    return images
+
+  def testWholeImagesExcludePadding(self):
+    image_sizes = [ [ 20, 30 ], [ 40, 15 ], [ 50, 50 ] ]
+    images = self._padded_batch(image_sizes, [ 50, 50 ])
+    num_crops = 2
+    num_rows = len(image_sizes) * num_crops
+    augmentation_params = {
+        'boxes' : [ [ 0.0, 0.0, 1.0, 1.0 ] ] * num_rows,
+        'flips' : [ False ] * num_rows,
+        'orderings' : [ 0 ] * num_rows,
+        'color_factors' : [ [ 0.0, 1.0, 0.0, 1.0 ] ] * num_rows,
+        'turns' : [ 0 ] * num_rows,
+    }
+    with self.test_session() as sess:
+      distorted = dermatologic_preprocessing.preprocess_batch_for_train(
+          tf.constant(images), 17, 17, image_sizes=tf.constant(image_sizes), num_crops=num_crops,
+          fast_mode=True, augmentation_params=augmentation_params)
+      distorted = sess.run(distorted)
+    self.assertEqual(distorted.shape, (num_rows, 17, 17, 3))
+    # All pixels, including the last row and column of each crop, come from the actual images
+    self.assertAllClose(distorted, np.ones_like(distorted))
+
+  def testRandomBoxesExcludePadding(self):
+    image_sizes = [ [ 7, 33 ], [ 64, 9 ], [ 31, 31 ] ]
+    images = self._padded_batch(image_sizes, [ 64, 64 ])
+    num_crops = 8
+    num_rows = len(image_sizes) * num_crops
+    augmentation_params = {
+        'flips' : [ False ] * num_rows,
+        'orderings' : [ 0 ] * num_rows,
+        'color_factors' : [ [ 0.0, 1.0, 0.0, 1.0 ] ] * num_rows,
+    }
+    with self.test_session() as sess:
+      distorted = dermatologic_preprocessing.preprocess_batch_for_train(
+          tf.constant(images), 16, 16, image_sizes=tf.constant(image_sizes), num_crops=num_crops,
+          fast_mode=True, area_range=(0.05, 1.0), augmentation_params=augmentation_params)
+      distorted = sess.run(distorted)
+    self.assertAllClose(distorted, np.ones_like(distorted))
+
+  def testReplicasInQueue(self):
+    # As in predict_image_classifier.py: the replicas of each image are batched by tf.train.batch
+    num_crops = 4
+    image = tf.constant(self._padded_batch([ [ 40, 30 ] ], [ 40, 30 ])[0])
+    replicas = dermatologic_preprocessing.preprocess_batch_for_train(
+        tf.expand_dims(image, 0), 16, 16, num_crops=num_crops, fast_mode=True)
+    self.assertEqual(replicas.get_shape().as_list(), [ num_crops, 16, 16, 3 ])
+    batch = tf.train.batch([ replicas ], batch_size=2, num_threads=1, capacity=4)
+    with self.test_session() as sess:
+      coord = tf.train.Coordinator()
+      threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+      self.assertEqual(sess.run(batch).shape, (2, num_crops, 16, 16, 3))
+      coord.request_stop()
+      coord.join(threads)
+
+
+class Rot90RowsTest(tf.test.TestCase):
+
+  def testTurns(self):
+    images = np.random.RandomState(0).rand(5, 6, 6, 3).astype(np.float32)
+    turns = [ 0, 1, 2, 3, 1 ]
+    with self.test_session() as sess:
+      rotated = sess.run(dermatologic_preprocessing.rot90_rows(tf.constant(images), turns=tf.constant(turns)))
+    for image, turn, rotated_image in zip(images, turns, rotated):
+      self.assertAllClose(rotated_image, np.rot90(image, turn))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,134 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Converts a frozen inference graph to fp16 or int8, calibrating the int8 graphs on training images.
+
+The input is a frozen graph exported by export_inference_graph.py, and the output is a frozen graph
+for predict_image_classifier.py --frozen_graph (see deployment/frozen_graph.py). The int8 graphs are
+calibrated on --calibration_samples images of the training split, preprocessed as in the feature
+extraction, so the ranges of the eight-bit activations are fixed.
+
+Quantization changes the features slightly, so check that the downstream SVM layer is not affected:
+extract the features of a validation split with both the float32 and the quantized graphs, and run
+predict_svm_layer.py on the quantized features with --reference_test (the float32 features) and
+--auc_tolerance, which fails if the AUCs differ by more than the tolerance.
+
+Usage:
+  python quantize_inference_graph.py --frozen_graph=inception_v4_frozen.pb --precision=int8 \
+      --dataset_dir=... --output_file=inception_v4_int8.pb
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from datasets import dataset_factory
+from datasets import tf_data_provider
+from deployment import frozen_graph
+from preprocessing import preprocessing_factory
+
+tf.app.flags.DEFINE_string(
+    'frozen_graph', None, 'The frozen (float32) inference graph, exported by export_inference_graph.py.')
+
+tf.app.flags.DEFINE_string(
+    'precision', 'int8', 'The precision of the converted graph: int8 or fp16.')
+
+tf.app.flags.DEFINE_string(
+    'output_file', None, 'File to output the converted graph. Its description goes to <output_file>.json.')
+
+tf.app.flags.DEFINE_string(
+    'dataset_name', 'skin_lesions', 'The name of the dataset of the calibration images.')
+
+tf.app.flags.DEFINE_string(
+    'dataset_split_name', 'train', 'The name of the split of the calibration images.')
+
+tf.app.flags.DEFINE_string(
+    'dataset_dir', None, 'The directory where the dataset files are stored.')
+
+tf.app.flags.DEFINE_integer(
+    'calibration_samples', 256, 'The number of images (randomly chosen) that calibrate the int8 graphs.')
+
+tf.app.flags.DEFINE_integer(
+    'batch_size', 16, 'The number of calibration images in each batch.')
+
+tf.app.flags.DEFINE_string(
+    'preprocessing_name', 'dermatologic', 'The name of the preprocessing to use. Default: dermatologic')
+
+tf.app.flags.DEFINE_bool(
+    'augmented_calibration', True,
+    'Preprocesses the calibration images with the test-time augmentation (as when extracting features '
+    'with --eval_replicas>1), instead of the plain evaluation preprocessing.')
+
+tf.app.flags.DEFINE_bool(
+    'aggressive_augmentation', False, 'Turn off fast_mode on preprocessing')
+
+tf.app.flags.DEFINE_bool(
+    'add_rotations', False, 'Add random rotations to augmentation on preprocessing')
+
+tf.app.flags.DEFINE_integer(
+    'normalize_per_image', 0, 'Normalization per image: 0 (None), 1 (Mean), 2 (Mean and Stddev)')
+
+tf.app.flags.DEFINE_float(
+    'minimum_area_to_crop', 0.05, 'Minimum area to keep in cropping for augmentation')
+
+FLAGS = tf.app.flags.FLAGS
+
+
+def main(unparsed):
+  unparsed = unparsed[1:]
+  if unparsed:
+    raise ValueError('Unrecognized arguments: %s' % ' '.join(unparsed))
+
+  if not FLAGS.frozen_graph:
+    raise ValueError('You must supply the frozen graph with --frozen_graph')
+
+  if not FLAGS.output_file:
+    raise ValueError('You must supply the output file with --output_file')
+
+  valid_precisions = [ 'int8', 'fp16' ]
+  if not FLAGS.precision in valid_precisions:
+    raise ValueError('Option --precision must be one of ' + ' '.join(valid_precisions))
+
+  if FLAGS.precision=='int8' and not FLAGS.dataset_dir:
+    raise ValueError('You must supply the dataset directory (of the calibration images) with --dataset_dir')
+
+  tf.logging.set_verbosity(tf.logging.INFO)
+  graph_def, info = frozen_graph.read(FLAGS.frozen_graph)
+  tf.logging.info('Converting %s to %s', FLAGS.frozen_graph, FLAGS.precision)
+  graph_def, info = frozen_graph.quantize(graph_def, info, FLAGS.precision)
+
+  if FLAGS.precision=='int8':
+    image_size = info['image_size']
+    preprocessing_fn = preprocessing_factory.get_preprocessing(
+        FLAGS.preprocessing_name, is_training=FLAGS.augmented_calibration)
+
+    def preprocess(image):
+      if FLAGS.preprocessing_name=='dermatologic':
+        image = preprocessing_fn(image, image_size, image_size,
+            fast_mode=not FLAGS.aggressive_augmentation,
+            area_range=(FLAGS.minimum_area_to_crop, 1.0),
+            add_rotations=FLAGS.add_rotations,
+            normalize_per_image=FLAGS.normalize_per_image)
+      else:
+        image = preprocessing_fn(image, image_size, image_size)
+      return (image,)
+
+    def input_fn():
+      dataset = dataset_factory.get_dataset(
+          FLAGS.dataset_name, FLAGS.dataset_split_name, FLAGS.dataset_dir, items=[])
+      batches = tf_data_provider.make_batched_dataset(
+          dataset, [ dataset.input_field ], preprocess, FLAGS.batch_size, shuffle=True, seed=0)
+      return batches.make_one_shot_iterator().get_next()[0]
+
+    num_batches = max(1, FLAGS.calibration_samples // FLAGS.batch_size)
+    tf.logging.info('Calibrating on %d images of %s/%s', num_batches * FLAGS.batch_size,
+                    FLAGS.dataset_name, FLAGS.dataset_split_name)
+    graph_def, info = frozen_graph.calibrate(graph_def, info, input_fn, num_batches)
+
+  frozen_graph.write(graph_def, info, FLAGS.output_file)
+  tf.logging.info('Wrote %s (%d nodes, %.1f MB)', FLAGS.output_file, len(graph_def.node),
+                  graph_def.ByteSize() / 2.0**20)
+
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,354 @@
+# Copyright 2017 Eduardo Valle. All rights reserved.
+# eduardovalle.com/ github.com/learningtitans
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Writers and readers for the features extracted by predict_image_classifier.py.
+
+The writers receive the samples in blocks (see ChunkedFeatureWriter), so that each block is
+serialized with a single bulk call, possibly in a background thread.
+
+The columnar format is a memory-mappable container. Layout of the file:
+  [0, 64)             preamble: _COLUMNAR_MAGIC, padded with zeros
+  [64, 64+N*F*4)      features, float32 little-endian, C order, shape [N, F]
+  [64+N*F*4, end-8)   trailer: pickled dict with the ids, labels (int64 array), sizes and flags
+  [end-8, end)        offset of the trailer, uint64 little-endian
+
+The features block is contiguous and aligned, so it can be memory-mapped directly by the readers,
+without parsing nor converting any sample. The ids and labels are small and kept in the trailer,
+which allows writing the features as a stream, before the number of samples is known.
+
+The writers can be synced to disk at any point of the stream (see ChunkedFeatureWriter.sync()):
+the returned state allows to truncate a partial file back to that point and to continue writing
+it, e.g., when resuming an interrupted extraction.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import io
+import os
+import pickle
+import queue
+import struct
+import sys
+import threading
+
+import numpy as np
+
+from svm_layer import utils as su
+
+_COLUMNAR_MAGIC = b'\x93SVMFEAT'
+_COLUMNAR_VERSION = 1
+_FEATURES_OFFSET = 64
+_FEATURES_DTYPE = np.dtype('<f4')
+_TRAILER_OFFSET_FORMAT = '<Q'
+_TRAILER_OFFSET_SIZE = struct.calcsize(_TRAILER_OFFSET_FORMAT)
+_TEXT_FLOAT_FORMAT = '%.16f'
+
+
+def partial_filename(filename, task_index, num_tasks):
+  """Returns the name of the partial output of a task of a sharded extraction (see merge_features.py)."""
+  if num_tasks==1:
+    return filename
+  return '%s.part-%05d-of-%05d' % (filename, task_index, num_tasks)
+
+
+def progress_filename(filename, task_index, num_tasks):
+  """Returns the name of the progress record of the (partial) output filename of a task, present while
+  the task is unfinished (see predict_image_classifier.py --resume)."""
+  return partial_filename(filename, task_index, num_tasks) + '.progress'
+
+
+def sync_file(outfile):
+  """Flushes a file to disk, and returns its state (the offset where the next write will go)."""
+  outfile.flush()
+  os.fsync(outfile.fileno())
+  return { 'offset' : outfile.tell() }
+
+
+def reopen_file(filename, state, mode):
+  """Reopens a file (mode 'r+t' or 'r+b') truncated to a state returned by sync_file()."""
+  outfile = open(filename, mode)
+  outfile.seek(state['offset'])
+  outfile.truncate()
+  return outfile
+
+
+class TextBlockWriter(object):
+  """Writes blocks of samples as lines of comma-separated values (text format)."""
+
+  def __init__(self, outfile, write_ids=True):
+    self._outfile = outfile
+    self._write_ids = write_ids
+
+  def write_block(self, ids, labels, features):
+    record_format = ', '.join(([ '%s' ] if self._write_ids else [ ]) + [ '%s' ] +
+                              [ _TEXT_FLOAT_FORMAT ] * features.shape[1])
+    records = []
+    for s in range(features.shape[0]):
+      fields  = [ ids[s] ] if self._write_ids else [ ]
+      fields += [ labels[s] ]
+      fields += features[s].tolist()
+      records.append(record_format % tuple(fields))
+    self._outfile.write('\n'.join(records) + '\n')
+
+  def sync(self):
+    return sync_file(self._outfile)
+
+  def close(self):
+    if self._outfile is sys.stdout:
+      self._outfile.flush()
+    else:
+      self._outfile.close()
+
+
+class PickleBlockWriter(object):
+  """Writes blocks of samples as a stream of per-sample pickled records (pickle format)."""
+
+  def __init__(self, outfile):
+    self._outfile = outfile
+
+  def write_block(self, ids, labels, features):
+    records = io.BytesIO()
+    for s in range(features.shape[0]):
+      pickle.dump([ids[s], labels[s], features[s]], records)
+    self._outfile.write(records.getvalue())
+
+  def sync(self):
+    return sync_file(self._outfile)
+
+  def close(self):
+    self._outfile.close()
+
+
+class ColumnarFeatureWriter(object):
+  """Writes samples (id, label, features) to a columnar features file.
+
+  If state (returned by sync()) is given, continues a partial file from that state.
+  """
+
+  def __init__(self, filename, flags=None, state=None):
+    self._flags = flags
+    if state is None:
+      self._file = open(filename, 'wb')
+      self._file.write(_COLUMNAR_MAGIC.ljust(_FEATURES_OFFSET, b'\0'))
+      self._ids = []
+      self._labels = []
+      self._feature_size = None
+    else:
+      self._file = reopen_file(filename, state, 'r+b')
+      self._ids = list(state['ids'])
+      self._labels = list(state['labels'])
+      self._feature_size = state['feature_size']
+
+  def write(self, image_id, label, features):
+    features = np.asarray(features, dtype=_FEATURES_DTYPE).reshape([1, -1])
+    self.write_block([ image_id ], [ label ], features)
+
+  def write_block(self, ids, labels, features):
+    features = np.ascontiguousarray(features, dtype=_FEATURES_DTYPE)
+    if self._feature_size is None:
+      self._feature_size = features.shape[1]
+    elif features.shape[1]!=self._feature_size:
+      raise ValueError('inconsistent feature size: expected %d, found %d' %
+                       (self._feature_size, features.shape[1]))
+    self._file.write(features.tobytes())
+    self._ids.extend(ids)
+    self._labels.extend(labels)
+
+  def sync(self):
+    state = sync_file(self._file)
+    state.update(ids=list(self._ids), labels=list(self._labels), feature_size=self._feature_size)
+    return state
+
+  def close(self):
+    if self._file is None:
+      return
+    trailer = {
+        'version'         : _COLUMNAR_VERSION,
+        'num_samples'     : len(self._ids),
+        'feature_size'    : self._feature_size or 0,
+        'features_offset' : _FEATURES_OFFSET,
+        'features_dtype'  : _FEATURES_DTYPE.str,
+        'ids'             : self._ids,
+        'labels'          : np.asarray(self._labels, dtype=np.int64),
+        'flags'           : self._flags,
+      }
+    trailer_offset = self._file.tell()
+    pickle.dump(trailer, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+    self._file.write(struct.pack(_TRAILER_OFFSET_FORMAT, trailer_offset))
+    self._file.close()
+    self._file = None
+
+
+class ChunkedFeatureWriter(object):
+  """Accumulates samples in a NumPy block, and hands full blocks to a block writer.
+
+  If background is True, the blocks are serialized by a writer thread, fed by a bounded queue, so
+  the caller only waits for the disk when max_pending_chunks blocks are already waiting.
+  """
+
+  def __init__(self, block_writer, feature_size, chunk_size=256, background=False,
+               max_pending_chunks=2):
+    self._block_writer = block_writer
+    self._feature_size = feature_size
+    self._chunk_size = max(1, chunk_size)
+    self._new_chunk()
+    self._error = None
+    if background:
+      self._queue = queue.Queue(maxsize=max_pending_chunks)
+      self._thread = threading.Thread(target=self._write_loop, name='feature_writer')
+      self._thread.daemon = True
+      self._thread.start()
+    else:
+      self._queue = None
+      self._thread = None
+
+  def _new_chunk(self):
+    self._ids = []
+    self._labels = []
+    self._features = np.empty([self._chunk_size, self._feature_size], dtype=_FEATURES_DTYPE)
+
+  def _write_loop(self):
+    while True:
+      chunk = self._queue.get()
+      if chunk is None:
+        self._queue.task_done()
+        break
+      if self._error is None:
+        try:
+          self._block_writer.write_block(*chunk)
+        except Exception as error: # Reported to the caller on the next flush or on close
+          self._error = error
+      self._queue.task_done()
+
+  def _check_error(self):
+    if self._error is not None:
+      raise IOError('the feature writer thread failed: %s' % self._error)
+
+  def write(self, image_id, label, features):
+    self._features[len(self._ids)] = features
+    self._ids.append(image_id)
+    self._labels.append(label)
+    if len(self._ids)==self._chunk_size:
+      self.flush()
+
+  def flush(self):
+    if not self._ids:
+      return
+    chunk = (self._ids, self._labels, self._features[:len(self._ids)])
+    self._new_chunk()
+    if self._queue is None:
+      self._block_writer.write_block(*chunk)
+    else:
+      self._check_error()
+      self._queue.put(chunk)
+
+  def sync(self):
+    """Writes all pending samples to disk, and returns the state of the block writer."""
+    self.flush()
+    if self._queue is not None:
+      self._queue.join()
+    self._check_error()
+    return self._block_writer.sync()
+
+  def close(self):
+    self.flush()
+    if self._thread is not None:
+      self._queue.put(None)
+      self._thread.join()
+      self._thread = None
+    self._check_error()
+    self._block_writer.close()
+
+
+def is_columnar_file(filename):
+  with open(filename, 'rb') as source:
+    return source.read(len(_COLUMNAR_MAGIC))==_COLUMNAR_MAGIC
+
+
+def read_columnar_header(filename):
+  with open(filename, 'rb') as source:
+    if source.read(len(_COLUMNAR_MAGIC))!=_COLUMNAR_MAGIC:
+      raise ValueError('%s is not a columnar features file' % filename)
+    source.seek(-_TRAILER_OFFSET_SIZE, 2)
+    trailer_offset, = struct.unpack(_TRAILER_OFFSET_FORMAT, source.read(_TRAILER_OFFSET_SIZE))
+    source.seek(trailer_offset)
+    trailer = pickle.load(source)
+  if trailer['version']>_COLUMNAR_VERSION:
+    raise ValueError('%s has an unsupported version: %d' % (filename, trailer['version']))
+  return trailer
+
+
+def read_columnar_data(filename, mmap_mode='c'):
+  """Reads a columnar features file, memory-mapping the features.
+
+  The default copy-on-write mode lets the preprocessors (e.g., PCA(copy=False)) transform the
+  features in place without ever touching the file.
+  """
+  trailer = read_columnar_header(filename)
+  num_samples = trailer['num_samples']
+  feature_size = trailer['feature_size']
+  if num_samples>0:
+    features = np.memmap(filename, dtype=np.dtype(trailer['features_dtype']), mode=mmap_mode,
+                         offset=trailer['features_offset'], shape=(num_samples, feature_size))
+  else:
+    features = np.empty([0, feature_size], dtype=np.dtype(trailer['features_dtype']))
+  labels = trailer['labels'].astype(np.float64)
+  return trailer['ids'], labels, features
+
+
+def read_features_data(filename):
+  """Reads a features file either in the columnar or in the (legacy) pickle format."""
+  if is_columnar_file(filename):
+    return read_columnar_data(filename)
+  else:
+    return su.read_pickled_data(filename)
+
+
+def merge_feature_files(input_files, output_file, chunk_size=4096):
+  """Concatenates features files of the same format (text, pickle or columnar), in the given order.
+
+  The sample counts in the headers are summed; the rest of the headers (and the flags, in the
+  columnar format) are taken from the first file.
+  """
+  if is_columnar_file(input_files[0]):
+    writer = None
+    for input_file in input_files:
+      ids, labels, features = read_columnar_data(input_file, mmap_mode='r')
+      if writer is None:
+        writer = ColumnarFeatureWriter(output_file, flags=read_columnar_header(input_file)['flags'])
+      for c in range(0, features.shape[0], chunk_size):
+        writer.write_block(ids[c:c+chunk_size], labels[c:c+chunk_size].astype(np.int64),
+                           features[c:c+chunk_size])
+    writer.close()
+    return
+  with open(input_files[0], 'rb') as source:
+    is_pickle = source.read(1)==pickle.PROTO
+  sources = [ open(input_file, 'rb') for input_file in input_files ]
+  if is_pickle:
+    headers = [ pickle.load(source) for source in sources ]
+    header = pickle.dumps([ sum(h[0] for h in headers) ] + headers[0][1:])
+  else:
+    headers = [ (int(source.readline()), source.readline()) for source in sources ]
+    header = ('%d\n' % sum(h[0] for h in headers)).encode('utf-8') + headers[0][1]
+  with open(output_file, 'wb') as merged:
+    merged.write(header)
+    for source in sources:
+      # The records follow the header, and are copied as they are
+      while True:
+        block = source.read(1 << 24)
+        if not block:
+          break
+        merged.write(block)
+      source.close()
@@ -20,15 +20,22 @@ from __future__ import division
 from __future__ import print_function
 
 import datetime
+import os
+import re
 import signal
 import sys
+import time
 
 import tensorflow as tf
 
 from tensorflow.python.ops import control_flow_ops
 from datasets import dataset_factory
+from datasets import tf_data_provider
+from deployment import cpu_config
 from deployment import model_deploy
+from deployment import train_telemetry
 from nets import nets_factory
+from preprocessing import dermatologic_preprocessing
 from preprocessing import preprocessing_factory
 
 slim = tf.contrib.slim
@@ -71,6 +78,16 @@ tf.app.flags.DEFINE_integer(
     'num_preprocessing_threads', 4,
     'The number of threads used to create the batches.')
 
+tf.app.flags.DEFINE_string(
+    'input_pipeline', 'queue',
+    'The input pipeline: queue (slim DatasetDataProvider with queue runners) or dataset (tf.data, '
+    'with parallel interleaved reading, parallel decoding and preprocessing fused with the '
+    'batching, and prefetch; requires TensorFlow 1.9+).')
+
+tf.app.flags.DEFINE_integer(
+    'prefetch_batches', 2,
+    'The number of batches prefetched by --input_pipeline=dataset.')
+
 tf.app.flags.DEFINE_integer(
     'log_every_n_steps', 10,
     'The frequency with which logs are print.')
@@ -79,6 +96,24 @@ tf.app.flags.DEFINE_integer(
     'save_summaries_secs', 600,
     'The frequency with which summaries are saved, in seconds.')
 
+tf.app.flags.DEFINE_string(
+    'summary_policy', 'minimal',
+    'The summaries saved every --save_summaries_secs: minimal (default, the total loss and the learning '
+    'rate), none, scalars (all scalar summaries: losses, learning rate, sparsity of the end_points, '
+    'fill of the queues), sampled (the scalars, plus the histograms of the end_points and variables '
+    'every --summary_histogram_steps steps), or whitelist (the summaries, of any kind, whose names match '
+    '--summary_whitelist). The image summaries of --preprocessing_summaries are kept in all policies.')
+
+tf.app.flags.DEFINE_integer(
+    'summary_histogram_steps', 1000,
+    'With --summary_policy=sampled, the number of steps between the histogram summaries. The histograms '
+    'are fetched in the same run as the train op, so they describe the batch of that step.')
+
+tf.app.flags.DEFINE_string(
+    'summary_whitelist', None,
+    'With --summary_policy=whitelist, comma-separated regular expressions matched against the start of '
+    'the summary names, e.g., total_loss,learning_rate,losses/.*,activations/Mixed_7d')
+
 tf.app.flags.DEFINE_integer(
     'save_interval_secs', 600,
     'The frequency with which the model is saved, in seconds.')
@@ -86,6 +121,25 @@ tf.app.flags.DEFINE_integer(
 tf.app.flags.DEFINE_integer(
     'task', 0, 'Task id of the replica running the training.')
 
+tf.app.flags.DEFINE_string(
+    'telemetry_file', None,
+    'CSV file to append the wall time, examples/sec, and fill level of the input queues (with '
+    '--input_pipeline=queue) of each step. By default, telemetry.csv (telemetry_<task>.csv with '
+    'several --worker_replicas) in --train_dir.')
+
+tf.app.flags.DEFINE_integer(
+    'telemetry_every_steps', 100,
+    'The number of steps averaged in each telemetry summary.')
+
+tf.app.flags.DEFINE_float(
+    'starvation_fill', 0.1,
+    'Fill level (0.0 to 1.0) under which an input queue is considered nearly empty.')
+
+tf.app.flags.DEFINE_integer(
+    'starvation_steps', 50,
+    'Warns that the training is starved by the input pipeline when an input queue is nearly empty '
+    'during this many consecutive steps.')
+
 tf.app.flags.DEFINE_bool(
     'verbose_placement', False,
     'Shows detailed information about device placement.')
@@ -98,6 +152,20 @@ tf.app.flags.DEFINE_bool(
     'fixed_memory', False,
     'Allocates the entire memory at once.')
 
+tf.app.flags.DEFINE_integer(
+    'intra_op_parallelism_threads', 0,
+    'Threads available to each op (e.g., a convolution). If 0, TensorFlow chooses (all cores of the '
+    'host, or all cores in --cpu_affinity).')
+
+tf.app.flags.DEFINE_integer(
+    'inter_op_parallelism_threads', 0,
+    'Ops run in parallel. If 0, TensorFlow chooses (all cores of the host, or all cores in --cpu_affinity).')
+
+tf.app.flags.DEFINE_string(
+    'cpu_affinity', None,
+    'Pins the process to a list of cores, e.g., 0-7 or 0-3,8-11, so several jobs on one host do not '
+    'contend for the same cores. See tune_threads.py to find the best settings for a model.')
+
 ######################
 # Optimization Flags #
 ######################
@@ -157,6 +225,18 @@ tf.app.flags.DEFINE_string(
     'Specifies how the learning rate is decayed. One of "fixed", "exponential",'
     ' or "polynomial"')
 
+tf.app.flags.DEFINE_string(
+    'mixed_precision', 'none',
+    'Computes the convolutions and activations in reduced precision: none (default), float16 or bfloat16. '
+    'The weights are kept, and updated, in float32, and the losses are computed in float32. Requires '
+    'TensorFlow 1.9+ (fused float16 batch normalizations), and, for bfloat16, a build with bfloat16 kernels.')
+
+tf.app.flags.DEFINE_float(
+    'loss_scale', None,
+    'Factor of the loss in the backward pass, so the small float16 gradients do not underflow (the '
+    'gradients are unscaled before the update). By default, 128 with --mixed_precision=float16, and 1 '
+    'otherwise (bfloat16 has the range of float32).')
+
 tf.app.flags.DEFINE_float('learning_rate', 0.01, 'Initial learning rate.')
 
 tf.app.flags.DEFINE_float(
@@ -240,6 +320,17 @@ tf.app.flags.DEFINE_integer(
 tf.app.flags.DEFINE_float(
     'minimum_area_to_crop', 0.05, 'Minimum area to keep in cropping for augmentation')
 
+tf.app.flags.DEFINE_string(
+    'preprocessing_summaries', 'none',
+    'Image summaries of the dermatologic training transformations: none (default), sampled (a '
+    'small random fraction of the images) or full (every image, which slows down the input).')
+
+tf.app.flags.DEFINE_bool(
+    'batched_augmentation', False,
+    'Augments whole (zero-padded) batches with a vectorized subgraph, with per-example crops, flips, '
+    'colors and rotations, instead of one image at a time in the preprocessing threads. Requires '
+    'the dermatologic preprocessing. The crops are always resized with bilinear interpolation.')
+
 tf.app.flags.DEFINE_integer(
     'use_special_schedule', 0, 'Use special schedule for training: 0 (None), 1 (Final round of fine tuning on important images)')
 
@@ -437,6 +528,33 @@ def _get_variables_to_train():
   return variables_to_train
 
 
+class _ExtraFetchSession(object):
+  """Wraps the session given to slim.learning.train_step(), adding extra fetches to its run of the train op.
+
+  The other runs (e.g., of should_log and should_stop) and the run options (e.g., of the traces) go
+  through untouched. After the step, extra_results holds the values of the extra fetches, and
+  global_step the value of the global step fetched with the train op.
+  """
+
+  def __init__(self, sess, train_op, extra_fetches):
+    self._sess = sess
+    self._train_op = train_op
+    self._extra_fetches = extra_fetches
+    self.extra_results = None
+    self.global_step = None
+
+  def run(self, fetches, *args, **kwargs):
+    if isinstance(fetches, list) and fetches and fetches[0] is self._train_op:
+      results = self._sess.run(fetches + [ self._extra_fetches ], *args, **kwargs)
+      self.extra_results = results[-1]
+      self.global_step = results[1]
+      return results[:-1]
+    return self._sess.run(fetches, *args, **kwargs)
+
+  def __getattr__(self, name):
+    return getattr(self._sess, name)
+
+
 def main(unparsed):
 
   this_app_path = unparsed[0]
@@ -453,6 +571,31 @@ def main(unparsed):
   if not FLAGS.normalize_per_image in [0, 1, 2]:
     raise ValueError('Invalid value for --normalize_per_image: must be 0, 1 or 2')
 
+  valid_summary_levels = [ 'none', 'sampled', 'full' ]
+  if not FLAGS.preprocessing_summaries in valid_summary_levels:
+    raise ValueError('Option --preprocessing_summaries must be one of ' + ' '.join(valid_summary_levels))
+
+  if FLAGS.batched_augmentation and FLAGS.preprocessing_name!='dermatologic':
+    raise ValueError('Option --batched_augmentation requires --preprocessing_name=dermatologic')
+
+  valid_input_pipelines = [ 'queue', 'dataset' ]
+  if not FLAGS.input_pipeline in valid_input_pipelines:
+    raise ValueError('Option --input_pipeline must be one of ' + ' '.join(valid_input_pipelines))
+
+  valid_precisions = [ 'none', 'float16', 'bfloat16' ]
+  if not FLAGS.mixed_precision in valid_precisions:
+    raise ValueError('Option --mixed_precision must be one of ' + ' '.join(valid_precisions))
+
+  valid_summary_policies = [ 'minimal', 'none', 'scalars', 'sampled', 'whitelist' ]
+  if not FLAGS.summary_policy in valid_summary_policies:
+    raise ValueError('Option --summary_policy must be one of ' + ' '.join(valid_summary_policies))
+
+  if (FLAGS.summary_policy=='whitelist')!=bool(FLAGS.summary_whitelist):
+    raise ValueError('Option --summary_whitelist must be used with --summary_policy=whitelist, and vice-versa')
+
+  # Pins the process before the session creates its thread pools, which inherit the affinity
+  cpus = cpu_config.set_cpu_affinity(FLAGS.cpu_affinity) if FLAGS.cpu_affinity else None
+
   tf.logging.set_verbosity(tf.logging.INFO)
   with tf.Graph().as_default():
     #######################
@@ -472,8 +615,10 @@ def main(unparsed):
     ######################
     # Select the dataset #
     ######################
+    # Only the input field and the task label are parsed from each record
     dataset = dataset_factory.get_dataset(
-        FLAGS.dataset_name, FLAGS.dataset_split_name, FLAGS.dataset_dir)
+        FLAGS.dataset_name, FLAGS.dataset_split_name, FLAGS.dataset_dir,
+        items=[ FLAGS.task_name ])
 
     ######################
     # Select the network #
@@ -496,44 +641,119 @@ def main(unparsed):
     # Create a dataset provider that loads data from the dataset #
     ##############################################################
     with tf.device(deploy_config.inputs_device()):
-      provider = slim.dataset_data_provider.DatasetDataProvider(
-          dataset,
-          num_readers=FLAGS.num_readers,
-          common_queue_capacity=20 * FLAGS.batch_size,
-          common_queue_min=10 * FLAGS.batch_size)
-      [image, label] = provider.get([dataset.input_field, FLAGS.task_name])
-      label -= FLAGS.labels_offset
-
       train_image_size = FLAGS.train_image_size or network_fn.default_image_size
-
-      if FLAGS.preprocessing_name=='dermatologic':
-        image = image_preprocessing_fn(image, train_image_size, train_image_size,
-            bbox=None,
+      # The tf.data pipelines do not expose the fill level of their buffers
+      input_queues = []
+
+      def preprocess(image, label):
+        label -= FLAGS.labels_offset
+        if FLAGS.preprocessing_name=='dermatologic':
+          image = image_preprocessing_fn(image, train_image_size, train_image_size,
+              bbox=None,
+              fast_mode=not FLAGS.aggressive_augmentation,
+              area_range=(FLAGS.minimum_area_to_crop, 1.0),
+              add_rotations=FLAGS.add_rotations,
+              normalize_per_image=FLAGS.normalize_per_image,
+              summary_level=FLAGS.preprocessing_summaries)
+        else:
+          image = image_preprocessing_fn(image, train_image_size, train_image_size)
+        return image, label
+
+      num_classes = dataset.num_classes - FLAGS.labels_offset
+
+      def distort_batch(images, image_sizes, labels):
+        images = dermatologic_preprocessing.preprocess_batch_for_train(
+            images, train_image_size, train_image_size,
+            image_sizes=image_sizes,
             fast_mode=not FLAGS.aggressive_augmentation,
             area_range=(FLAGS.minimum_area_to_crop, 1.0),
             add_rotations=FLAGS.add_rotations,
             normalize_per_image=FLAGS.normalize_per_image)
+        return images, labels
+
+      if FLAGS.batched_augmentation and FLAGS.input_pipeline=='dataset':
+        # The images are padded to a common size and augmented as whole batches
+        def prepare(image, label):
+          label -= FLAGS.labels_offset
+          return image, tf.shape(image)[:2], slim.one_hot_encoding(label, num_classes)
+        batches = tf_data_provider.make_padded_batched_dataset(
+            dataset, [dataset.input_field, FLAGS.task_name],
+            preprocess_fn=prepare,
+            batch_preprocess_fn=distort_batch,
+            batch_size=FLAGS.batch_size,
+            shuffle=True,
+            num_readers=FLAGS.num_readers,
+            num_parallel_calls=FLAGS.num_preprocessing_threads,
+            prefetch_batches=FLAGS.prefetch_batches)
+        batch_queue = tf_data_provider.DatasetQueue(batches, FLAGS.batch_size)
+      elif FLAGS.input_pipeline=='dataset':
+        def preprocess_one_hot(image, label):
+          image, label = preprocess(image, label)
+          return image, slim.one_hot_encoding(label, num_classes)
+        batches = tf_data_provider.make_batched_dataset(
+            dataset, [dataset.input_field, FLAGS.task_name],
+            preprocess_fn=preprocess_one_hot,
+            batch_size=FLAGS.batch_size,
+            shuffle=True,
+            num_readers=FLAGS.num_readers,
+            num_parallel_calls=FLAGS.num_preprocessing_threads,
+            prefetch_batches=FLAGS.prefetch_batches)
+        batch_queue = tf_data_provider.DatasetQueue(batches, FLAGS.batch_size)
       else:
-        image = image_preprocessing_fn(image, train_image_size, train_image_size)
-
-      images, labels = tf.train.batch(
-          [image, label],
-          batch_size=FLAGS.batch_size,
-          num_threads=FLAGS.num_preprocessing_threads,
-          capacity=5 * FLAGS.batch_size)
-      labels = slim.one_hot_encoding(
-          labels, dataset.num_classes - FLAGS.labels_offset)
-      batch_queue = slim.prefetch_queue.prefetch_queue(
-          [images, labels], capacity=2 * deploy_config.num_clones)
+        provider = slim.dataset_data_provider.DatasetDataProvider(
+            dataset,
+            num_readers=FLAGS.num_readers,
+            common_queue_capacity=20 * FLAGS.batch_size,
+            common_queue_min=10 * FLAGS.batch_size)
+        [image, label] = provider.get([dataset.input_field, FLAGS.task_name])
+
+        if FLAGS.batched_augmentation:
+          # The images are padded to a common size and augmented as whole batches
+          label -= FLAGS.labels_offset
+          with tf.name_scope('batch_queue') as batch_scope:
+            images, image_sizes, labels = tf.train.batch(
+                [image, tf.shape(image)[:2], label],
+                batch_size=FLAGS.batch_size,
+                num_threads=FLAGS.num_preprocessing_threads,
+                capacity=5 * FLAGS.batch_size,
+                dynamic_pad=True)
+          images, labels = distort_batch(images, image_sizes, labels)
+        else:
+          image, label = preprocess(image, label)
+          with tf.name_scope('batch_queue') as batch_scope:
+            images, labels = tf.train.batch(
+                [image, label],
+                batch_size=FLAGS.batch_size,
+                num_threads=FLAGS.num_preprocessing_threads,
+                capacity=5 * FLAGS.batch_size)
+        # tf.train.batch does not return its queue: it is the one of the queue runner in its scope
+        [batch_runner] = tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS, scope=batch_scope)
+        batch_fifo = batch_runner.queue
+        labels = slim.one_hot_encoding(labels, num_classes)
+        batch_queue = slim.prefetch_queue.prefetch_queue(
+            [images, labels], capacity=2 * deploy_config.num_clones)
+        input_queues = [ ('batch_queue', batch_fifo, 5 * FLAGS.batch_size),
+                         ('prefetch_queue', batch_queue, 2 * deploy_config.num_clones) ]
 
     ####################
     # Define the model #
     ####################
+    compute_dtype = { 'float16' : tf.float16, 'bfloat16' : tf.bfloat16 }.get(FLAGS.mixed_precision)
+
     def clone_fn(batch_queue):
       """Allows data parallelism by creating multiple clones of network_fn."""
       with tf.device(deploy_config.inputs_device()):
         images, labels = batch_queue.dequeue()
-      logits, end_points = network_fn(images)
+      if compute_dtype is None:
+        logits, end_points = network_fn(images)
+      else:
+        # The float32 variables are cast to the dtype of the images by each layer that uses them
+        with tf.variable_scope(tf.get_variable_scope(),
+                               custom_getter=model_deploy.mixed_precision_getter(compute_dtype)):
+          logits, end_points = network_fn(tf.cast(images, compute_dtype))
+        logits = tf.cast(logits, tf.float32)
+        if 'AuxLogits' in end_points:
+          end_points['AuxLogits'] = tf.cast(end_points['AuxLogits'], tf.float32)
 
       #############################
       # Specify the loss function #
@@ -556,8 +776,11 @@ def main(unparsed):
     # the updates for the batch_norm variables created by network_fn.
     update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS, first_clone_scope)
 
+    # The summaries of the end_points and variables are only created if the policy may keep them
+    detailed_summaries = FLAGS.summary_policy in [ 'scalars', 'sampled', 'whitelist' ]
+
     # Add summaries for end_points.
-    end_points = clones[0].outputs
+    end_points = clones[0].outputs if detailed_summaries else {}
     for end_point in end_points:
       x = end_points[end_point]
       summaries.add(tf.summary.histogram('activations/' + end_point, x))
@@ -569,7 +792,7 @@ def main(unparsed):
       summaries.add(tf.summary.scalar('losses/%s' % loss.op.name, loss))
 
     # Add summaries for variables.
-    for variable in slim.get_model_variables():
+    for variable in slim.get_model_variables() if detailed_summaries else []:
       summaries.add(tf.summary.histogram(variable.op.name, variable))
 
     #################################
@@ -608,9 +831,11 @@ def main(unparsed):
     variables_to_train = _get_variables_to_train()
 
     #  and returns a train_tensor and summary_op
+    loss_scale = FLAGS.loss_scale or (128.0 if FLAGS.mixed_precision=='float16' else 1.0)
     total_loss, clones_gradients = model_deploy.optimize_clones(
         clones,
         optimizer,
+        loss_scale=loss_scale,
         var_list=variables_to_train)
     # Add total_loss to summary.
     summaries.add(tf.summary.scalar('total_loss', total_loss))
@@ -629,24 +854,87 @@ def main(unparsed):
     summaries |= set(tf.get_collection(tf.GraphKeys.SUMMARIES,
                                        first_clone_scope))
 
-    # Merge all summaries together.
-    summary_op = tf.summary.merge(list(summaries), name='summary_op')
+    # Keeps the summaries chosen by the policy
+    if FLAGS.summary_policy=='minimal':
+      whitelist = [ 'total_loss', 'learning_rate' ]
+    elif FLAGS.summary_policy=='whitelist':
+      whitelist = [ w.strip() for w in FLAGS.summary_whitelist.split(',') if w.strip() ]
+    else:
+      whitelist = []
 
-    session_config = tf.ConfigProto(
+    def summary_kept(summary):
+      if summary.op.type=='ImageSummary' and FLAGS.preprocessing_summaries!='none':
+        return True
+      if FLAGS.summary_policy in [ 'scalars', 'sampled' ]:
+        return summary.op.type=='ScalarSummary'
+      # The names of the summary ops may have a numeric suffix, e.g., total_loss_1
+      return any(re.match('(%s)(_[0-9]+)?$' % w, summary.op.name) for w in whitelist)
+
+    # Merge all summaries together.
+    kept_summaries = sorted([ s for s in summaries if summary_kept(s) ], key=lambda s: s.op.name)
+    summary_op = tf.summary.merge(kept_summaries, name='summary_op') if kept_summaries else None
+    if FLAGS.summary_policy=='sampled':
+      histograms = sorted([ s for s in summaries if s.op.type=='HistogramSummary' ], key=lambda s: s.op.name)
+      histogram_op = tf.summary.merge(histograms, name='histogram_op') if histograms else None
+    else:
+      histogram_op = None
+    tf.logging.info('Summary policy %s: %d of %d summaries kept%s', FLAGS.summary_policy,
+                    len(kept_summaries), len(summaries),
+                    ', histograms every %d steps' % FLAGS.summary_histogram_steps if histogram_op is not None else '')
+
+    session_config = cpu_config.session_config(
+        intra_op_threads = FLAGS.intra_op_parallelism_threads,
+        inter_op_threads = FLAGS.inter_op_parallelism_threads,
+        cpus = cpus,
         log_device_placement = FLAGS.verbose_placement,
         allow_soft_placement = not FLAGS.hard_placement)
     if not FLAGS.fixed_memory:
       session_config.gpu_options.allow_growth=True
 
+    ###########################
+    # Configure the telemetry #
+    ###########################
+    with tf.device(deploy_config.inputs_device()):
+      queue_fills = [ tf.cast(queue.size(), tf.float32) / capacity for _, queue, capacity in input_queues ]
+    telemetry_file = FLAGS.telemetry_file or os.path.join(FLAGS.train_dir,
+        'telemetry_%d.csv' % FLAGS.task if FLAGS.worker_replicas>1 else 'telemetry.csv')
+    if not tf.gfile.IsDirectory(FLAGS.train_dir):
+      tf.gfile.MakeDirs(FLAGS.train_dir)
+    # The chief writes all summaries (of the summary_op, and written outside it) to a single event file
+    summary_writer = tf.summary.FileWriter(FLAGS.train_dir) if FLAGS.task==0 else None
+    telemetry = train_telemetry.StepTelemetry(telemetry_file,
+        examples_per_step=FLAGS.batch_size * deploy_config.num_clones,
+        queue_names=[ name for name, _, _ in input_queues ],
+        summary_writer=summary_writer,
+        summary_every_steps=FLAGS.telemetry_every_steps,
+        starvation_fill=FLAGS.starvation_fill,
+        starvation_steps=FLAGS.starvation_steps)
+
     ###########################
     # Kicks off the training. #
     ###########################
 
     def train_step_fn(sess, train_op, global_step, train_step_kwargs):
+      # The fills of the queues, and on the sampled steps the histograms, are fetched in the same run
+      # as the train op: the telemetry adds no run to the steps, and the histograms describe the
+      # batch of the step, with no extra batch dequeued
+      extra_fetches = { 'fills' : queue_fills }
+      if (histogram_op is not None and summary_writer is not None and
+          train_step_fn.steps_done%FLAGS.summary_histogram_steps==0):
+        extra_fetches['histograms'] = histogram_op
+      extra_sess = _ExtraFetchSession(sess, train_op, extra_fetches)
+      step_start = time.time()
       total_loss, should_stop = slim.learning.train_step(
-          sess, train_op, global_step, train_step_kwargs)
+          extra_sess, train_op, global_step, train_step_kwargs)
+      step_time = time.time()-step_start
+      train_step_fn.steps_done += 1
+      step = extra_sess.global_step
+      if 'histograms' in extra_fetches:
+        summary_writer.add_summary(extra_sess.extra_results['histograms'], step)
+      telemetry.record(step, step_time, extra_sess.extra_results['fills'])
       return total_loss, should_stop or train_step_fn.should_stop
     train_step_fn.should_stop = False
+    train_step_fn.steps_done = 0
 
     def exit_gracefully(signum, frame):
       interrupted = datetime.datetime.utcnow()
@@ -675,20 +963,25 @@ def main(unparsed):
       experiment_file.flush()
 
 
-    slim.learning.train(
-        train_tensor,
-        train_step_fn=train_step_fn,
-        logdir=FLAGS.train_dir,
-        master=FLAGS.master,
-        is_chief=(FLAGS.task == 0),
-        init_fn=_get_init_fn(),
-        summary_op=summary_op,
-        number_of_steps=FLAGS.max_number_of_steps,
-        log_every_n_steps=FLAGS.log_every_n_steps,
-        save_summaries_secs=FLAGS.save_summaries_secs,
-        save_interval_secs=FLAGS.save_interval_secs,
-        sync_optimizer=optimizer if FLAGS.sync_replicas else None,
-        session_config=session_config)
+    try:
+      slim.learning.train(
+          train_tensor,
+          train_step_fn=train_step_fn,
+          logdir=FLAGS.train_dir,
+          master=FLAGS.master,
+          is_chief=(FLAGS.task == 0),
+          init_fn=_get_init_fn(),
+          summary_op=summary_op,
+          summary_writer=summary_writer,
+          number_of_steps=FLAGS.max_number_of_steps,
+          log_every_n_steps=FLAGS.log_every_n_steps,
+          save_summaries_secs=FLAGS.save_summaries_secs,
+          save_interval_secs=FLAGS.save_interval_secs,
+          sync_optimizer=optimizer if FLAGS.sync_replicas else None,
+          session_config=session_config)
+    finally:
+      # Keeps the telemetry of the steps done, even if the training fails or is interrupted
+      telemetry.close()
 
     finish = datetime.datetime.utcnow()
     if not FLAGS.experiment_file is None:
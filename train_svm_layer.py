@@ -27,6 +27,7 @@ import sklearn.gaussian_process
 import sklearn.model_selection
 import sklearn.preprocessing
 
+from svm_layer import feature_files as sf
 from svm_layer import utils as su
 
 version_required = (3, 4, 0)
@@ -43,7 +44,7 @@ parser.add_argument('--max_iter_svm', type=int, default=1000, help='maximum numb
 parser.add_argument('--max_iter_hyper', type=int, default=10, help='maximum number of interations for the hyperparameter search.')
 parser.add_argument('--jobs', type=int, default=1, help='number of parallel jobs in the hyperparameter search.')
 parser.add_argument('--preprocess', type=str, default='PCA', help='train and apply a preprocessor for the data: PCA, PCA_WHITEN, Z_SCORE, NONE.')
-parser.add_argument('--input_training', type=str, required=True, help='input file with the training data, in pickle format.')
+parser.add_argument('--input_training', type=str, required=True, help='input file with the training data, in pickle or columnar format.')
 parser.add_argument('--output_model', type=str, required=True, help='output file to receive the model, in pickle format.')
 parser.add_argument('--no_group', default=False, action='store_true', help='do not group samples using id when cross-validating.')
 parser.add_argument('--allow_old_python', help='The script was not tested on Python 2 and will normally require Python 3.4+, '
@@ -70,7 +71,7 @@ def main():
     sys.exit(1)
 
   first = start = su.print_and_time('Reading training data...', file=sys.stderr)
-  ids, labels, features = su.read_pickled_data(FLAGS.input_training)
+  ids, labels, features = sf.read_features_data(FLAGS.input_training)
   start = su.print_and_time('', past=start, file=sys.stderr)
 
 
@@ -0,0 +1,160 @@
+# Contributed 2017 Eduardo Valle. eduardovalle.com/ github.com/learningtitans
+"""Finds the thread pool settings that maximize the throughput of several jobs side by side.
+
+Runs --num_jobs copies of a model side by side, each pinned to its own block of the cores in
+--cpu_affinity, for each combination of intra-op and inter-op threads, and reports the total
+images/sec. The forward pass (--mode=predict) or the forward and backward passes (--mode=train)
+run on random images, so the results measure the network, not the input pipeline. Use the best
+settings with the --cpu_affinity, --intra_op_parallelism_threads and --inter_op_parallelism_threads
+flags of train_image_classifier.py and predict_image_classifier.py.
+
+Usage:
+  python tune_threads.py --model_name=inception_v4 --num_jobs=4 --batch_size=8 --mode=predict
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+import multiprocessing
+import sys
+import time
+
+import tensorflow as tf
+
+from deployment import cpu_config
+from nets import nets_factory
+
+tf.app.flags.DEFINE_string(
+    'model_name', 'inception_v4', 'The name of the architecture to benchmark.')
+
+tf.app.flags.DEFINE_integer(
+    'image_size', None, 'Size of the input images. By default, the default size of the network.')
+
+tf.app.flags.DEFINE_integer(
+    'batch_size', 8, 'The number of images in each step (for prediction, batch_size*eval_replicas).')
+
+tf.app.flags.DEFINE_string(
+    'mode', 'predict', 'What to benchmark: predict (forward pass) or train (forward and backward passes).')
+
+tf.app.flags.DEFINE_integer(
+    'num_jobs', 1, 'The number of jobs side by side, each pinned to its own block of cores.')
+
+tf.app.flags.DEFINE_string(
+    'cpu_affinity', None, 'The cores shared by the jobs, e.g., 0-15. By default, all available cores.')
+
+tf.app.flags.DEFINE_string(
+    'intra_op_threads', None,
+    'Comma-separated intra-op thread counts to try. By default, powers of 2 up to the cores per job.')
+
+tf.app.flags.DEFINE_string(
+    'inter_op_threads', '1,2', 'Comma-separated inter-op thread counts to try.')
+
+tf.app.flags.DEFINE_integer(
+    'warmup_steps', 3, 'Steps run before the timing, in each job.')
+
+tf.app.flags.DEFINE_integer(
+    'steps', 10, 'Steps timed, in each job.')
+
+tf.app.flags.DEFINE_string(
+    'output_file', None, 'CSV file to output the results, in addition to the standard output.')
+
+FLAGS = tf.app.flags.FLAGS
+
+
+def benchmark(model_name, image_size, batch_size, mode, cpus, intra_op_threads, inter_op_threads,
+              warmup_steps, steps, start_barrier, results):
+  """Runs in a job process: pins it, builds the model and reports its images/sec."""
+  cpu_config.set_cpu_affinity(cpu_config.format_cpu_list(cpus))
+  with tf.Graph().as_default():
+    network_fn = nets_factory.get_network_fn(model_name, num_classes=2, is_training=mode=='train')
+    image_size = image_size or network_fn.default_image_size
+    images = tf.random_uniform([ batch_size, image_size, image_size, 3 ], minval=-1.0, maxval=1.0)
+    logits, _ = network_fn(images)
+    if mode=='train':
+      labels = tf.random_uniform([ batch_size ], maxval=2, dtype=tf.int32)
+      loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=logits)
+      step_op = tf.train.GradientDescentOptimizer(0.0).minimize(loss)
+    else:
+      step_op = logits
+    config = cpu_config.session_config(intra_op_threads, inter_op_threads, cpus=cpus)
+    with tf.Session(config=config) as sess:
+      sess.run(tf.global_variables_initializer())
+      for _ in range(warmup_steps):
+        sess.run(step_op)
+      # The jobs are timed together, so they contend for the host as in production
+      start_barrier.wait()
+      start = time.time()
+      for _ in range(steps):
+        sess.run(step_op)
+      results.put(steps * batch_size / (time.time() - start))
+
+
+def run_trial(cpu_blocks, intra_op_threads, inter_op_threads):
+  context = multiprocessing.get_context('spawn')
+  start_barrier = context.Barrier(len(cpu_blocks))
+  results = context.Queue()
+  jobs = [ context.Process(target=benchmark, args=(FLAGS.model_name, FLAGS.image_size,
+               FLAGS.batch_size, FLAGS.mode, cpus, intra_op_threads, inter_op_threads,
+               FLAGS.warmup_steps, FLAGS.steps, start_barrier, results))
+           for cpus in cpu_blocks ]
+  for job in jobs:
+    job.start()
+  for job in jobs:
+    job.join()
+  if any(job.exitcode!=0 for job in jobs):
+    raise RuntimeError('a benchmark job failed with intra_op_threads=%d inter_op_threads=%d' %
+                       (intra_op_threads, inter_op_threads))
+  return [ results.get() for _ in jobs ]
+
+
+def main(unparsed):
+  unparsed = unparsed[1:]
+  if unparsed:
+    raise ValueError('Unrecognized arguments: %s' % ' '.join(unparsed))
+
+  valid_modes = [ 'predict', 'train' ]
+  if not FLAGS.mode in valid_modes:
+    raise ValueError('Option --mode must be one of ' + ' '.join(valid_modes))
+
+  cpus = cpu_config.parse_cpu_list(FLAGS.cpu_affinity) if FLAGS.cpu_affinity else cpu_config.available_cpus()
+  cpus_per_job = len(cpus) // FLAGS.num_jobs
+  if cpus_per_job<1:
+    raise ValueError('Option --num_jobs=%d exceeds the %d cores available' % (FLAGS.num_jobs, len(cpus)))
+  cpu_blocks = [ cpus[j*cpus_per_job:(j+1)*cpus_per_job] for j in range(FLAGS.num_jobs) ]
+
+  if FLAGS.intra_op_threads:
+    intra_op_candidates = [ int(t) for t in FLAGS.intra_op_threads.split(',') ]
+  else:
+    intra_op_candidates = [ 2**e for e in range(cpus_per_job.bit_length()) ]
+    if intra_op_candidates[-1]!=cpus_per_job:
+      intra_op_candidates.append(cpus_per_job)
+  inter_op_candidates = [ int(t) for t in FLAGS.inter_op_threads.split(',') ]
+
+  print('%d jobs, cores per job: %s' % (FLAGS.num_jobs, ' '.join(cpu_config.format_cpu_list(b) for b in cpu_blocks)),
+        file=sys.stderr)
+  header = 'intra_op_threads, inter_op_threads, images_per_sec, slowest_job_images_per_sec'
+  print(header)
+  trials = []
+  for intra_op_threads, inter_op_threads in itertools.product(intra_op_candidates, inter_op_candidates):
+    throughputs = run_trial(cpu_blocks, intra_op_threads, inter_op_threads)
+    trials.append((intra_op_threads, inter_op_threads, sum(throughputs), min(throughputs)))
+    print('%d, %d, %.2f, %.2f' % trials[-1])
+    sys.stdout.flush()
+
+  if FLAGS.output_file:
+    with open(FLAGS.output_file, 'wt') as outfile:
+      print(header, file=outfile)
+      for trial in trials:
+        print('%d, %d, %.2f, %.2f' % trial, file=outfile)
+
+  best = max(trials, key=lambda trial: trial[2])
+  print('Best: --intra_op_parallelism_threads=%d --inter_op_parallelism_threads=%d '
+        '(%.2f images/sec in %d jobs)' % (best[0], best[1], best[2], FLAGS.num_jobs), file=sys.stderr)
+  for j, block in enumerate(cpu_blocks):
+    print('  job %d: --cpu_affinity=%s' % (j, cpu_config.format_cpu_list(block)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+  tf.app.run()